@@ -11,6 +11,8 @@ class App(tk.Tk):
         self.title("Military DB")
         self.geometry("600x400")
         self.db = Database()
+        # Зміни з інших робочих місць (LISTEN/NOTIFY) скидають кеші та оновлюють відкриті вікна
+        self.db.start_listener()
 
         self._current = None
         self.show_login_screen()
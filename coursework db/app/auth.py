@@ -22,7 +22,7 @@ class AuthService:
                        JOIN roles r ON r.id = k.role_id
               WHERE k.login = %s \
               """
-        rows = self.db.query(sql, [login])
+        rows = self.db.query(sql, [login], prepare=True)
         return dict(rows[0]) if rows else None
 
     def get_all_keys_unsafe(self) -> List[Dict]:
@@ -33,12 +33,14 @@ class AuthService:
         if not role: raise ValueError(f"Role '{role_name}' not found")
         role_id = role[0][0]
 
-        user_sql = 'INSERT INTO users (email, confirmed) VALUES (%s, %s) RETURNING id'
-        user_id = self.db.query(user_sql, [email, True])[0][0]
-
         pwd = self.hash_password(password)
-        keys_sql = 'INSERT INTO keys (login, password, role_id, user_id) VALUES (%s, %s, %s, %s)'
-        self.db.execute(keys_sql, [login, pwd, role_id, user_id])
+        # users + keys створюються атомарно на одному з'єднанні пулу
+        with self.db.transaction():
+            user_sql = 'INSERT INTO users (email, confirmed) VALUES (%s, %s) RETURNING id'
+            user_id = self.db.query(user_sql, [email, True])[0][0]
+
+            keys_sql = 'INSERT INTO keys (login, password, role_id, user_id) VALUES (%s, %s, %s, %s)'
+            self.db.execute(keys_sql, [login, pwd, role_id, user_id])
 
         return user_id
 
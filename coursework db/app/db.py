@@ -1,77 +1,767 @@
 import os
+import re
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 import psycopg2.extras
-from typing import Any, Iterable, Optional, Tuple, List
+from psycopg2 import sql as pgsql
+from typing import Any, Iterable, Iterator, Optional, Sequence, Tuple, List
 from dotenv import load_dotenv
 
 # ✅ Завантажуємо змінні середовища з .env
 load_dotenv()
 
 
+def _env_int(name: str, default: int) -> int:
+    """Ціле число з .env (або значення за замовчуванням)"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[list]:
+    """Розбити будь-який ітерабельний об'єкт на списки по size елементів"""
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _CopyStream:
+    """Файлоподібний потік CSV-рядків для COPY FROM STDIN (читає дані пачками)"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]], batch_size: int):
+        self._batches = _chunks(rows, batch_size)
+        self._buffer = ""
+        self.rows = 0
+
+    @staticmethod
+    def _field(value: Any) -> str:
+        # Порожнє поле без лапок — NULL, усе інше береться в лапки
+        if value is None:
+            return ""
+        return '"' + str(value).replace('"', '""') + '"'
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            self.rows += len(batch)
+            self._buffer += "".join(",".join(self._field(v) for v in row) + "\n" for row in batch)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    """Ключ статистики: SQL без коментарів, літералів і зайвих пробілів"""
+    text = re.sub(r"--[^\n]*", " ", sql)
+    text = re.sub(r"'(?:[^']|'')*'", "?", text)
+    text = re.sub(r"%\(\w+\)s|%s", "?", text)
+    text = re.sub(r"\b\d+(?:\.\d+)?\b", "?", text)
+    return " ".join(text.split()).rstrip(";").strip()
+
+
+@lru_cache(maxsize=512)
+def _server_placeholders(sql: str) -> Tuple[str, Optional[Tuple[str, ...]], int]:
+    """%s / %(name)s -> $1..$n для PREPARE. Повертає (SQL, імена параметрів або None, к-сть параметрів)"""
+    names = []
+    positional = 0
+
+    def repl(m):
+        nonlocal positional
+        if m.group(0) == "%%":
+            return "%"
+        if m.group(1):
+            if m.group(1) not in names:
+                names.append(m.group(1))
+            return f"${names.index(m.group(1)) + 1}"
+        positional += 1
+        return f"${positional}"
+
+    text = re.sub(r"%%|%\((\w+)\)s|%s", repl, sql.strip().rstrip(";"))
+    if names:
+        return text, tuple(names), len(names)
+    return text, None, positional
+
+
+_IDENT = r'"?([A-Za-z_][\w$]*)"?(?:\s*\.\s*"?([A-Za-z_][\w$]*)"?)?'
+_READ_RE = re.compile(r"\b(?:FROM|JOIN)\s+" + _IDENT, re.IGNORECASE)
+_WRITE_RE = re.compile(r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|COPY)\s+(?:ONLY\s+)?" + _IDENT,
+                       re.IGNORECASE)
+_DDL_RE = re.compile(r"^\s*(?:CREATE|ALTER|DROP|DO|CALL|GRANT|REVOKE)\b", re.IGNORECASE)
+# DDL, що не змінює даних постійних таблиць: індекси, розширення, тимчасові таблиці й функції pg_temp
+_NO_WRITE_DDL_RE = re.compile(r"^\s*CREATE\s+(?:(?:UNIQUE\s+)?INDEX|EXTENSION|(?:(?:GLOBAL|LOCAL)\s+)?TEMP(?:ORARY)?\s+TABLE"
+                              r"|(?:OR\s+REPLACE\s+)?FUNCTION\s+pg_temp\.)\b", re.IGNORECASE)
+
+
+def _table_names(regex, sql: str) -> set:
+    # schema.table -> table; для кешу схема не важлива
+    return {(m.group(2) or m.group(1)).lower() for m in regex.finditer(sql)}
+
+
+@lru_cache(maxsize=1024)
+def read_tables(sql: str) -> frozenset:
+    """Таблиці, з яких читає запит (FROM / JOIN)"""
+    return frozenset(_table_names(_READ_RE, sql))
+
+
+@lru_cache(maxsize=1024)
+def written_tables(sql: str) -> Optional[frozenset]:
+    """Таблиці, які змінює запит; None — DDL/скрипт, що може змінити що завгодно"""
+    if _NO_WRITE_DDL_RE.search(sql):
+        return frozenset()
+    if _DDL_RE.search(sql):
+        return None
+    return frozenset(_table_names(_WRITE_RE, sql))
+
+
+class ResultCache:
+    """LRU-кеш результатів SELECT з TTL; кожен запис позначений таблицями, з яких він читав"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(sql: str, params) -> Optional[tuple]:
+        if params is None:
+            frozen = None
+        elif isinstance(params, dict):
+            frozen = tuple(sorted(params.items()))
+        else:
+            frozen = tuple(params)
+        key = (sql, frozen)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, rows, tables: frozenset, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), tables, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> int:
+        """Скинути записи, що читали з tables (None — скинути все)"""
+        with self._lock:
+            if tables is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            tables = set(tables)
+            stale = [k for k, (_, tags, _) in self._entries.items() if tags & tables]
+            for k in stale:
+                del self._entries[k]
+            return len(stale)
+
+
+# Канал LISTEN/NOTIFY, в який тригери notify_row_change() пишуть зміни рядків
+NOTIFY_CHANNEL = "row_changes"
+
+
+class QueryStats:
+    """Реєстр статистики запитів: виклики, час, рядки та гістограма затримок за нормалізованим SQL"""
+
+    # Верхні межі кошиків гістограми (мс); останній кошик — усе, що повільніше
+    BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self, slow_ms: int, log_path: Optional[str]):
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._slow_log = None
+
+    def record(self, sql: str, seconds: float, rows: int = 0, error: bool = False):
+        ms = seconds * 1000
+        key = normalize_sql(sql)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = self._entries[key] = {"sql": key, "calls": 0, "errors": 0, "rows": 0,
+                                          "total_ms": 0.0, "max_ms": 0.0,
+                                          "histogram": [0] * (len(self.BUCKETS_MS) + 1)}
+            e["calls"] += 1
+            e["errors"] += int(error)
+            e["rows"] += max(rows, 0)
+            e["total_ms"] += ms
+            e["max_ms"] = max(e["max_ms"], ms)
+            idx = next((i for i, b in enumerate(self.BUCKETS_MS) if ms <= b), len(self.BUCKETS_MS))
+            e["histogram"][idx] += 1
+        if ms >= self.slow_ms:
+            self._log_slow(key, ms, rows, error)
+
+    def _log_slow(self, key: str, ms: float, rows: int, error: bool):
+        if not self.log_path:
+            return
+        if self._slow_log is None:
+            logger = logging.getLogger("db.slow_queries")
+            if not logger.handlers:
+                handler = logging.FileHandler(self.log_path, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+            self._slow_log = logger
+        status = " ERROR" if error else ""
+        self._slow_log.info(f"{ms:.1f} ms rows={rows}{status} | {key}")
+
+    def snapshot(self, order_by: str = "total_ms") -> List[dict]:
+        """Копія статистики, відсортована за спаданням order_by"""
+        with self._lock:
+            items = [dict(e, histogram=list(e["histogram"])) for e in self._entries.values()]
+        for e in items:
+            e["avg_ms"] = e["total_ms"] / e["calls"] if e["calls"] else 0.0
+        return sorted(items, key=lambda e: e[order_by], reverse=True)
+
+    def histogram_labels(self) -> List[str]:
+        return [f"≤{b}" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}"]
+
+    def dump(self) -> str:
+        """Текстовий звіт для збереження у файл"""
+        labels = self.histogram_labels()
+        lines = []
+        for e in self.snapshot():
+            hist = " ".join(f"{l}:{n}" for l, n in zip(labels, e["histogram"]) if n)
+            lines.append(f"calls={e['calls']} total={e['total_ms']:.1f}ms avg={e['avg_ms']:.1f}ms "
+                         f"max={e['max_ms']:.1f}ms rows={e['rows']} errors={e['errors']} [{hist}]\n    {e['sql']}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class Database:
-    def __init__(self):
-        self._conn = None
+    def __init__(self, min_connections: Optional[int] = None, max_connections: Optional[int] = None):
+        # Пул з'єднань: кожен виклик бере з'єднання з пулу і повертає його назад
+        self.min_connections = max(1, min_connections or _env_int("DB_POOL_MIN", 1))
+        self.max_connections = max(self.min_connections, max_connections or _env_int("DB_POOL_MAX", 5))
+        # З'єднання, що простоювало довше за цей інтервал, перевіряється перед видачею
+        self.ping_interval = _env_int("DB_POOL_PING_SEC", 30)
+        # Розмір пачки для потокового читання (query_iter)
+        self.iter_batch_size = _env_int("DB_ITER_BATCH", 2000)
+        # Розмір пачки для масового запису (execute_many / bulk_insert / copy_from)
+        self.write_batch_size = _env_int("DB_WRITE_BATCH", 1000)
+        # Статистика запитів і журнал повільних запитів
+        self.stats = QueryStats(_env_int("DB_SLOW_QUERY_MS", 200), os.getenv("DB_SLOW_QUERY_LOG", "slow_queries.log"))
+
+        # Власний пул: до max_connections з'єднань, простої з'єднання не закриваються,
+        # тож серверний стан (підготовлені запити) живе між викликами
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._last_used = {}
+        self._local = threading.local()
+        # Видані з'єднання за потоками — для скасування запиту з іншого потоку
+        self._active = {}
+        self._active_lock = threading.Lock()
+        # Підготовлені запити: id(conn) -> OrderedDict(sql -> ім'я PREPARE), LRU на кожне з'єднання
+        self.prepared_cache_size = _env_int("DB_PREPARED_CACHE", 64)
+        self._prepared = {}
+        # Кеш результатів довідкових запитів (query_cached) з інвалідацією за таблицями
+        self.cache = ResultCache(_env_int("DB_CACHE_SIZE", 256), _env_int("DB_CACHE_TTL_SEC", 300))
+        # Залежні таблиці: зміна ключа -> які таблиці теж змінюються (ON DELETE CASCADE/SET NULL, тригери)
+        self.table_dependents = {}
+        self._fk_loaded = False
+        self._invalidation_listeners = []
+        # Слухач NOTIFY: окреме autocommit-з'єднання у фоновому потоці
+        self._subscribers = {}
+        self._subscribers_lock = threading.Lock()
+        self._listener_thread = None
+        self._listener_stop = threading.Event()
+
+    @staticmethod
+    def _connect_params() -> dict:
+        return dict(
+            host=os.getenv("DB_HOST"),
+            port=int(os.getenv("DB_PORT")),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+        )
+
+    def _open(self):
+        try:
+            conn = psycopg2.connect(cursor_factory=psycopg2.extras.DictCursor, **self._connect_params())
+            # print(f"✅ Підключено до БД '{os.getenv('DB_NAME')}'")
+        except Exception as e:
+            print(f"❌ Помилка підключення до БД: {e}")
+            raise
+        with self._pool_lock:
+            self._opened += 1
+        return conn
 
     def connect(self):
-        """Підключення до бази даних PostgreSQL"""
-        if self._conn is None or self._conn.closed:
-            try:
-                self._conn = psycopg2.connect(
-                    host=os.getenv("DB_HOST"),
-                    port=int(os.getenv("DB_PORT")),
-                    database=os.getenv("DB_NAME"),
-                    user=os.getenv("DB_USER"),
-                    password=os.getenv("DB_PASSWORD"),
-                    cursor_factory=psycopg2.extras.DictCursor
-                )
-                # print(f"✅ Підключено до БД '{os.getenv('DB_NAME')}'")
-            except Exception as e:
-                print(f"❌ Помилка підключення до БД: {e}")
-                raise
-        return self._conn
+        """Підключення до бази даних PostgreSQL (відкриває DB_POOL_MIN з'єднань пулу)"""
+        with self._pool_lock:
+            self._closed = False
+            missing = self.min_connections - self._opened
+        for _ in range(max(missing, 0)):
+            conn = self._open()
+            with self._pool_lock:
+                self._idle.append(conn)
+            self._last_used[id(conn)] = time.monotonic()
 
-    def query(self, sql: str, params: Optional[Iterable[Any]] = None):
-        """Виконати SELECT-запит і повернути результат"""
-        conn = self.connect()
+    # =====================================================
+    # ПУЛ З'ЄДНАНЬ (checkout / checkin)
+    # =====================================================
+    def _is_alive(self, conn) -> bool:
+        """Health-check з'єднання перед видачею з пулу"""
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle < self.ping_interval:
+            return True
         try:
             with conn.cursor() as cur:
-                cur.execute(sql, params)
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _discard(self, conn):
+        """Закрити з'єднання і забути все, що з ним пов'язано"""
+        self._last_used.pop(id(conn), None)
+        self._prepared.pop(id(conn), None)
+        with self._pool_lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout(self):
+        """Взяти робоче з'єднання з пулу (блокує, якщо всі зайняті)"""
+        if self._closed:
+            self.connect()
+        self._slots.acquire()
+        try:
+            for _ in range(self.max_connections + 1):
+                with self._pool_lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._open()
+                elif not self._is_alive(conn):
+                    self._discard(conn)
+                    continue
+                with self._active_lock:
+                    self._active[id(conn)] = (threading.get_ident(), conn)
+                return conn
+            raise psycopg2.OperationalError("Не вдалося отримати робоче з'єднання з пулу")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn):
+        """Повернути з'єднання в пул (незавершена транзакція відкочується)"""
+        with self._active_lock:
+            self._active.pop(id(conn), None)
+        try:
+            broken = bool(conn.closed)
+            if not broken and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
                 try:
-                    rows = cur.fetchall()
-                    return rows
-                except psycopg2.ProgrammingError:
-                    return []
-        except Exception as e:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                with self._pool_lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def _connection(self):
+        """З'єднання для одного виклику (або поточної транзакції цього потоку)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    def cancel_thread(self, thread_id: int) -> int:
+        """Скасувати запити, що зараз виконуються на з'єднаннях потоку thread_id.
+        connection.cancel() — клієнтський аналог pg_cancel_backend() для свого бекенду."""
+        with self._active_lock:
+            conns = [conn for owner, conn in self._active.values() if owner == thread_id]
+        for conn in conns:
+            try:
+                conn.cancel()
+            except psycopg2.Error:
+                pass
+        return len(conns)
+
+    def _in_transaction(self) -> bool:
+        return getattr(self._local, "tx_depth", 0) > 0
+
+    def _finish(self, conn, ok: bool):
+        """Commit/rollback після одиночного виклику (всередині transaction() — нічого)"""
+        if self._in_transaction():
+            return
+        if ok:
+            conn.commit()
+        else:
             conn.rollback()  # ⬅️ ВАЖЛИВО: Відкочуємо транзакцію при помилці
-            raise e
+
+    @contextmanager
+    def transaction(self):
+        """Кілька викликів query/execute в одній транзакції на одному з'єднанні"""
+        with self._connection() as conn:
+            self._local.tx_depth = getattr(self._local, "tx_depth", 0) + 1
+            try:
+                yield conn
+            except Exception:
+                self._local.tx_depth -= 1
+                if not self._in_transaction():
+                    conn.rollback()
+                raise
+            else:
+                self._local.tx_depth -= 1
+                if not self._in_transaction():
+                    conn.commit()
+            finally:
+                # Повторна інвалідація після commit/rollback: поки транзакція йшла,
+                # інший потік міг покласти в кеш ще старі дані
+                if not self._in_transaction():
+                    pending = getattr(self._local, "tx_written", None)
+                    self._local.tx_written = None
+                    if pending:
+                        self._invalidate(None if None in pending else pending)
+
+    # =====================================================
+    # КЕШ РЕЗУЛЬТАТІВ І ІНВАЛІДАЦІЯ
+    # =====================================================
+    def add_invalidation_listener(self, callback):
+        """callback(tables) викликається після змін у таблицях (tables=None — змінилось будь-що)"""
+        self._invalidation_listeners.append(callback)
+
+    def remove_invalidation_listener(self, callback):
+        if callback in self._invalidation_listeners:
+            self._invalidation_listeners.remove(callback)
+
+    def _load_table_dependents(self):
+        """Граф каскадних FK із каталогу: видалення в батьківській таблиці змінює дочірні"""
+        self._fk_loaded = True
+        try:
+            rows = self.query("""
+                SELECT c.confrelid::regclass::text AS parent, c.conrelid::regclass::text AS child
+                FROM pg_constraint c
+                WHERE c.contype = 'f' AND (c.confdeltype IN ('c', 'n', 'd') OR c.confupdtype IN ('c', 'n', 'd'))
+            """)
+        except psycopg2.Error:
+            return
+        for r in rows:
+            parent = r["parent"].split(".")[-1].strip('"').lower()
+            child = r["child"].split(".")[-1].strip('"').lower()
+            self.table_dependents.setdefault(parent, set()).add(child)
+
+    def _expand_tables(self, tables: Iterable[str]) -> set:
+        result, todo = set(), list(tables)
+        while todo:
+            t = todo.pop()
+            if t in result:
+                continue
+            result.add(t)
+            todo.extend(self.table_dependents.get(t, ()))
+        return result
+
+    def _invalidate(self, tables: Optional[Iterable[str]]):
+        expanded = None if tables is None else self._expand_tables(tables)
+        self.cache.invalidate(expanded)
+        for callback in list(self._invalidation_listeners):
+            try:
+                callback(expanded)
+            except Exception as e:
+                print(f"Invalidation listener error: {e}")
+
+    def _note_write(self, tables: Optional[Iterable[str]]):
+        """Зафіксувати запис у таблиці tables (None — невідомо які, скинути все)"""
+        if tables is not None:
+            tables = set(tables)
+            if not tables:
+                return
+        self._invalidate(tables)
+        if self._in_transaction():
+            pending = getattr(self._local, "tx_written", None) or set()
+            if tables is None:
+                pending.add(None)
+            else:
+                pending |= tables
+            self._local.tx_written = pending
+
+    def query_cached(self, sql: str, params: Optional[Iterable[Any]] = None, *,
+                     tables: Optional[Iterable[str]] = None, ttl: Optional[float] = None, prepare: bool = False):
+        """SELECT через кеш результатів (TTL + LRU). tables — теги інвалідації;
+        за замовчуванням це таблиці з FROM/JOIN запиту. Повернені рядки не можна змінювати."""
+        if not self._fk_loaded:
+            self._load_table_dependents()
+        key = ResultCache.make_key(sql, params)
+        if key is not None:
+            rows = self.cache.get(key)
+            if rows is not None:
+                return rows
+        rows = self.query(sql, params, prepare=prepare)
+        if key is not None:
+            tags = frozenset(t.lower() for t in tables) if tables is not None else read_tables(sql)
+            self.cache.put(key, rows, tags, ttl)
+        return rows
+
+    # =====================================================
+    # ЗАПИТИ
+    # =====================================================
+    def _execute_prepared(self, conn, cur, sql: str, params):
+        """PREPARE при першому використанні на цьому з'єднанні, далі лише EXECUTE"""
+        cache = self._prepared.setdefault(id(conn), OrderedDict())
+        server_sql, names, count = _server_placeholders(sql)
+        name = cache.get(sql)
+        if name is None:
+            name = f"ps_{uuid.uuid4().hex[:16]}"
+            cur.execute(f"PREPARE {name} AS {server_sql}")
+            cache[sql] = name
+            if len(cache) > self.prepared_cache_size:
+                _, evicted = cache.popitem(last=False)
+                cur.execute(f"DEALLOCATE {evicted}")
+        else:
+            cache.move_to_end(sql)
+
+        if names is not None:
+            values = [params[n] for n in names]
+        else:
+            values = list(params or [])[:count]
+        try:
+            if values:
+                cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(values))})", values)
+            else:
+                cur.execute(f"EXECUTE {name}")
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Хтось виконав DEALLOCATE/DISCARD на цьому з'єднанні — підготуємо заново наступного разу
+            cache.pop(sql, None)
+            raise
+
+    def query(self, sql: str, params: Optional[Iterable[Any]] = None, *, prepare: bool = False):
+        """Виконати SELECT-запит і повернути результат.
+        prepare=True — використати підготовлений запит (для часто повторюваних SQL)."""
+        with self._connection() as conn:
+            start = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    if prepare and self.prepared_cache_size > 0:
+                        self._execute_prepared(conn, cur, sql, params)
+                    else:
+                        cur.execute(sql, params)
+                    try:
+                        rows = cur.fetchall()
+                    except psycopg2.ProgrammingError:
+                        rows = []
+                self._finish(conn, True)
+                self.stats.record(sql, time.perf_counter() - start, len(rows))
+                self._note_write(written_tables(sql))
+                return rows
+            except Exception as e:
+                self.stats.record(sql, time.perf_counter() - start, error=True)
+                self._finish(conn, False)
+                raise e
 
     def query_with_columns(self, sql: str, params: Optional[Iterable[Any]] = None) -> Tuple[List[str], list]:
         """Виконати SELECT-запит і повернути (імена колонок, дані)"""
-        conn = self.connect()
+        with self._connection() as conn:
+            start = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    try:
+                        rows = cur.fetchall()
+                        cols = [desc.name for desc in cur.description]
+                    except psycopg2.ProgrammingError:
+                        cols, rows = [], []
+                self._finish(conn, True)
+                self.stats.record(sql, time.perf_counter() - start, len(rows))
+                self._note_write(written_tables(sql))
+                return cols, rows
+            except Exception as e:
+                self.stats.record(sql, time.perf_counter() - start, error=True)
+                self._finish(conn, False)  # ⬅️ ВАЖЛИВО
+                raise e
+
+    def _iter_rows(self, sql: str, params: Optional[Iterable[Any]], batch_size: Optional[int]):
+        """Серверний курсор: спершу віддає імена колонок, далі рядки пачками"""
+        batch_size = batch_size or self.iter_batch_size
+        # DECLARE ... CURSOR FOR не приймає ';' в кінці запиту
+        sql = sql.strip().rstrip(";")
+        # Генератор може жити між іншими викликами цього потоку, тому власне з'єднання
+        # не реєструється як поточне (інакше чужий commit закрив би курсор)
+        tx_conn = getattr(self._local, "conn", None)
+        conn = tx_conn or self._checkout()
+        ok = False
+        # У статистику йде лише час роботи БД, без часу обробки рядків споживачем
+        db_time, total = 0.0, 0
         try:
-            with conn.cursor() as cur:
+            with conn.cursor(name=f"iter_{uuid.uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                start = time.perf_counter()
                 cur.execute(sql, params)
+                rows = cur.fetchmany(batch_size)
+                db_time += time.perf_counter() - start
+                yield [desc.name for desc in cur.description] if cur.description else []
+                while rows:
+                    total += len(rows)
+                    yield from rows
+                    start = time.perf_counter()
+                    rows = cur.fetchmany(batch_size)
+                    db_time += time.perf_counter() - start
+            ok = True
+        finally:
+            self.stats.record(sql, db_time, total, error=not ok)
+            if tx_conn is None:
                 try:
-                    rows = cur.fetchall()
-                    cols = [desc.name for desc in cur.description]
-                    return cols, rows
-                except psycopg2.ProgrammingError:
-                    return [], []
-        except Exception as e:
-            conn.rollback()  # ⬅️ ВАЖЛИВО
-            raise e
+                    if ok:
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                finally:
+                    self._checkin(conn)
+
+    def query_iter(self, sql: str, params: Optional[Iterable[Any]] = None,
+                   batch_size: Optional[int] = None) -> Iterator:
+        """Генератор рядків SELECT-запиту (пам'ять не залежить від розміру результату)"""
+        rows = self._iter_rows(sql, params, batch_size)
+        next(rows)
+        yield from rows
+
+    def query_iter_with_columns(self, sql: str, params: Optional[Iterable[Any]] = None,
+                                batch_size: Optional[int] = None) -> Tuple[List[str], Iterator]:
+        """Як query_iter, але одразу повертає (імена колонок, генератор рядків)"""
+        rows = self._iter_rows(sql, params, batch_size)
+        cols = next(rows)
+        return cols, rows
 
     def execute(self, sql: str, params: Optional[Iterable[Any]] = None) -> int:
         """Виконати INSERT/UPDATE/DELETE"""
-        conn = self.connect()
+        with self._connection() as conn:
+            start = time.perf_counter()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    count = cur.rowcount
+                self._finish(conn, True)
+                self.stats.record(sql, time.perf_counter() - start, count)
+                self._note_write(written_tables(sql))
+                return count
+            except Exception as e:
+                self.stats.record(sql, time.perf_counter() - start, error=True)
+                self._finish(conn, False)  # ⬅️ ВАЖЛИВО: Якщо запис не вдався, скасовуємо зміни
+                raise e
+
+    # =====================================================
+    # МАСОВИЙ ЗАПИС (одна транзакція на весь пакет)
+    # =====================================================
+    @contextmanager
+    def _recorded(self, sql: str, start: float, rows):
+        """Записати в статистику пакетну операцію (rows — функція, що повертає к-сть рядків)"""
+        ok = False
         try:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-                conn.commit()
-                return cur.rowcount
-        except Exception as e:
-            conn.rollback()  # ⬅️ ВАЖЛИВО: Якщо запис не вдався, скасовуємо зміни
-            raise e
+            yield
+            ok = True
+        finally:
+            self.stats.record(sql, time.perf_counter() - start, rows(), error=not ok)
+
+    def execute_many(self, sql: str, params_seq: Iterable[Iterable[Any]], batch_size: Optional[int] = None) -> int:
+        """Виконати INSERT/UPDATE/DELETE для багатьох наборів параметрів (execute_batch).
+        Повертає кількість виконаних наборів параметрів."""
+        batch_size = batch_size or self.write_batch_size
+        total = 0
+        start = time.perf_counter()
+        with self._recorded(sql, start, lambda: total):
+            with self.transaction() as conn:
+                with conn.cursor() as cur:
+                    for chunk in _chunks(params_seq, batch_size):
+                        psycopg2.extras.execute_batch(cur, sql, chunk, page_size=batch_size)
+                        total += len(chunk)
+                self._note_write(written_tables(sql))
+        return total
+
+    def bulk_insert(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]],
+                    batch_size: Optional[int] = None) -> int:
+        """Вставити багато рядків через execute_values. Повертає кількість вставлених рядків."""
+        batch_size = batch_size or self.write_batch_size
+        stmt = pgsql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            pgsql.Identifier(table), pgsql.SQL(", ").join(map(pgsql.Identifier, columns)))
+        total = 0
+        start = time.perf_counter()
+        with self._recorded(f"BULK INSERT INTO {table}", start, lambda: total):
+            with self.transaction() as conn:
+                with conn.cursor() as cur:
+                    query = stmt.as_string(conn)
+                    for chunk in _chunks(rows, batch_size):
+                        psycopg2.extras.execute_values(cur, query, chunk, page_size=len(chunk))
+                        total += cur.rowcount
+                self._note_write({table.lower()})
+        return total
+
+    def copy_from(self, table: str, rows: Iterable[Sequence[Any]], columns: Optional[Sequence[str]] = None,
+                  batch_size: Optional[int] = None) -> int:
+        """Завантажити рядки через COPY ... FROM STDIN (CSV). Повертає кількість рядків."""
+        batch_size = batch_size or self.write_batch_size
+        target = pgsql.Identifier(table)
+        if columns:
+            target = pgsql.SQL("{} ({})").format(target, pgsql.SQL(", ").join(map(pgsql.Identifier, columns)))
+        stmt = pgsql.SQL("COPY {} FROM STDIN WITH (FORMAT csv)").format(target)
+        stream = _CopyStream(rows, batch_size)
+        start = time.perf_counter()
+        with self._recorded(f"COPY {table} FROM STDIN", start, lambda: stream.rows):
+            with self.transaction() as conn:
+                with conn.cursor() as cur:
+                    cur.copy_expert(stmt.as_string(conn), stream, size=65536)
+                self._note_write({table.lower()})
+                return cur.rowcount if cur.rowcount >= 0 else stream.rows
 
     def execute_file(self, filepath: str):
         """Виконує SQL-скрипт із вказаного файлу."""
@@ -86,23 +776,109 @@ class Database:
              print(f"❌ Помилка читання файлу '{filepath}': {e}")
              return
 
-        conn = self.connect()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql_script)
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql_script)
                 conn.commit()
+                self._note_write(None)
                 print(f"✅ Скрипт '{filepath}' успішно виконано!")
-        except Exception as e:
-            conn.rollback()  # ⬅️ ВАЖЛИВО
-            print(f"❌ Помилка при виконанні SQL з '{filepath}':\n{e}")
+            except Exception as e:
+                conn.rollback()  # ⬅️ ВАЖЛИВО
+                print(f"❌ Помилка при виконанні SQL з '{filepath}':\n{e}")
+
+    # =====================================================
+    # LISTEN / NOTIFY: зміни з інших сесій
+    # =====================================================
+    def subscribe(self, callback, tables: Optional[Iterable[str]] = None):
+        """callback(event) на кожну зміну рядка в tables (None — у всіх таблицях).
+        event = {"table", "op", "id", "pid"}; op == "RESYNC" після перепідключення слухача
+        (частина подій могла загубитися). Викликається у фоновому потоці. Повертає токен для unsubscribe."""
+        token = object()
+        with self._subscribers_lock:
+            self._subscribers[token] = (callback, None if tables is None else frozenset(tables))
+        return token
+
+    def unsubscribe(self, token):
+        with self._subscribers_lock:
+            self._subscribers.pop(token, None)
+
+    def start_listener(self):
+        """Запустити фоновий потік LISTEN row_changes (повторний виклик нічого не робить)"""
+        if self._listener_thread is not None and self._listener_thread.is_alive():
+            return
+        self._listener_stop.clear()
+        self._listener_thread = threading.Thread(target=self._listen_loop, name="db-listener", daemon=True)
+        self._listener_thread.start()
+
+    def stop_listener(self):
+        self._listener_stop.set()
+        thread, self._listener_thread = self._listener_thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2)
+
+    def _listen_loop(self):
+        delay = 1
+        first = True
+        while not self._listener_stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._connect_params())
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                delay = 1
+                if not first:
+                    # Поки слухача не було, події губилися — скидаємо все
+                    self._dispatch({"table": None, "op": "RESYNC", "id": None, "pid": None})
+                first = False
+                while not self._listener_stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        try:
+                            event = json.loads(n.payload)
+                        except ValueError:
+                            continue
+                        event["pid"] = n.pid
+                        self._dispatch(event)
+            except Exception as e:
+                if not self._listener_stop.is_set():
+                    print(f"⚠️ Слухач змін БД: {e}; перепідключення через {delay} с")
+                    self._listener_stop.wait(delay)
+                    delay = min(delay * 2, 30)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def _dispatch(self, event: dict):
+        table = event.get("table")
+        # Зміна з іншої сесії: кеші скидаються так само, як після власного запису
+        self._invalidate(None if table is None else {table})
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers.values())
+        for callback, tables in subscribers:
+            if tables is not None and table is not None and table not in tables:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Subscriber error: {e}")
 
     def close(self):
-        """Закрити підключення"""
-        if self._conn is not None and not self._conn.closed:
-            self._conn.close()
-            self._conn = None
-            print("🔒 Підключення до БД закрито")
+        """Закрити всі підключення пулу"""
+        if not hasattr(self, "_idle") or self._closed:
+            return
+        self._closed = True
+        self.stop_listener()
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+        print("🔒 Підключення до БД закрито")
 
     def __del__(self):
         """Автоматичне закриття при видаленні об’єкта"""
-        self.close()
\ No newline at end of file
+        self.close()
@@ -0,0 +1,308 @@
+import csv
+import os
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from lookups import source_sql
+
+STAGING_TABLE = "import_staging"
+RESOLVED_TABLE = "import_resolved"
+
+# Перевірка, чи приводиться текст до типу колонки (без падіння всього INSERT на одному рядку)
+_CASTABLE_FN = """
+    CREATE OR REPLACE FUNCTION pg_temp.import_castable(val text, typ text) RETURNS boolean AS $$
+    BEGIN
+        EXECUTE format('SELECT %L::' || typ, val);
+        RETURN true;
+    EXCEPTION WHEN others THEN
+        RETURN false;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+# =====================================================
+# ЧИТАННЯ ФАЙЛІВ
+# =====================================================
+def _cell(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, datetime) and value.time() == datetime.min.time():
+        value = value.date()
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    text = str(value).strip()
+    return text or None
+
+
+def _read_csv(path: str) -> Tuple[List[str], Iterator[list]]:
+    f = open(path, newline="", encoding="utf-8-sig")
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(f, dialect)
+    header = next(reader, [])
+
+    def rows():
+        with f:
+            for row in reader:
+                yield [_cell(v) for v in row]
+    return header, rows()
+
+
+def _read_xlsx(path: str) -> Tuple[List[str], Iterator[list]]:
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("Для імпорту XLSX встановіть пакет openpyxl (pip install openpyxl) або збережіть файл як CSV")
+    book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    sheet_rows = book.active.iter_rows(values_only=True)
+    header = [_cell(v) or "" for v in next(sheet_rows, ())]
+
+    def rows():
+        try:
+            for row in sheet_rows:
+                yield [_cell(v) for v in row]
+        finally:
+            book.close()
+    return header, rows()
+
+
+def read_table_file(path: str) -> Tuple[List[str], Iterator[list]]:
+    """(заголовок, ітератор рядків) CSV або XLSX-файлу; значення — рядки або None"""
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm"):
+        return _read_xlsx(path)
+    return _read_csv(path)
+
+
+# =====================================================
+# ІМПОРТ
+# =====================================================
+class ImportResult:
+    def __init__(self, inserted: int, rejected: List[Dict[str, Any]], ignored: List[str]):
+        self.inserted = inserted
+        self.rejected = rejected      # [{"line": №, "errors": "...", <поле>: значення з файлу}]
+        self.ignored = ignored        # колонки файлу, яких немає серед полів сутності
+
+    def write_rejects(self, path: str, fields: Sequence[str]):
+        """Звіт про відхилені рядки: номер рядка файлу, причина, початкові значення"""
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "errors"] + list(fields))
+            for r in self.rejected:
+                writer.writerow([r["line"], r["errors"]] + [r.get(name) for name in fields])
+
+
+class EntityImporter:
+    """Масовий імпорт CSV/XLSX у таблицю сутності CRUD за її метаданими "fields".
+
+    Файл потоково заливається через COPY у тимчасову таблицю, combo-поля (звання, номери частин...)
+    перетворюються на id одним JOIN-ом з довідником (за id або за підписом), перевірки
+    (обов'язковість, тип, довжина, неоднозначність) виконуються одним запитом для всіх рядків,
+    UNIQUE і CHECK обмеження таблиці — кількома запитами над усім файлом, а коректні рядки
+    вставляються одним INSERT ... SELECT. Якщо INSERT усе ж відхилить БД (тригери бізнес-правил,
+    наприклад звання командира), рядки вставляються по одному під SAVEPOINT, і відхиляються лише
+    ті, на яких БД повідомила помилку."""
+
+    def __init__(self, db, config: Dict[str, Any]):
+        self.db = db
+        self.config = config
+        self.table = config["table"]
+        self.fields = [f for f in config["fields"]]
+
+    # --- відповідність колонок файлу полям ---
+    @staticmethod
+    def _norm(text: str) -> str:
+        return re.sub(r"[\s*]+", " ", str(text or "")).strip().lower()
+
+    def map_header(self, header: Sequence[str]) -> Tuple[Dict[int, str], List[str]]:
+        """{номер колонки файлу: поле} за назвою поля або його підписом; + невідомі колонки"""
+        names = {}
+        for f in self.fields:
+            names[self._norm(f["name"])] = f["name"]
+            names[self._norm(f["label"])] = f["name"]
+        mapping, ignored = {}, []
+        for i, title in enumerate(header):
+            name = names.get(self._norm(title))
+            if name and name not in mapping.values():
+                mapping[i] = name
+            elif title:
+                ignored.append(str(title))
+        return mapping, ignored
+
+    def _column_types(self) -> Dict[str, Tuple[str, str, Optional[int]]]:
+        rows = self.db.query_cached("""
+            SELECT c.column_name, c.data_type, c.character_maximum_length,
+                   format_type(a.atttypid, a.atttypmod) AS sql_type
+            FROM information_schema.columns c
+                     JOIN pg_attribute a ON a.attrelid = c.table_name::regclass AND a.attname = c.column_name
+            WHERE c.table_schema = current_schema() AND c.table_name = %s
+        """, [self.table], tables=["information_schema.columns"])
+        return {r["column_name"]: (r["sql_type"], r["data_type"], r["character_maximum_length"]) for r in rows}
+
+    def _constraints(self) -> List[Dict[str, Any]]:
+        """UNIQUE / PRIMARY KEY і CHECK обмеження таблиці: тип, колонки, вираз CHECK"""
+        return self.db.query_cached("""
+            SELECT c.conname, c.contype, pg_get_expr(c.conbin, c.conrelid) AS expression,
+                   ARRAY(SELECT a.attname::text
+                         FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, pos)
+                                  JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+                         ORDER BY k.pos) AS columns
+            FROM pg_constraint c
+            WHERE c.conrelid = %s::regclass AND c.contype IN ('p', 'u', 'c')
+            ORDER BY c.conname
+        """, [self.table], tables=["pg_constraint"])
+
+    # --- SQL перевірки і перетворення ---
+    def _resolve_sql(self, columns: Sequence[str]) -> Tuple[str, list]:
+        """SELECT line_no, <значення полів>, errors FROM staging з JOIN-ами довідників (для всіх рядків разом)"""
+        types = self._column_types()
+        selects, select_params, joins, checks = [], [], [], []
+        for i, f in enumerate(self.fields):
+            name = f["name"]
+            raw = f"st.{name}" if name in columns else "NULL::text"
+            sql_type, data_type, max_len = types.get(name, ("text", "text", None))
+
+            if f["type"] == "combo" and (f.get("source") or f.get("custom_query")):
+                lookup = f.get("custom_query") or source_sql(f["source"], f.get("source_display", "name"))
+                lookup = lookup.strip().rstrip(";")
+                # Значення з файлу — або id, або підпис із довідника (без урахування регістру)
+                joins.append(f"LEFT JOIN ({lookup}) AS by_id_{i} "
+                             f"ON by_id_{i}.id = CASE WHEN {raw} ~ '^\\d+$' THEN {raw}::bigint END")
+                joins.append(f"LEFT JOIN (SELECT lower(d_val::text) AS label, min(id) AS id, count(*) AS n "
+                             f"FROM ({lookup}) AS lk GROUP BY 1) AS by_label_{i} ON by_label_{i}.label = lower({raw})")
+                value = f"COALESCE(by_id_{i}.id, by_label_{i}.id)"
+                checks.append((f"{raw} IS NOT NULL AND by_id_{i}.id IS NULL AND by_label_{i}.n > 1", [],
+                               f"{f['label']}: неоднозначне значення"))
+                checks.append((f"{raw} IS NOT NULL AND {value} IS NULL", [],
+                               f"{f['label']}: не знайдено в довіднику"))
+            elif data_type in ("text", "character varying", "character"):
+                value = raw
+                if max_len:
+                    checks.append((f"length({raw}) > {int(max_len)}", [],
+                                   f"{f['label']}: довше за {int(max_len)} символів"))
+            else:
+                value = f"CASE WHEN pg_temp.import_castable({raw}, %s) THEN {raw} END"
+                select_params.append(sql_type)
+                checks.append((f"{raw} IS NOT NULL AND NOT pg_temp.import_castable({raw}, %s)", [sql_type],
+                               f"{f['label']}: некоректне значення"))
+            if f.get("required"):
+                checks.append((f"{raw} IS NULL", [], f"{f['label']}: обов'язкове поле"))
+            selects.append(f"{value} AS {name}")
+
+        error_params = []
+        for _, cond_params, message in checks:
+            error_params += cond_params + [message]
+        errors = ("array_remove(ARRAY[" + ", ".join(f"CASE WHEN {cond} THEN %s END" for cond, _, _ in checks)
+                  + "]::text[], NULL)") if checks else "'{}'::text[]"
+
+        sql = (f"SELECT st.line_no, {', '.join(selects)}, {errors} AS errors "
+               f"FROM {STAGING_TABLE} st {' '.join(joins)}")
+        return sql, select_params + error_params
+
+    # --- виконання ---
+    def run(self, path: str) -> ImportResult:
+        header, rows = read_table_file(path)
+        mapping, ignored = self.map_header(header)
+        if not mapping:
+            raise ValueError("У файлі немає жодної колонки, що відповідає полям таблиці "
+                             "(заголовки мають збігатися з назвами полів форми)")
+        columns = list(mapping.values())
+        positions = list(mapping)
+
+        def staged():
+            # line_no — номер рядка у файлі (рядок 1 — заголовок)
+            for line_no, row in enumerate(rows, start=2):
+                if not any(row):
+                    continue
+                yield [line_no] + [row[p] if p < len(row) else None for p in positions]
+
+        with self.db.transaction():
+            self.db.execute(f"CREATE TEMP TABLE {STAGING_TABLE} (line_no int, "
+                            + ", ".join(f"{c} text" for c in columns) + ") ON COMMIT DROP")
+            self.db.copy_from(STAGING_TABLE, staged(), ["line_no"] + columns)
+            self.db.execute(_CASTABLE_FN)
+
+            resolve_sql, params = self._resolve_sql(columns)
+            self.db.execute(f"CREATE TEMP TABLE {RESOLVED_TABLE} ON COMMIT DROP AS {resolve_sql}", params)
+
+            names = [f["name"] for f in self.fields if f["name"] in columns]
+            types = self._column_types()
+            self._check_constraints(names, types)
+
+            casts = ", ".join(f"{n}::{types[n][0]}" if n in types else n for n in names)
+            insert_sql = (f"INSERT INTO {self.table} ({', '.join(names)}) "
+                          f"SELECT {casts} FROM {RESOLVED_TABLE} WHERE cardinality(errors) = 0")
+            self.db.execute("SAVEPOINT import_insert")
+            try:
+                inserted = self.db.execute(insert_sql + " ORDER BY line_no")
+            except Exception:
+                self.db.execute("ROLLBACK TO SAVEPOINT import_insert")
+                inserted = self._insert_by_row(insert_sql)
+            self.db.execute("RELEASE SAVEPOINT import_insert")
+
+            rejected = self.db.query(f"""
+                SELECT r.line_no, array_to_string(r.errors, '; ') AS errors, {', '.join(f'st.{c}' for c in columns)}
+                FROM {RESOLVED_TABLE} r JOIN {STAGING_TABLE} st ON st.line_no = r.line_no
+                WHERE cardinality(r.errors) > 0
+                ORDER BY r.line_no
+            """)
+
+        rejected = [dict(r, line=r["line_no"]) for r in rejected]
+        return ImportResult(inserted, rejected, ignored)
+
+    def _reject(self, lines_sql: str, message: str, params: Sequence[Any] = ()):
+        """Додати помилку message рядкам, номери яких повертає lines_sql"""
+        self.db.execute(f"UPDATE {RESOLVED_TABLE} SET errors = errors || %s::text "
+                        f"WHERE line_no IN ({lines_sql})", [message] + list(params))
+
+    def _check_constraints(self, names: Sequence[str], types: Dict[str, Tuple[str, str, Optional[int]]]):
+        """UNIQUE і CHECK обмеження для всіх коректних рядків разом, до INSERT.
+
+        Перевіряються лише обмеження, всі колонки яких є у файлі: решта колонок отримає
+        значення за замовчуванням, яке тут невідоме."""
+        labels = {f["name"]: f["label"] for f in self.fields}
+        # Коректні рядки з уже приведеними типами — так, як їх побачить INSERT
+        typed = (f"(SELECT line_no, " + ", ".join(f"{n}::{types[n][0]} AS {n}" if n in types else n for n in names)
+                 + f" FROM {RESOLVED_TABLE} WHERE cardinality(errors) = 0)")
+        for con in self._constraints():
+            cols = list(con["columns"])
+            if not cols or not set(cols) <= set(names):
+                continue
+            title = ", ".join(labels.get(c, c) for c in cols)
+            if con["contype"] == "c":
+                # NOT (NULL) — не порушення, як і в самому CHECK
+                self._reject(f"SELECT line_no FROM {typed} AS t WHERE NOT ({con['expression'].replace('%', '%%')})",
+                             f"{title}: порушено обмеження {con['conname']}")
+                continue
+            key = ", ".join(cols)
+            not_null = " AND ".join(f"t.{c} IS NOT NULL" for c in cols)
+            self._reject(f"SELECT t.line_no FROM {typed} AS t JOIN {self.table} USING ({key})",
+                         f"{title}: такий запис уже існує")
+            # Повтори всередині файлу: перший рядок лишається, решта відхиляються
+            self._reject(f"SELECT unnest(lines[2:]) FROM (SELECT array_agg(t.line_no ORDER BY t.line_no) AS lines "
+                         f"FROM {typed} AS t WHERE {not_null} GROUP BY {key} HAVING count(*) > 1) AS d",
+                         f"{title}: повторює попередній рядок файлу")
+
+    def _insert_by_row(self, insert_sql: str) -> int:
+        """Вставка коректних рядків по одному під SAVEPOINT; помилка БД потрапляє у звіт рядка"""
+        inserted = 0
+        lines = self.db.query(f"SELECT line_no FROM {RESOLVED_TABLE} WHERE cardinality(errors) = 0 ORDER BY line_no")
+        for r in lines:
+            self.db.execute("SAVEPOINT import_row")
+            try:
+                inserted += self.db.execute(insert_sql + " AND line_no = %s", [r["line_no"]])
+            except Exception as e:
+                self.db.execute("ROLLBACK TO SAVEPOINT import_row")
+                message = getattr(getattr(e, "diag", None), "message_primary", None) or str(e).strip()
+                self.db.execute(f"UPDATE {RESOLVED_TABLE} SET errors = errors || %s::text WHERE line_no = %s",
+                                [message, r["line_no"]])
+            else:
+                self.db.execute("RELEASE SAVEPOINT import_row")
+        return inserted
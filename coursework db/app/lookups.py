@@ -0,0 +1,153 @@
+import threading
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import read_tables
+
+SUBUNIT_TABLES = ("companies", "platoons", "squads")
+
+
+def source_sql(table: str, display: str = "name", condition: str = "") -> str:
+    """Запит довідника (id, d_val) для combo-поля з "source"/"source_display" (condition — умова WHERE)"""
+    where_clause = f" WHERE {condition}" if condition else ""
+    return f"SELECT id, {display} AS d_val FROM {table}{where_clause} ORDER BY {display}"
+
+
+class LookupCache:
+    """Спільний для всього процесу кеш довідників id -> підпис для combo-полів.
+
+    Ключ — SQL довідника (source_sql() або custom_query поля), що повертає колонки id і d_val.
+    Відсутні довідники вибираються одним запитом UNION ALL (load), тож діалог
+    відкривається щонайбільше за один запит до БД. Довідник скидається, щойно
+    Database повідомляє про запис у будь-яку з таблиць, які він читає."""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._items: Dict[str, List[Tuple[int, str]]] = {}
+        self._labels: Dict[str, Dict[int, str]] = {}
+        self._tables: Dict[str, frozenset] = {}
+        # Лічильник інвалідацій: результат, вибраний до запису в БД, не потрапляє в кеш
+        self._version = 0
+        # Дерево рот/взводів/відділень частини: unit_id -> {таблиця: {id батька: [(id, назва)]}}
+        self._subunits: Dict[int, Dict[str, Dict[int, List[Tuple[int, str]]]]] = {}
+        db.add_invalidation_listener(self.invalidate)
+
+    # =====================================================
+    # ВИБІРКА
+    # =====================================================
+    @staticmethod
+    def _clean(sql: str) -> str:
+        return sql.strip().rstrip(";")
+
+    def load(self, queries: Iterable[str]) -> int:
+        """Вибрати всі ще не закешовані довідники одним запитом; повертає кількість вибраних"""
+        with self._lock:
+            missing = list(dict.fromkeys(self._clean(q) for q in queries if self._clean(q) not in self._items))
+            version = self._version
+        if not missing:
+            return 0
+
+        # row_number() зберігає ORDER BY кожного довідника всередині спільного результату
+        parts = [f"SELECT {i} AS lookup_no, row_number() OVER () AS lookup_pos, lk.id, lk.d_val::text AS d_val "
+                 f"FROM ({sql}) AS lk" for i, sql in enumerate(missing)]
+        rows = self.db.query(" UNION ALL ".join(f"({p})" for p in parts) + " ORDER BY lookup_no, lookup_pos")
+
+        grouped = {sql: [] for sql in missing}
+        for r in rows:
+            grouped[missing[r["lookup_no"]]].append((r["id"], r["d_val"]))
+        with self._lock:
+            if version != self._version:
+                return len(missing)
+            for sql, items in grouped.items():
+                self._items[sql] = items
+                self._labels[sql] = dict(items)
+                self._tables[sql] = read_tables(sql)
+        return len(missing)
+
+    def _grouped(self, sql: str) -> Tuple[List[Tuple[int, str]], Dict[int, str]]:
+        sql = self._clean(sql)
+        with self._lock:
+            if sql in self._items:
+                return self._items[sql], self._labels[sql]
+        self.load([sql])
+        with self._lock:
+            if sql in self._items:
+                return self._items[sql], self._labels[sql]
+        # Довідник інвалідовано під час вибірки — віддати свіжий результат без кешування
+        items = [(r["id"], str(r["d_val"])) for r in self.db.query(sql)]
+        return items, dict(items)
+
+    def items(self, sql: str) -> List[Tuple[int, str]]:
+        """[(id, підпис)] довідника в порядку його ORDER BY"""
+        return self._grouped(sql)[0]
+
+    def values(self, sql: str) -> List[str]:
+        """Значення для ttk.Combobox у форматі "id: підпис" """
+        return [f"{i}: {label}" for i, label in self.items(sql)]
+
+    def label(self, sql: str, item_id) -> Optional[str]:
+        try:
+            return self._grouped(sql)[1].get(int(item_id))
+        except (TypeError, ValueError):
+            return None
+
+    def subunits(self, unit_id: int) -> Dict[str, Dict[int, List[Tuple[int, str]]]]:
+        """Усі роти, взводи і відділення частини одним запитом, проіндексовані за батьком:
+        tree["companies"][unit_id], tree["platoons"][company_id], tree["squads"][platoon_id]"""
+        unit_id = int(unit_id)
+        with self._lock:
+            if unit_id in self._subunits:
+                return self._subunits[unit_id]
+            version = self._version
+
+        rows = self.db.query("""
+            SELECT 'companies' AS level, c.id, c.name, c.military_unit_id AS parent_id
+            FROM companies c WHERE c.military_unit_id = %s
+            UNION ALL
+            SELECT 'platoons', p.id, p.name, p.company_id
+            FROM platoons p JOIN companies c ON p.company_id = c.id WHERE c.military_unit_id = %s
+            UNION ALL
+            SELECT 'squads', s.id, s.name, s.platoon_id
+            FROM squads s JOIN platoons p ON s.platoon_id = p.id JOIN companies c ON p.company_id = c.id
+            WHERE c.military_unit_id = %s
+            ORDER BY name
+        """, [unit_id] * 3)
+
+        tree = {table: {} for table in SUBUNIT_TABLES}
+        for r in rows:
+            tree[r["level"]].setdefault(r["parent_id"], []).append((r["id"], r["name"]))
+        with self._lock:
+            if version == self._version:
+                self._subunits[unit_id] = tree
+        return tree
+
+    # =====================================================
+    # ІНВАЛІДАЦІЯ
+    # =====================================================
+    def invalidate(self, tables: Optional[Iterable[str]] = None):
+        """Скинути довідники, що читають tables (None — усі)"""
+        with self._lock:
+            self._version += 1
+            if tables is None:
+                stale = list(self._items)
+            else:
+                tables = set(tables)
+                stale = [sql for sql, deps in self._tables.items() if deps & tables]
+            for sql in stale:
+                self._items.pop(sql, None)
+                self._labels.pop(sql, None)
+                self._tables.pop(sql, None)
+            if tables is None or tables & set(SUBUNIT_TABLES):
+                self._subunits.clear()
+
+
+_SHARED = weakref.WeakKeyDictionary()
+
+
+def lookup_cache(db) -> LookupCache:
+    """Єдиний LookupCache для з'єднання db (спільний для всіх вкладок і діалогів)"""
+    cache = _SHARED.get(db)
+    if cache is None:
+        cache = _SHARED[db] = LookupCache(db)
+    return cache
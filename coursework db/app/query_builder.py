@@ -0,0 +1,427 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Ключ сортування: (SQL-вираз, колонка результату, DESC?, може бути NULL?)
+SortKey = Tuple[str, str, bool, bool]
+
+_KEYWORDS_RE = re.compile(r"\b(SELECT|FROM|WHERE|GROUP\s+BY|ORDER\s+BY|LIMIT)\b", re.IGNORECASE)
+_ALIAS_RE = re.compile(r"\bAS\s+\"?([A-Za-z_]\w*)\"?\s*$", re.IGNORECASE)
+_COLUMN_RE = re.compile(r"^(?:[A-Za-z_]\w*\.)?\"?([A-Za-z_]\w*)\"?$")
+_JOIN_RE = re.compile(r"\b(LEFT\s+(?:OUTER\s+)?|RIGHT\s+(?:OUTER\s+)?|FULL\s+(?:OUTER\s+)?|INNER\s+)?JOIN\s+"
+                      r"([A-Za-z_][\w.]*)\s+(?:AS\s+)?([A-Za-z_]\w*)", re.IGNORECASE)
+_JOIN_ON_RE = re.compile(r"\bJOIN\s+([A-Za-z_][\w.]*)\s+(?:AS\s+)?([A-Za-z_]\w*)\s+ON\s+"
+                         r"([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)", re.IGNORECASE)
+_REF_RE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+_QUALIFIED_RE = re.compile(r"^([A-Za-z_]\w*)\.([A-Za-z_]\w*)$")
+_FROM_TABLE_RE = re.compile(r"^\s*([A-Za-z_][\w.]*)(?:\s+(?:AS\s+)?(?!(?:LEFT|RIGHT|INNER|FULL|CROSS|JOIN|WHERE|ON)\b)"
+                            r"([A-Za-z_]\w*))?", re.IGNORECASE)
+
+
+# =====================================================
+# РОЗБІР custom_sql
+# =====================================================
+def _strip_comments(sql: str) -> str:
+    return re.sub(r"--[^\n]*", "", sql)
+
+
+def _mask(sql: str) -> str:
+    """Рядок тієї ж довжини, де вміст дужок і лапок замінено пробілами — для пошуку ключових слів верхнього рівня"""
+    out, depth, quote = [], 0, None
+    for ch in sql:
+        if quote:
+            out.append(" ")
+            if ch == quote:
+                quote = None
+            continue
+        if ch in ("'", '"'):
+            quote = ch
+            out.append(" ")
+        elif ch == "(":
+            depth += 1
+            out.append(" ")
+        elif ch == ")":
+            depth -= 1
+            out.append(" ")
+        else:
+            out.append(ch if depth == 0 else " ")
+    return "".join(out)
+
+
+def _split_top(text: str, sep: str = ",") -> List[str]:
+    masked = _mask(text)
+    parts, start = [], 0
+    for i, ch in enumerate(masked):
+        if ch == sep:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def parse_select(sql: str) -> Dict[str, str]:
+    """SELECT ... FROM ... [WHERE ...] [ORDER BY ...] -> частини запиту верхнього рівня"""
+    sql = _strip_comments(sql).strip().rstrip(";")
+    masked = _mask(sql)
+    marks = [(m.start(), m.end(), re.sub(r"\s+", " ", m.group(1).upper())) for m in _KEYWORDS_RE.finditer(masked)]
+    parts = {}
+    for i, (start, end, kw) in enumerate(marks):
+        stop = marks[i + 1][0] if i + 1 < len(marks) else len(sql)
+        parts[kw] = sql[end:stop].strip()
+    return parts
+
+
+def _select_items(select_sql: str) -> List[Tuple[str, str]]:
+    items = []
+    for item in _split_top(select_sql):
+        m = _ALIAS_RE.search(_mask(item))
+        if m:
+            expr, alias = item[:m.start()].strip(), m.group(1)
+        else:
+            col = _COLUMN_RE.match(item)
+            if not col:
+                raise ValueError(f"Колонка без псевдоніма: {item}")
+            expr, alias = item, col.group(1)
+        items.append((re.sub(r"\s+", " ", expr), alias))
+    return items
+
+
+def _order_items(order_sql: str) -> List[Tuple[str, bool]]:
+    items = []
+    for item in _split_top(order_sql):
+        m = re.match(r"^(.*?)(?:\s+(ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?$", item, re.IGNORECASE | re.DOTALL)
+        items.append((re.sub(r"\s+", " ", m.group(1).strip()), (m.group(2) or "").upper() == "DESC"))
+    return items
+
+
+# =====================================================
+# KEYSET
+# =====================================================
+def _keyset(sort: Sequence[SortKey], values: Sequence[Any], forward: bool, inclusive: bool) -> Tuple[str, list]:
+    """Умова «рядок після (перед) bound» для довільних напрямків сортування; NULL завжди в кінці"""
+    directions = {desc for _, _, desc, _ in sort}
+    if len(directions) == 1 and not any(nullable for _, _, _, nullable in sort) and None not in values:
+        # Один напрямок без NULL — порівняння рядків (a, b) > (x, y), яке B-tree індекс бере як межу сканування
+        op = ">" if forward != (True in directions) else "<"
+        exprs = ", ".join(expr for expr, _, _, _ in sort)
+        marks = ", ".join(["%s"] * len(sort))
+        return f"({exprs}) {op}{'=' if inclusive else ''} ({marks})", list(values)
+
+    ors, params = [], []
+
+    def equal(expr, value):
+        if value is None:
+            return f"{expr} IS NULL", []
+        return f"{expr} = %s", [value]
+
+    for i, (expr, _, desc, nullable) in enumerate(sort):
+        parts, p = [], []
+        for (prev_expr, _, _, _), prev_val in zip(sort[:i], values[:i]):
+            cond, cp = equal(prev_expr, prev_val)
+            parts.append(cond)
+            p += cp
+        value = values[i]
+        if forward:
+            if value is None:
+                continue  # після NULL (NULLS LAST) у цьому ключі нічого немає
+            op = "<" if desc else ">"
+            parts.append(f"({expr} {op} %s OR {expr} IS NULL)" if nullable else f"{expr} {op} %s")
+        else:
+            if value is None:
+                parts.append(f"{expr} IS NOT NULL")
+            else:
+                parts.append(f"{expr} {'>' if desc else '<'} %s")
+        if value is not None:
+            p.append(value)
+        ors.append("(" + " AND ".join(parts) + ")")
+        params += p
+
+    if inclusive:
+        conds = [equal(expr, v) for (expr, _, _, _), v in zip(sort, values)]
+        ors.append("(" + " AND ".join(c for c, _ in conds) + ")")
+        for _, cp in conds:
+            params += cp
+    if not ors:
+        return "FALSE", []
+    cond = "(" + " OR ".join(ors) + ")"
+    expr, _, desc, nullable = sort[0]
+    if not nullable and values[0] is not None:
+        # Надлишкова межа за першим ключем — щоб індекс по ньому почав сканування з bound
+        cond = f"{expr} {'>=' if forward != desc else '<='} %s AND {cond}"
+        params = [values[0]] + params
+    return cond, params
+
+
+def _order_sql(sort: Sequence[SortKey], forward: bool) -> str:
+    items = []
+    for expr, _, desc, _ in sort:
+        if forward:
+            items.append(f"{expr} {'DESC' if desc else 'ASC'} NULLS LAST")
+        else:
+            items.append(f"{expr} {'ASC' if desc else 'DESC'} NULLS FIRST")
+    return ", ".join(items)
+
+
+@lru_cache(maxsize=512)
+def _render(select_sql: str, from_sql: str, conds: Tuple[str, ...], order_sql: str, keyset_sql: Optional[str]) -> str:
+    where = list(conds) + ([keyset_sql] if keyset_sql else [])
+    where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+    return f"SELECT {select_sql} FROM {from_sql}{where_sql} ORDER BY {order_sql} LIMIT %s"
+
+
+# =====================================================
+# ЗАПИТ СТОРІНКИ
+# =====================================================
+class PageQuery:
+    """Незмінний опис запиту сторінки: SELECT/FROM сутності + фільтри + сортування.
+    Фільтри й сортування потрапляють прямо у WHERE/ORDER BY над базовими таблицями,
+    без обгортання в підзапит."""
+
+    def __init__(self, select_sql: str, from_sql: str, key: str, sort: Sequence[SortKey],
+                 conds: Sequence[Tuple[str, Sequence[Any]]] = (), columns: Optional[Dict[str, str]] = None,
+                 from_params: Sequence[Any] = ()):
+        self.select_sql = select_sql
+        self.from_sql = from_sql
+        self.from_params = tuple(from_params)
+        self.key = key
+        self.sort = tuple(sort)
+        self.conds = tuple((c, tuple(p)) for c, p in conds)
+        self.columns = columns or {}
+
+    def _replace(self, **changes) -> "PageQuery":
+        q = PageQuery.__new__(PageQuery)
+        q.__dict__.update(self.__dict__)
+        q.__dict__.update(changes)
+        return q
+
+    def where(self, cond: str, params: Sequence[Any] = ()) -> "PageQuery":
+        return self._replace(conds=self.conds + ((cond, tuple(params)),))
+
+    def join(self, join_sql: str, params: Sequence[Any] = (), select: str = "") -> "PageQuery":
+        """Додатковий JOIN (параметри join_sql ідуть перед параметрами WHERE)"""
+        return self._replace(from_sql=f"{self.from_sql} {join_sql}",
+                             from_params=self.from_params + tuple(params),
+                             select_sql=f"{self.select_sql}, {select}" if select else self.select_sql)
+
+    def order_by(self, sort: Sequence[SortKey], select: str = "") -> "PageQuery":
+        """Нове сортування; ключ сторінок (key) завжди додається останнім для однозначності.
+        select — додаткові колонки результату, потрібні для keyset-межі сортування"""
+        tail = [s for s in self.sort if s[1] == self.key][-1:]
+        sort = [s for s in sort if s[1] != self.key]
+        return self._replace(sort=tuple(sort) + tuple(tail),
+                             select_sql=f"{self.select_sql}, {select}" if select else self.select_sql)
+
+    def bound(self, row) -> tuple:
+        return tuple(row[alias] for _, alias, _, _ in self.sort)
+
+    def page(self, limit: int, bound: Optional[Sequence[Any]] = None, forward: bool = True,
+             inclusive: bool = False) -> Tuple[str, list]:
+        keyset_sql, keyset_params = (None, [])
+        if bound is not None:
+            keyset_sql, keyset_params = _keyset(self.sort, bound, forward, inclusive)
+        sql = _render(self.select_sql, self.from_sql, tuple(c for c, _ in self.conds),
+                      _order_sql(self.sort, forward), keyset_sql)
+        params = list(self.from_params)
+        for _, p in self.conds:
+            params += p
+        return sql, params + keyset_params + [limit]
+
+    def row(self, key_value) -> Tuple[str, list]:
+        """Запит одного рядка за ключем (щоб відкрити вікно з нього)"""
+        return self.where(f"{self.columns.get(self.key, self.key)} = %s", [key_value]).page(1)
+
+    def rows(self, key_values: Sequence[Any]) -> Tuple[str, list]:
+        """Запит кількох рядків за ключами одним запитом (= ANY)"""
+        keys = list(key_values)
+        return self.where(f"{self.columns.get(self.key, self.key)} = ANY(%s)", [keys]).page(max(1, len(keys)))
+
+
+# =====================================================
+# СУТНІСТЬ
+# =====================================================
+class EntityQuery:
+    """Скомпільована конфігурація сутності CRUD: колонки -> вирази, FROM з JOIN-ами, сортування за замовчуванням"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.table = config["table"]
+        self.pk = config.get("pk", "id")
+        self.fields = list(config["display_fields"])
+        self.key = self.fields[0]
+        # Поле -> індексований вираз сортування (напр. rank_name -> mp.rank_id, тобто за старшинством)
+        self.sort_exprs = dict(config.get("sort_exprs", {}))
+
+        if "custom_sql" in config:
+            parts = parse_select(config["custom_sql"])
+            items = _select_items(parts["SELECT"])
+            self.from_sql = re.sub(r"\s+", " ", parts["FROM"])
+            m = _FROM_TABLE_RE.match(self.from_sql)
+            self.alias = (m.group(2) or m.group(1)) if m else self.table
+            self.base_where = re.sub(r"\s+", " ", parts["WHERE"]) if "WHERE" in parts else None
+            default_order = _order_items(parts["ORDER BY"]) if "ORDER BY" in parts else []
+        else:
+            items = [(f"{self.table}.{f}", f) for f in self.fields]
+            self.from_sql = self.table
+            self.alias = self.table
+            self.base_where = None
+            default_order = []
+
+        # Псевдонім -> (таблиця, чи може бути NULL через зовнішній JOIN)
+        self.aliases = {self.alias: (self.table, False)}
+        for m in _JOIN_RE.finditer(self.from_sql):
+            self.aliases[m.group(3)] = (m.group(2), bool(m.group(1)) and not m.group(1).upper().startswith("INNER"))
+
+        # Псевдонім JOIN-у прямо від базової таблиці -> (колонка базової таблиці, колонка приєднаної)
+        self.join_keys = {}
+        self.join_clauses = {}
+        for m in _JOIN_ON_RE.finditer(self.from_sql):
+            joined, left, right = m.group(2), (m.group(3), m.group(4)), (m.group(5), m.group(6))
+            self.join_clauses[joined] = "LEFT " + m.group(0)
+            if left[0] == self.alias and right[0] == joined:
+                self.join_keys[joined] = (left[1], right[1])
+            elif right[0] == self.alias and left[0] == joined:
+                self.join_keys[joined] = (right[1], left[1])
+
+        self.columns = {alias: expr for expr, alias in items}
+        self.select_sql = ", ".join(expr if expr.split(".")[-1] == alias else f"{expr} AS {alias}"
+                                    for expr, alias in items)
+
+        # ORDER BY з custom_sql: [(поле, desc)]; чи може вираз бути NULL, визначає default_sort()
+        exprs = {expr: alias for alias, expr in self.columns.items()}
+        self.default_order = []
+        for expr, desc in default_order:
+            alias = exprs.get(expr, expr if expr in self.columns else None)
+            if alias is None or alias == self.key:
+                continue
+            self.default_order.append((alias, desc))
+
+    def expr(self, field: str) -> str:
+        return self.columns[field]
+
+    @property
+    def pk_expr(self) -> str:
+        return f"{self.alias}.{self.pk}"
+
+    @property
+    def key_column(self) -> Optional[str]:
+        """Колонка базової таблиці, з якої береться ключ рядка (для RETURNING); None — ключ не з неї"""
+        m = _QUALIFIED_RE.match(self.columns[self.key])
+        return m.group(2) if m and m.group(1) == self.alias else None
+
+    def default_sort(self, not_null=lambda table: ()) -> Tuple[SortKey, ...]:
+        """Сортування за замовчуванням (ORDER BY custom_sql, потім ключ); not_null — як у sorted()"""
+        sort = tuple((self.columns[alias], alias, desc, self.nullable(self.columns[alias], not_null))
+                     for alias, desc in self.default_order)
+        return sort + ((self.columns[self.key], self.key, False, False),)
+
+    def query(self, not_null=lambda table: ()) -> PageQuery:
+        q = PageQuery(self.select_sql, self.from_sql, self.key, self.default_sort(not_null), columns=self.columns)
+        if self.base_where:
+            q = q.where(f"({self.base_where})")
+        return q
+
+    def nullable(self, expr: str, not_null) -> bool:
+        """Чи може вираз бути NULL; not_null(table) -> множина NOT NULL колонок таблиці"""
+        m = _QUALIFIED_RE.match(expr)
+        if not m or m.group(1) not in self.aliases:
+            return True
+        table, outer = self.aliases[m.group(1)]
+        return outer or m.group(2) not in not_null(table)
+
+    def sorted(self, q: PageQuery, field: str, desc: bool = False, not_null=lambda table: ()) -> PageQuery:
+        """q, відсортований за полем field (потім за ключем); NULL — в кінці"""
+        expr = self.sort_exprs.get(field, self.columns[field])
+        if expr == self.columns[field]:
+            return q.order_by([(expr, field, desc, self.nullable(expr, not_null))])
+        alias = f"sort_{field}"
+        return q.order_by([(expr, alias, desc, self.nullable(expr, not_null))], select=f"{expr} AS {alias}")
+
+    def filtered(self, q: PageQuery, field: str, op: str, value: Any = None) -> PageQuery:
+        """Фільтр по полю: '~' містить, '=', '>=', '<=', 'null' порожнє"""
+        expr = self.columns[field]
+        if op == "~":
+            return q.where(f"{expr}::text ILIKE %s", [f"%{value}%"])
+        if op == "null":
+            return q.where(f"{expr} IS NULL")
+        if op in ("=", ">=", "<="):
+            return q.where(f"{expr} {op} %s", [value])
+        raise ValueError(f"Невідомий оператор фільтра: {op}")
+
+    @property
+    def search_fields(self) -> List[str]:
+        """Поля, в яких шукає search() (і звужує результат клієнт) — усі, крім первинного ключа"""
+        return [f for f in self.fields if f != self.pk]
+
+    def _via_join(self, alias: str, cond: str) -> str:
+        base_col, joined_col = self.join_keys[alias]
+        return (f"{self.alias}.{base_col} IN "
+                f"(SELECT {alias}.{joined_col} FROM {self.aliases[alias][0]} {alias} WHERE {cond})")
+
+    def key_sets(self, fields: Sequence[str], term: str) -> List[Tuple[str, list]]:
+        """Запити ключів (search_key) рядків, у яких term входить у fields, без виконання всього SELECT сутності:
+        колонки приєднаних таблиць — через `fk IN (SELECT id FROM <довідник> WHERE ... ILIKE)`,
+        колонки базової таблиці — ILIKE по ній самій, вирази з кількох таблиць — лише з потрібними JOIN-ами"""
+        like = f"%{term}%"
+        base_from = self.table if self.alias == self.table else f"{self.table} {self.alias}"
+        base_conds, joined_conds, sets = [], [], []
+        for f in fields:
+            expr = self.columns[f]
+            refs = {}
+            for alias, col in _REF_RE.findall(expr):
+                if alias in self.aliases:
+                    refs.setdefault(alias, []).append(f"{alias}.{col}")
+            joined = [a for a in refs if a != self.alias]
+            if not joined:
+                base_conds.append(f"{expr}::text ILIKE %s")
+            elif any(a not in self.join_keys for a in joined):
+                # JOIN не від базової таблиці — ключі через повний FROM сутності, але лише для цього поля
+                sets.append((f"SELECT {self.pk_expr} AS search_key FROM {self.from_sql} WHERE {expr}::text ILIKE %s",
+                             [like]))
+            elif len(refs) == 1:
+                joined_conds.append(self._via_join(joined[0], f"{expr}::text ILIKE %s"))
+            else:
+                # Вираз з кількох таблиць (CONCAT_WS, COALESCE...) — лише з JOIN-ами, які він використовує
+                joins = " ".join(self.join_clauses[a] for a in joined)
+                sets.append((f"SELECT {self.pk_expr} AS search_key FROM {base_from} {joins} "
+                             f"WHERE {expr}::text ILIKE %s", [like]))
+        if base_conds:
+            sets.append((f"SELECT {self.pk_expr} AS search_key FROM {base_from} WHERE " + " OR ".join(base_conds),
+                         [like] * len(base_conds)))
+        for cond in joined_conds:
+            sets.append((f"SELECT {self.pk_expr} AS search_key FROM {base_from} WHERE {cond}", [like]))
+        return sets
+
+    def search(self, term: str, search_index=None, not_null=lambda table: ()) -> PageQuery:
+        """Пошук term: текстові колонки базової таблиці — через триграмний індекс (з рангом),
+        решта полів — окремими наборами ключів (key_sets); без індексу — ILIKE по всіх полях"""
+        q = self.query(not_null)
+        fields = self.search_fields
+        matched = None
+        if search_index is not None:
+            indexed = [f for f in search_index.searchable_columns(self.table, fields)
+                       if self.columns[f] == f"{self.alias}.{f}"]
+            rest = [f for f in fields if f not in indexed]
+            matched = search_index.match(self.table, indexed, term, self.pk, self.key_sets(rest, term))
+        if matched is not None:
+            match_sql, params = matched
+            rank = f"m.{search_index.RANK_COLUMN}"
+            q = q.join(f"JOIN ({match_sql}) AS m ON m.search_key = {self.pk_expr}", params,
+                       select=f"{rank} AS {search_index.RANK_COLUMN}")
+            return q.order_by([(rank, search_index.RANK_COLUMN, True, False)])
+
+        conds = [f"{self.columns[f]}::text ILIKE %s" for f in fields]
+        if not conds:
+            return q.where("FALSE")
+        return q.where("(" + " OR ".join(conds) + ")", [f"%{term}%"] * len(conds))
+
+
+_COMPILED: Dict[tuple, EntityQuery] = {}
+
+
+def compile_entity(config: Dict[str, Any]) -> EntityQuery:
+    """EntityQuery для конфігурації сутності (кешується: розбір SQL виконується один раз)"""
+    cache_key = (config["table"], config.get("pk", "id"), config.get("custom_sql"), tuple(config["display_fields"]),
+                 tuple(sorted(config.get("sort_exprs", {}).items())))
+    entity = _COMPILED.get(cache_key)
+    if entity is None:
+        entity = _COMPILED[cache_key] = EntityQuery(config)
+    return entity
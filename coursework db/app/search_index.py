@@ -0,0 +1,138 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+
+
+class SearchIndex:
+    """Пошук за триграмами (pg_trgm): GIN-індекси на текстових колонках таблиць сутностей
+    і запити, що йдуть через ці індекси з ранжуванням за схожістю.
+
+    Якщо розширення pg_trgm недоступне, available == False і пошук
+    лишається звичайним ILIKE по всіх колонках."""
+
+    RANK_COLUMN = "search_rank"
+
+    def __init__(self, db):
+        self.db = db
+        self.available = None
+        self._lock = threading.Lock()
+        self._columns: Dict[str, List[str]] = {}
+
+    # =====================================================
+    # ПІДГОТОВКА ІНДЕКСІВ
+    # =====================================================
+    def _ensure_extension(self) -> bool:
+        if self.available is not None:
+            return self.available
+        try:
+            rows = self.db.query("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if not rows:
+                self.db.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            self.available = True
+        except psycopg2.Error as e:
+            print(f"⚠️ pg_trgm недоступний, пошук без індексів: {e}")
+            self.available = False
+        return self.available
+
+    def text_columns(self, table: str) -> List[str]:
+        """Текстові колонки таблиці (varchar/text) — кандидати для триграмного індексу"""
+        if table not in self._columns:
+            rows = self.db.query_cached("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s
+                  AND data_type IN ('character varying', 'text', 'character')
+                ORDER BY ordinal_position
+            """, [table], tables=["information_schema.columns"])
+            self._columns[table] = [r["column_name"] for r in rows]
+        return self._columns[table]
+
+    def searchable_columns(self, table: str, fields: Sequence[str]) -> List[str]:
+        """Поля сутності, які є текстовими колонками її власної таблиці"""
+        text_cols = self.text_columns(table)
+        return [f for f in fields if f in text_cols]
+
+    def unindexed_fields(self, table: str, fields: Sequence[str]) -> List[str]:
+        """Поля, яких немає серед текстових колонок таблиці (нетекстові або взяті з JOIN-ів) —
+        вони не покриваються триграмним індексом і шукаються через ILIKE"""
+        text_cols = self.text_columns(table)
+        return [f for f in fields if f not in text_cols]
+
+    def provision(self, entities: Sequence[dict]) -> int:
+        """Створити відсутні GIN-індекси для всіх сутностей (table + display_fields); повертає кількість нових"""
+        with self._lock:
+            if not self._ensure_extension():
+                return 0
+            wanted = {}
+            for config in entities:
+                table = config.get("table")
+                if not table:
+                    continue
+                for col in self.searchable_columns(table, config.get("display_fields", [])):
+                    wanted[f"trgm_{table}_{col}"] = (table, col)
+            if not wanted:
+                return 0
+
+            existing = {r["indexname"] for r in self.db.query(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(%s)",
+                [list(wanted)])}
+            created = 0
+            for name, (table, col) in wanted.items():
+                if name in existing:
+                    continue
+                try:
+                    self.db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({col} gin_trgm_ops)")
+                    created += 1
+                except psycopg2.Error as e:
+                    print(f"⚠️ Не вдалося створити індекс {name}: {e}")
+            if created:
+                print(f"🔎 Створено триграмних індексів: {created}")
+            return created
+
+    # =====================================================
+    # ПОШУКОВІ ЗАПИТИ
+    # =====================================================
+    def match(self, table: str, fields: Sequence[str], term: str, key: str = "id",
+              key_sets: Sequence[Tuple[str, list]] = ()) -> Optional[Tuple[str, list]]:
+        """Підзапит (search_key, search_rank) з рядками table, що містять term у текстових полях.
+        key_sets — додаткові запити (search_key) для полів поза індексом; їхні збіги мають ранг 0
+        і об'єднуються з триграмними (UNION ALL), тож кожен набір ключів бере власний індекс.
+        None — індексований пошук неможливий (немає pg_trgm чи текстових колонок)."""
+        if not self._ensure_extension():
+            return None
+        cols = self.searchable_columns(table, fields)
+        if not cols:
+            return None
+        rank = ", ".join(f"word_similarity(%s, {c})" for c in cols)
+        where = " OR ".join(f"{c} ILIKE %s" for c in cols)
+        # float8: значення рангу повертається в keyset-межу сторінки і має порівнюватися точно
+        sql = (f"SELECT {key} AS search_key, COALESCE(GREATEST({rank}), 0)::float8 AS {self.RANK_COLUMN} "
+               f"FROM {table} WHERE {where}")
+        params = [term] * len(cols) + [f"%{term}%"] * len(cols)
+        if not key_sets:
+            return sql, params
+        parts = [sql]
+        for ks_sql, ks_params in key_sets:
+            parts.append(f"SELECT ks.search_key, 0::float8 FROM ({ks_sql}) AS ks")
+            params += list(ks_params)
+        return (f"SELECT search_key, MAX({self.RANK_COLUMN}) AS {self.RANK_COLUMN} "
+                f"FROM ({' UNION ALL '.join(parts)}) AS matches GROUP BY search_key"), params
+
+    def search_sql(self, base_sql: str, table: str, fields: Sequence[str], term: str,
+                   key: str = "id", result_key: Optional[str] = None) -> Optional[Tuple[str, list]]:
+        """Результат base_sql, обмежений збігами з індексу і доповнений колонкою search_rank.
+        fields — колонки table; ті, що поза індексом, шукаються ILIKE по самій table.
+        result_key — колонка base_sql, що відповідає key таблиці."""
+        rest = self.unindexed_fields(table, fields)
+        key_sets = []
+        if rest:
+            key_sets.append((f"SELECT {key} AS search_key FROM {table} WHERE "
+                             + " OR ".join(f"{f}::text ILIKE %s" for f in rest), [f"%{term}%"] * len(rest)))
+        matched = self.match(table, fields, term, key, key_sets)
+        if matched is None:
+            return None
+        match_sql, params = matched
+        sql = (f"SELECT search_sub.*, m.{self.RANK_COLUMN} "
+               f"FROM ({base_sql.strip().rstrip(';')}) AS search_sub "
+               f"JOIN ({match_sql}) AS m ON m.search_key = search_sub.{result_key or key}")
+        return sql, params
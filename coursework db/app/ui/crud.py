@@ -1,14 +1,31 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from typing import Dict, Any, Optional
 from datetime import datetime, date
 
+from search_index import SearchIndex
+from lookups import lookup_cache, source_sql
+from importer import EntityImporter
+from ui.worker import DbTask, BusyIndicator
+from query_builder import compile_entity
+from ui.virtual_table import VirtualTable
+from ui.search import SearchController, row_matches
+from ui.live import LiveUpdates
+
+# Оператори фільтра: підпис -> оператор EntityQuery.filtered
+FILTER_OPS = {"містить": "~", "=": "=", "≥": ">=", "≤": "<=", "порожнє": "null"}
+
+# Затримка перед підрахунком записів, які змінить масова зміна, під час набору значення (мс)
+PREVIEW_DELAY_MS = 300
+
 
 class CRUDFrame(tk.Frame):
     def __init__(self, master, db):
         super().__init__(master)
         self.db = db
+        self.search_index = SearchIndex(db)
+        self.lookups = lookup_cache(db)
 
         self.current_subunit_type = tk.StringVar(value="company")
 
@@ -27,6 +44,9 @@ class CRUDFrame(tk.Frame):
         self.entity_combo.pack(side=tk.LEFT)
         self.entity_combo.bind("<<ComboboxSelected>>", self._on_entity_select)
 
+        self.busy = BusyIndicator(top_panel)
+        self.busy.pack(side=tk.RIGHT)
+
         self.content_frame = ttk.Frame(self, padding=10)
         self.content_frame.grid(row=1, column=0, sticky="nsew")
         self.content_frame.columnconfigure(0, weight=1)
@@ -207,6 +227,8 @@ class CRUDFrame(tk.Frame):
                 # 🔥 Додано middle_name у display_fields
                 "display_fields": ["id", "last_name", "first_name", "middle_name", "rank_name", "full_location"],
                 "headers": ["ID", "Прізвище", "Ім'я", "По батькові", "Звання", "Місце служби"],
+                # Звання сортуються за старшинством (rank_id), а не за абеткою
+                "sort_exprs": {"rank_name": "mp.rank_id"},
                 "custom_sql": """
                               SELECT mp.id,
                                      mp.last_name,
@@ -428,14 +450,27 @@ class CRUDFrame(tk.Frame):
 
         self.entity_combo['values'] = list(self.entities.keys())
 
-    def _on_entity_select(self, event):
+        # Триграмні індекси для пошуку створюються у фоні (лише відсутні)
+        DbTask(self, self.db, lambda: self.search_index.provision(list(self.entities.values())),
+               on_error=lambda e: print(f"Search index error: {e}"))
+
+    def _on_entity_select(self, event, start_key=None):
         entity_name = self.entity_var.get()
         if not entity_name: return
 
         for widget in self.content_frame.winfo_children(): widget.destroy()
-        self._create_crud_interface(self.entities[entity_name], entity_name)
-
-    def _create_crud_interface(self, config: Dict[str, Any], entity_name: str):
+        self._create_crud_interface(self.entities[entity_name], entity_name, start_key)
+
+    def open_record(self, table: str, record_id) -> bool:
+        """Відкрити сутність таблиці table з прокруткою до запису record_id і виділити його"""
+        for entity_name, config in self.entities.items():
+            if config["table"] == table:
+                self.entity_var.set(entity_name)
+                self._on_entity_select(None, start_key=record_id)
+                return True
+        return False
+
+    def _create_crud_interface(self, config: Dict[str, Any], entity_name: str, start_key=None):
         control_panel = ttk.Frame(self.content_frame, padding=(0, 0, 0, 10))
         control_panel.grid(row=0, column=0, sticky="ew")
 
@@ -445,6 +480,10 @@ class CRUDFrame(tk.Frame):
         ttk.Button(btn_frame, text="➕ Додати", command=lambda: self._add_record(config)).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(btn_frame, text="✏️ Редагувати", command=lambda: self._edit_record(config)).pack(side=tk.LEFT,
                                                                                                     padx=5)
+        ttk.Button(btn_frame, text="🧩 Масова зміна", command=lambda: self._bulk_edit(config)).pack(side=tk.LEFT,
+                                                                                                  padx=5)
+        ttk.Button(btn_frame, text="📥 Імпорт", command=lambda: self._import_records(config)).pack(side=tk.LEFT,
+                                                                                                 padx=5)
         ttk.Button(btn_frame, text="🗑️ Видалити", command=lambda: self._delete_record(config)).pack(side=tk.LEFT,
                                                                                                     padx=5)
 
@@ -454,87 +493,192 @@ class CRUDFrame(tk.Frame):
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=25)
         search_entry.pack(side=tk.LEFT, padx=5)
-        search_entry.bind('<KeyRelease>', lambda e: self._search_records(config))
+        search_entry.bind('<KeyRelease>', lambda e: self.search.on_key(self.search_var.get()))
+        search_entry.bind('<Return>', lambda e: self.search.search_now(self.search_var.get()))
 
         ttk.Button(search_frame, text="🔄", width=3, command=lambda: self._refresh_table(config)).pack(side=tk.LEFT)
 
-        table_frame = ttk.Frame(self.content_frame)
-        table_frame.grid(row=1, column=0, sticky="nsew")
-        table_frame.columnconfigure(0, weight=1)
-        table_frame.rowconfigure(0, weight=1)
+        # Сортування і фільтри виконуються в БД (ORDER BY / WHERE у PageQuery), а не над завантаженими рядками
+        self._sort = None       # (поле, desc) або None — порядок за замовчуванням
+        self._filters = []      # [(поле, оператор, значення)]
+        self._create_filter_bar(config, control_panel)
+
+        # Таблиця з посторінковим (keyset) довантаженням замість вибірки всієї таблиці
+        self.table = VirtualTable(self.content_frame, self.db, busy=self.busy)
+        self.table.grid(row=1, column=0, sticky="nsew")
+        self.tree = self.table.tree
 
-        self.tree = ttk.Treeview(table_frame, show="headings")
-        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.search = SearchController(
+            self, self.db,
+            fetch=lambda term: self._search_records(config, term),
+            show=lambda term, rows: self._show_search(config, term, rows),
+            matches=lambda row, term: row_matches(self._search_fields(config))(row, term),
+            on_clear=lambda: self._refresh_table(config),
+            busy=self.busy)
 
-        v_scroll = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        v_scroll.grid(row=0, column=1, sticky="ns")
-        h_scroll = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        h_scroll.grid(row=1, column=0, sticky="ew")
-        self.tree.configure(yscrollcommand=v_scroll.set, xscrollcommand=h_scroll.set)
+        # Зміни з інших сесій (і масові операції) застосовуються до видимих рядків самі
+        LiveUpdates(self.table, self.db, {table for table, _ in compile_entity(config).aliases.values()},
+                    lambda changes: self._on_live_changes(config, changes))
 
         self.content_frame.rowconfigure(1, weight=1)
-        self._refresh_table(config)
+        self._refresh_table(config, start_key)
 
-    def _refresh_table(self, config: Dict[str, Any]):
+    # =====================================================
+    # СОРТУВАННЯ І ФІЛЬТРИ
+    # =====================================================
+    def _create_filter_bar(self, config: Dict[str, Any], parent):
         display_fields = config["display_fields"]
         headers = config.get("headers", display_fields)
-
-        for item in self.tree.get_children(): self.tree.delete(item)
-
-        self.tree["columns"] = display_fields
-        for col, header in zip(display_fields, headers):
-            self.tree.heading(col, text=header)
-            width = 300 if "location" in col else 120
-            self.tree.column(col, width=width, anchor=tk.W)
-
-        if "custom_sql" in config:
-            query = config["custom_sql"]
+        labels = dict(zip(headers, display_fields))
+
+        filter_frame = ttk.LabelFrame(parent, text=" Фільтр ", padding=(10, 5))
+        filter_frame.pack(side=tk.RIGHT, padx=10)
+
+        field_var = tk.StringVar(value=headers[0])
+        ttk.Combobox(filter_frame, textvariable=field_var, values=headers, state="readonly",
+                     width=14).pack(side=tk.LEFT, padx=2)
+        op_var = tk.StringVar(value="містить")
+        ttk.Combobox(filter_frame, textvariable=op_var, values=list(FILTER_OPS), state="readonly",
+                     width=8).pack(side=tk.LEFT, padx=2)
+        value_var = tk.StringVar()
+        value_entry = ttk.Entry(filter_frame, textvariable=value_var, width=14)
+        value_entry.pack(side=tk.LEFT, padx=2)
+
+        def add_filter(event=None):
+            op = FILTER_OPS[op_var.get()]
+            value = value_var.get().strip()
+            if op != "null" and not value:
+                return
+            self._filters.append((labels[field_var.get()], op, value or None))
+            value_var.set("")
+            self._apply_view(config)
+
+        def clear_filters():
+            self._filters = []
+            self._apply_view(config)
+
+        value_entry.bind('<Return>', add_filter)
+        ttk.Button(filter_frame, text="✔", width=3, command=add_filter).pack(side=tk.LEFT, padx=2)
+        ttk.Button(filter_frame, text="✖", width=3, command=clear_filters).pack(side=tk.LEFT)
+        self.filter_label = ttk.Label(filter_frame, text="", foreground="gray")
+        self.filter_label.pack(side=tk.LEFT, padx=(5, 0))
+
+    def _on_heading_click(self, config: Dict[str, Any], field: str):
+        """Клік по заголовку: зростання → спадання → порядок за замовчуванням"""
+        if self._sort is None or self._sort[0] != field:
+            self._sort = (field, False)
+        elif not self._sort[1]:
+            self._sort = (field, True)
+        else:
+            self._sort = None
+        self._apply_view(config)
+
+    def _apply_view(self, config: Dict[str, Any]):
+        """Перевибрати дані з новим сортуванням/фільтрами (з урахуванням поточного пошуку)"""
+        self._update_headings(config)
+        names = dict(zip(config["display_fields"], config.get("headers", config["display_fields"])))
+        ops = {v: k for k, v in FILTER_OPS.items()}
+        self.filter_label.config(text="; ".join(
+            f"{names[f]} {ops[op]}" + (f" {v}" if v is not None else "") for f, op, v in self._filters))
+
+        term = self.search_var.get().strip()
+        if term:
+            self.search.reset()
+            self.search.search_now(term)
         else:
-            table_name = config["table"]
-            pk = config.get("pk", "id")
-            fields_str = ", ".join(display_fields)
-            query = f'SELECT {fields_str} FROM {table_name} ORDER BY {pk}'
-
-        try:
-            rows = self.db.query(query)
-            for row in rows:
-                values = []
-                for col in display_fields:
-                    val = row.get(col)
-                    values.append(val if val is not None else "")
-                self.tree.insert("", tk.END, values=values)
-        except Exception as e:
-            messagebox.showerror("Помилка", f"Помилка завантаження: {e}")
-
-    def _search_records(self, config: Dict[str, Any]):
-        search_term = self.search_var.get().strip()
-        if not search_term:
             self._refresh_table(config)
-            return
 
+    def _update_headings(self, config: Dict[str, Any]):
         display_fields = config["display_fields"]
-        pk = config.get("pk", "id")
-
-        conditions = [f'{field}::text ILIKE %s' for field in display_fields if field != pk]
-        if not conditions: return
-        where_clause = " OR ".join(conditions)
-        params = [f'%{search_term}%'] * len(conditions)
+        headers = config.get("headers", display_fields)
+        for field, header in zip(display_fields, headers):
+            if self._sort and self._sort[0] == field:
+                header += " ▼" if self._sort[1] else " ▲"
+            self.tree.heading(field, text=header, command=lambda f=field: self._on_heading_click(config, f))
+
+    def _not_null(self, table: str):
+        """Колонки таблиці з NOT NULL — для них keyset-умова обходиться без перевірок на NULL"""
+        rows = self.db.query_cached("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND is_nullable = 'NO'
+        """, [table], tables=["information_schema.columns"])
+        return {r["column_name"] for r in rows}
+
+    def _current_query(self, config: Dict[str, Any], search_term: Optional[str] = None):
+        """PageQuery сутності з поточним пошуком, фільтрами і сортуванням"""
+        entity = compile_entity(config)
+        query = (entity.search(search_term, self.search_index, self._not_null) if search_term
+                 else entity.query(self._not_null))
+        for field, op, value in self._filters:
+            query = entity.filtered(query, field, op, value)
+        if self._sort is not None:
+            query = entity.sorted(query, self._sort[0], self._sort[1], self._not_null)
+        return query
+
+    def _refresh_table(self, config: Dict[str, Any], start_key=None):
+        self.search.reset()
+        display_fields = config["display_fields"]
+        headers = config.get("headers", display_fields)
 
-        if "custom_sql" in config:
-            base_sql = config["custom_sql"]
-            query = f"SELECT * FROM ({base_sql}) AS search_sub WHERE {where_clause}"
-        else:
-            table_name = config["table"]
-            query = f'SELECT {", ".join(display_fields)} FROM {table_name} WHERE {where_clause} ORDER BY {pk}'
+        widths = {col: 300 for col in display_fields if "location" in col}
+        self.table.set_columns(display_fields, headers, widths)
+        self._update_headings(config)
+
+        self._load_rows(config, self._current_query(config),
+                        on_error=lambda e: messagebox.showerror("Помилка", f"Помилка завантаження: {e}"),
+                        start_key=start_key)
+
+    def _load_rows(self, config: Dict[str, Any], query, on_error, start_key=None):
+        """Показати результат PageQuery сторінками; ключ сторінок — перша колонка (id запису)"""
+        self.table.load(query, on_error=on_error, start=start_key)
+
+    def _search_fields(self, config: Dict[str, Any]):
+        """Поля, по яких фактично шукає EntityQuery.search"""
+        return compile_entity(config).search_fields
+
+    def _search_records(self, config: Dict[str, Any], search_term: str):
+        """Перша сторінка результату пошуку (фоновий потік) -> (rows, чи це весь результат)"""
+        query = self._current_query(config, search_term)
+        rows = self.db.query(*query.page(self.table.page_size))
+        return rows, len(rows) < self.table.page_size
+
+    def _show_search(self, config: Dict[str, Any], search_term: str, rows):
+        # Решту сторінок результату таблиця довантажить сама під час прокрутки
+        query = self._current_query(config, search_term)
+        self.table.load(query, on_error=lambda e: print(f"Search error: {e}"), first_page=rows)
+
+    def _on_live_changes(self, config: Dict[str, Any], changes):
+        self.search.invalidate()
+        if changes is None:
+            return self.table.reload()
+        base = changes.get(config["table"], {})
+        self.table.apply_changes(upserted=[k for k, op in base.items() if op != "DELETE"],
+                                 deleted=[k for k, op in base.items() if op == "DELETE"],
+                                 refresh_visible=any(table != config["table"] for table in changes))
+
+    def _patch_rows(self, config: Dict[str, Any], keys, inserted: bool = False):
+        """Перечитати змінені рядки запитом таблиці (з JOIN-колонками) і оновити лише їх у Treeview"""
+        query = self.table.query
+        if query is None:
+            return self._refresh_table(config)
+        self.search.reset()
+
+        def fetch():
+            found = {str(r[query.key]): r for r in self.db.query(*query.rows(keys))}
+            return [(key, found.get(str(key))) for key in keys]
+
+        def done(result):
+            if self.table.query is not query:
+                return
+            for key, row in result:
+                if inserted:
+                    if row is not None:
+                        self.table.show_row(key)
+                elif not self.table.update_row(key, row) and row is not None:
+                    self.table.show_row(key)
 
-        try:
-            cols, rows = self.db.query_with_columns(query, params)
-            for item in self.tree.get_children(): self.tree.delete(item)
-            for row in rows:
-                values = [row.get(col) for col in display_fields]
-                self.tree.insert("", tk.END, values=values)
-        except Exception as e:
-            print(f"Search error: {e}")
+        DbTask(self, self.db, fetch, on_done=done,
+               on_error=lambda e: messagebox.showerror("Помилка", f"Помилка оновлення таблиці: {e}"), busy=self.busy)
 
     def _add_record(self, config):
         self._show_record_dialog(config, "Додати запис")
@@ -557,16 +701,259 @@ class CRUDFrame(tk.Frame):
         if not selection:
             messagebox.showwarning("Увага", "Виберіть запис!")
             return
+        if len(selection) > 1:
+            return self._bulk_delete(config, selection)
         if not messagebox.askyesno("Підтвердження", "Видалити запис?"): return
         rid = self.tree.item(selection[0])['values'][0]
         pk = config.get("pk", "id")
         try:
             self.db.execute(f'DELETE FROM {config["table"]} WHERE {pk}=%s', [rid])
-            self._refresh_table(config)
+            self.search.reset()
+            self.table.update_row(selection[0])
             messagebox.showinfo("Успіх", "Видалено")
         except Exception as e:
             messagebox.showerror("Помилка", f"Неможливо видалити (можливо, є пов'язані записи): {e}")
 
+    # =====================================================
+    # МАСОВІ ОПЕРАЦІЇ
+    # =====================================================
+    def _import_records(self, config: Dict[str, Any]):
+        """Імпорт CSV/XLSX: заголовки колонок — підписи полів форми (або назви колонок таблиці)"""
+        fname = filedialog.askopenfilename(filetypes=[("CSV / Excel", "*.csv *.xlsx"), ("CSV", "*.csv"),
+                                                      ("Excel", "*.xlsx")])
+        if not fname: return
+
+        def done(result):
+            text = f"Імпортовано записів: {result.inserted}\nВідхилено: {len(result.rejected)}"
+            if result.ignored:
+                text += f"\nПропущені колонки: {', '.join(result.ignored)}"
+            if not result.rejected:
+                messagebox.showinfo("Імпорт", text)
+            elif messagebox.askyesno("Імпорт", text + "\n\nЗберегти звіт про відхилені рядки?"):
+                report = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv")],
+                                                      initialfile="rejected.csv")
+                if report:
+                    try:
+                        result.write_rejects(report, [f["name"] for f in config["fields"]])
+                    except Exception as e:
+                        messagebox.showerror("Помилка", str(e))
+            if result.inserted:
+                self._refresh_table(config)
+
+        DbTask(self, self.db, lambda: EntityImporter(self.db, config).run(fname), on_done=done,
+               on_error=lambda e: messagebox.showerror("Помилка імпорту", f"Нічого не імпортовано: {e}"),
+               busy=self.busy)
+
+    def _selected_keys(self, config: Dict[str, Any], selection):
+        """(колонка таблиці, [ключі]) для виділених рядків — для WHERE col = ANY(%s)"""
+        col = compile_entity(config).key_column or config.get("pk", "id")
+        return col, [self.tree.item(iid)['values'][0] for iid in selection]
+
+    def _delete_preview(self, config: Dict[str, Any], col: str, keys) -> str:
+        """Скільки рядків зачепить видалення: самі записи і каскадно залежні через FK"""
+        table = config["table"]
+        refs = self.db.query_cached("""
+            SELECT c.conrelid::regclass::text AS child, a.attname AS fk_col, c.confdeltype AS action
+            FROM pg_constraint c
+                     JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+                     JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1]
+            WHERE c.contype = 'f' AND c.confrelid = %s::regclass
+              AND array_length(c.conkey, 1) = 1 AND ra.attname = %s
+        """, [table, col], tables=["pg_constraint"])
+
+        parts = [f"SELECT %s AS tbl, %s AS action, count(*) AS cnt FROM {table} WHERE {col} = ANY(%s)"]
+        params = [table, "", keys]
+        for r in refs:
+            parts.append(f"SELECT %s, %s, count(*) FROM {r['child']} WHERE {r['fk_col']} = ANY(%s)")
+            params += [r["child"], r["action"], keys]
+        counts = self.db.query(" UNION ALL ".join(parts), params)
+
+        actions = {"c": "буде видалено", "n": "посилання буде очищено", "d": "посилання буде скинуто"}
+        lines = [f"Буде видалено записів: {counts[0]['cnt']}"]
+        for r in counts[1:]:
+            if r["cnt"]:
+                what = actions.get(r["action"], "блокує видалення")
+                lines.append(f"  • {r['tbl']}: {r['cnt']} ({what})")
+        return "\n".join(lines)
+
+    def _bulk_delete(self, config: Dict[str, Any], selection):
+        col, keys = self._selected_keys(config, selection)
+
+        def preview():
+            try:
+                return self._delete_preview(config, col, keys)
+            except Exception as e:
+                print(f"Delete preview error: {e}")
+                return f"Виділено записів: {len(keys)}"
+
+        def delete():
+            # Один DELETE в одній транзакції: або видаляються всі записи, або жоден
+            with self.db.transaction():
+                return self.db.query(f'DELETE FROM {config["table"]} WHERE {col} = ANY(%s) RETURNING {col}', [keys])
+
+        def deleted(rows):
+            self.search.reset()
+            for r in rows:
+                self.table.update_row(r[col])
+            messagebox.showinfo("Успіх", f"Видалено записів: {len(rows)}")
+
+        def confirm(text):
+            if not messagebox.askyesno("Підтвердження", f"{text}\n\nВидалити виділені записи?"): return
+            DbTask(self, self.db, delete, on_done=deleted,
+                   on_error=lambda e: messagebox.showerror(
+                       "Помилка", f"Неможливо видалити (можливо, є пов'язані записи): {e}"),
+                   busy=self.busy)
+
+        # Підрахунок залежних записів і сам DELETE — у фоні, діалоги — з Tk-потоку
+        DbTask(self, self.db, preview, on_done=confirm, busy=self.busy)
+
+    def _bulk_edit(self, config: Dict[str, Any]):
+        selection = self.tree.selection()
+        if not selection:
+            messagebox.showwarning("Увага", "Виберіть записи!")
+            return
+        col, keys = self._selected_keys(config, selection)
+        fields = {f["label"]: f for f in config["fields"]}
+
+        dialog = tk.Toplevel(self)
+        dialog.title("Масова зміна")
+        dialog.transient(self.winfo_toplevel())
+        dialog.bind('<Escape>', lambda e: dialog.destroy())
+
+        frame = ttk.Frame(dialog, padding=20)
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text=f"Виділено записів: {len(keys)}", font=("Segoe UI", 12, "bold")).grid(
+            row=0, column=0, columnspan=2, sticky="w", pady=(0, 15))
+
+        ttk.Label(frame, text="Поле:", width=12).grid(row=1, column=0, sticky="w")
+        field_var = tk.StringVar(value=next(iter(fields)))
+        field_combo = ttk.Combobox(frame, textvariable=field_var, values=list(fields), state="readonly", width=30)
+        field_combo.grid(row=1, column=1, sticky="ew", pady=5)
+
+        ttk.Label(frame, text="Нове значення:", width=12).grid(row=2, column=0, sticky="w")
+        value_holder = ttk.Frame(frame)
+        value_holder.grid(row=2, column=1, sticky="ew", pady=5)
+        preview_label = ttk.Label(frame, text="", foreground="gray")
+        preview_label.grid(row=3, column=0, columnspan=2, sticky="w", pady=(10, 0))
+        state = {"widget": None}
+
+        def on_field(event=None):
+            for w in value_holder.winfo_children(): w.destroy()
+            field = fields[field_var.get()]
+            if field["type"] == "combo":
+                if "options" in field:
+                    vals = list(field["options"])
+                else:
+                    sql = field.get("custom_query") or source_sql(field["source"], field.get("source_display", "name"))
+                    try:
+                        vals = self.lookups.values(sql)
+                    except Exception as e:
+                        vals = []
+                        print(f"Lookup error: {e}")
+                w = ttk.Combobox(value_holder, values=([""] + vals) if not field.get("required") else vals,
+                                 state="readonly", width=28)
+                w.bind("<<ComboboxSelected>>", update_preview)
+            elif field["type"] == "date":
+                w = DateEntry(value_holder, date_pattern="yyyy-mm-dd", width=25)
+                w.bind("<<DateEntrySelected>>", update_preview)
+            else:
+                w = ttk.Entry(value_holder, width=30)
+                w.bind("<KeyRelease>", update_preview)
+            w.pack(fill=tk.X)
+            state["widget"] = w
+            update_preview()
+
+        def new_value():
+            field = fields[field_var.get()]
+            val = state["widget"].get().strip()
+            if field["type"] == "combo":
+                # Фіксований список "options" зберігається як є, довідник — як id з "id: підпис"
+                if "options" in field:
+                    return field, val or None
+                return field, int(val.split(":")[0]) if val else None
+            if field["type"] == "int":
+                return field, int(val) if val else None
+            return field, val or None
+
+        def update_preview(event=None):
+            # Підрахунок — у фоні і не частіше ніж раз на PREVIEW_DELAY_MS під час набору
+            if state.get("after_id"):
+                dialog.after_cancel(state["after_id"])
+            state["after_id"] = dialog.after(PREVIEW_DELAY_MS, run_preview)
+
+        def run_preview():
+            state["after_id"] = None
+            state["preview_no"] = preview_no = state.get("preview_no", 0) + 1
+            try:
+                field, value = new_value()
+            except ValueError:
+                preview_label.config(text="Некоректне значення")
+                return
+
+            def fetch():
+                return self.db.query(
+                    f'SELECT count(*) AS cnt FROM {config["table"]} '
+                    f'WHERE {col} = ANY(%s) AND {field["name"]} IS DISTINCT FROM %s', [keys, value])[0]["cnt"]
+
+            def show(cnt):
+                # Відповідь на застарілий запит (значення вже змінено) ігнорується
+                if preview_no == state["preview_no"]:
+                    preview_label.config(text=f"Буде змінено записів: {cnt} з {len(keys)}")
+
+            def failed(e):
+                if preview_no == state["preview_no"]:
+                    preview_label.config(text=f"Помилка: {e}")
+
+            DbTask(preview_label, self.db, fetch, on_done=show, on_error=failed)
+
+        def apply():
+            try:
+                field, value = new_value()
+            except ValueError:
+                messagebox.showwarning("Увага", "Некоректне значення", parent=dialog)
+                return
+            if field.get("required") and value is None:
+                messagebox.showwarning("Увага", f"Поле '{field['label']}' обов'язкове", parent=dialog)
+                return
+            assignments = {field["name"]: value}
+            if config["table"] == "military_personnel" and field["name"] == "military_unit_id":
+                # Переведення в іншу частину знімає з посад у ротах/взводах/відділеннях старої частини
+                assignments.update(company_id=None, platoon_id=None, squad_id=None)
+            elif (config["table"] == "military_units" and field["name"] in ("division_id", "brigade_id")
+                  and value is not None):
+                assignments["brigade_id" if field["name"] == "division_id" else "division_id"] = None
+
+            set_cl = ", ".join(f"{k} = %s" for k in assignments)
+
+            def update():
+                # Один UPDATE на всі записи в одній транзакції
+                with self.db.transaction():
+                    return self.db.query(
+                        f'UPDATE {config["table"]} SET {set_cl} WHERE {col} = ANY(%s) RETURNING {col}',
+                        list(assignments.values()) + [keys])
+
+            def done(changed):
+                if dialog.winfo_exists():
+                    dialog.destroy()
+                messagebox.showinfo("Успіх", f"Змінено записів: {len(changed)}")
+                if changed:
+                    self._patch_rows(config, [r[col] for r in changed])
+
+            def failed(e):
+                if dialog.winfo_exists():
+                    apply_btn.config(state=tk.NORMAL)
+                messagebox.showerror("Помилка бази даних", f"Деталі: {e}",
+                                     parent=dialog if dialog.winfo_exists() else None)
+
+            # Діалог лишається відкритим (кнопка вимкнена), доки UPDATE не завершиться у фоні
+            apply_btn.config(state=tk.DISABLED)
+            DbTask(self, self.db, update, on_done=done, on_error=failed, busy=self.busy)
+
+        field_combo.bind("<<ComboboxSelected>>", on_field)
+        apply_btn = ttk.Button(frame, text="💾 Застосувати", command=apply)
+        apply_btn.grid(row=4, column=0, columnspan=2, sticky="ew", pady=(20, 0))
+        on_field()
+
     def _show_record_dialog(self, config: Dict[str, Any], title: str, record_data: Optional[Dict] = None):
         dialog = tk.Toplevel(self)
         dialog.title(title)
@@ -675,17 +1062,18 @@ class CRUDFrame(tk.Frame):
                             command=update_unit_visibility).pack(side=tk.LEFT, padx=5)
 
         def update_child_combo(child_name, table, fk_col, parent_id_str):
+            # Роти/взводи/відділення беруться з дерева обраної частини (один запит на частину)
             child_widget = widgets.get(child_name)
             if not child_widget: return
             child_widget.set("")
-            if not parent_id_str:
+            unit_str = widgets['military_unit_id'].get() if 'military_unit_id' in widgets else ""
+            if not parent_id_str or not unit_str:
                 child_widget['values'] = []
                 return
             try:
                 parent_id = int(parent_id_str.split(":")[0])
-                sql = f"SELECT id, name as d_val FROM {table} WHERE {fk_col} = {parent_id} ORDER BY name"
-                data = self.db.query(sql)
-                vals = [f"{r['id']}: {r['d_val']}" for r in data]
+                tree = self.lookups.subunits(int(unit_str.split(":")[0]))
+                vals = [f"{i}: {name}" for i, name in tree[table].get(parent_id, [])]
                 vals.insert(0, "")
                 child_widget['values'] = vals
             except Exception as e:
@@ -706,6 +1094,31 @@ class CRUDFrame(tk.Frame):
             val = widgets['platoon_id'].get()
             update_child_combo('squad_id', 'squads', 'platoon_id', val)
 
+        def combo_now(field):
+            return not (config["table"] == "military_personnel" and not record_data
+                        and field["name"] in ['company_id', 'platoon_id', 'squad_id'])
+
+        def lookup_sql(field):
+            if "custom_query" in field:
+                return field["custom_query"]
+            if "source" in field:
+                return source_sql(field["source"], field.get("source_display", "name"))
+            return None
+
+        # Усі довідники діалогу (і ті, з яких підписуються збережені значення) — одним запитом
+        wanted = []
+        for field in config["fields"]:
+            if field["type"] != "combo":
+                continue
+            if combo_now(field) and lookup_sql(field):
+                wanted.append(lookup_sql(field))
+            if record_data and record_data.get(field["name"]) is not None and "source" in field:
+                wanted.append(source_sql(field["source"], field.get("source_display", "name")))
+        try:
+            self.lookups.load(wanted)
+        except Exception as e:
+            print(f"Lookup error: {e}")
+
         for field in config["fields"]:
             f_name = field["name"]
             f_label = field["label"] + (" *" if field.get("required") else "")
@@ -721,24 +1134,13 @@ class CRUDFrame(tk.Frame):
             if field["type"] == "date":
                 w = DateEntry(row, date_pattern="yyyy-mm-dd", width=25)
             elif field["type"] == "combo":
-                load_now = True
-                if config["table"] == "military_personnel" and f_name in ['company_id', 'platoon_id',
-                                                                          'squad_id'] and not record_data:
-                    load_now = False
-
                 vals = []
-                if load_now:
-                    if "custom_query" in field:
-                        try:
-                            data = self.db.query(field["custom_query"])
-                            vals = [f"{r['id']}: {r['d_val']}" for r in data]
-                        except:
-                            pass
-                    elif "source" in field:
-                        disp = field.get("source_display", "name")
+                if combo_now(field):
+                    if "options" in field:
+                        vals = list(field["options"])
+                    elif lookup_sql(field):
                         try:
-                            data = self.db.query(f'SELECT id, {disp} as d_val FROM {field["source"]} ORDER BY {disp}')
-                            vals = [f"{r['id']}: {r['d_val']}" for r in data]
+                            vals = self.lookups.values(lookup_sql(field))
                         except:
                             pass
                     if not field.get("required"): vals.insert(0, "")
@@ -753,7 +1155,9 @@ class CRUDFrame(tk.Frame):
             if record_data and f_name in record_data:
                 val = record_data[f_name]
                 if val is not None:
-                    if field["type"] == "combo":
+                    if field["type"] == "combo" and "options" in field:
+                        w.set(val)
+                    elif field["type"] == "combo":
                         search_prefix = f"{val}:"
                         found = False
                         for item in w['values']:
@@ -763,10 +1167,9 @@ class CRUDFrame(tk.Frame):
                                 break
                         if not found and "source" in field:
                             try:
-                                t_src = field["source"]
-                                t_disp = field.get("source_display", "name")
-                                res = self.db.query(f"SELECT {t_disp} FROM {t_src} WHERE id={val}")
-                                if res: w.set(f"{val}: {res[0][t_disp]}")
+                                label = self.lookups.label(
+                                    source_sql(field["source"], field.get("source_display", "name")), val)
+                                if label is not None: w.set(f"{val}: {label}")
                             except:
                                 w.set(val)
                     elif field["type"] == "date":
@@ -846,6 +1249,8 @@ class CRUDFrame(tk.Frame):
 
                 if f["type"] == "int":
                     data[f["name"]] = int(val) if val else None
+                elif f["type"] == "combo" and "options" in f:
+                    data[f["name"]] = val if val else None
                 elif f["type"] == "combo":
                     data[f["name"]] = int(val.split(":")[0]) if val else None
                 else:
@@ -894,19 +1299,25 @@ class CRUDFrame(tk.Frame):
                     except:
                         pass
 
+            key_col = compile_entity(config).key_column
+            returning = f" RETURNING {key_col}" if key_col else ""
             try:
                 if record_data:
                     set_cl = ", ".join([f"{k}=%s" for k in data])
                     params = list(data.values()) + [record_data[pk]]
-                    self.db.execute(f'UPDATE {config["table"]} SET {set_cl} WHERE {pk}=%s', params)
+                    changed = self.db.query(f'UPDATE {config["table"]} SET {set_cl} WHERE {pk}=%s{returning}', params)
                 else:
                     cols = ", ".join(data.keys())
                     phs = ", ".join(["%s"] * len(data))
-                    self.db.execute(f'INSERT INTO {config["table"]} ({cols}) VALUES ({phs})', list(data.values()))
+                    changed = self.db.query(f'INSERT INTO {config["table"]} ({cols}) VALUES ({phs}){returning}',
+                                            list(data.values()))
 
                 messagebox.showinfo("Успіх", "Запис успішно збережено!")
                 dialog.destroy()
-                self._refresh_table(config)
+                if key_col and changed:
+                    self._patch_rows(config, [r[key_col] for r in changed], inserted=not record_data)
+                else:
+                    self._refresh_table(config)
 
             except Exception as e:
                 if "duplicate key" in str(e):
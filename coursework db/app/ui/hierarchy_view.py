@@ -3,13 +3,16 @@ import tkinter as tk
 from tkinter import ttk
 
 from db import Database
+from lookups import lookup_cache
+from ui.worker import DbTask, BusyIndicator
+from ui.live import LiveUpdates
 
 
 # ----------------------------
 # ФУНКЦІЇ-ПОМІЧНИКИ (повертають список кортежів: (id, label, next_level))
 # ----------------------------
 def get_districts_rows(db: Database):
-    rows = db.query("SELECT id, name FROM military_districts ORDER BY name")
+    rows = db.query("SELECT id, name FROM military_districts ORDER BY name", prepare=True)
     return [(r["id"], r["name"], "army") for r in rows]
 
 
@@ -19,8 +22,8 @@ def get_armies_rows(db: Database, district_id: int):
         FROM armies
         WHERE military_district_id = %s
         ORDER BY number
-    """, (district_id,))
-    return [(r["id"], f"Армія {r['number']} — {r['name'] or ''}".strip(" — "), "corps") for r in rows]
+    """, (district_id,), prepare=True)
+    return [(r["id"], f"Армія {r['number']} — {r['name'] or ''}".strip(" — "), "army") for r in rows]
 
 
 def get_corps_rows(db: Database, army_id: int):
@@ -29,8 +32,8 @@ def get_corps_rows(db: Database, army_id: int):
         FROM corps
         WHERE army_id = %s
         ORDER BY number
-    """, (army_id,))
-    return [(r["id"], f"Корпус {r['number']} — {r['name'] or ''}".strip(" — "), "corps_children") for r in rows]
+    """, (army_id,), prepare=True)
+    return [(r["id"], f"Корпус {r['number']} — {r['name'] or ''}".strip(" — "), "corps") for r in rows]
 
 
 def get_corps_children_rows(db: Database, corps_id: int):
@@ -42,7 +45,7 @@ def get_corps_children_rows(db: Database, corps_id: int):
         FROM divisions
         WHERE corps_id = %s
         ORDER BY number
-    """, (corps_id,))
+    """, (corps_id,), prepare=True)
     for r in divs:
         label = f"Дивізія {r['number']} — {r['name'] or ''}".strip(" — ")
         result.append((r["id"], label, "division"))
@@ -52,7 +55,7 @@ def get_corps_children_rows(db: Database, corps_id: int):
         FROM brigades
         WHERE corps_id = %s
         ORDER BY number
-    """, (corps_id,))
+    """, (corps_id,), prepare=True)
     for r in brs:
         label = f"Бригада {r['number']} — {r['name'] or ''}".strip(" — ")
         result.append((r["id"], label, "brigade"))
@@ -66,7 +69,7 @@ def get_units_rows_by_division(db: Database, division_id: int):
         FROM military_units
         WHERE division_id = %s
         ORDER BY number
-    """, (division_id,))
+    """, (division_id,), prepare=True)
     return [(r["id"], f"Частина {r['number']} — {r['name'] or ''}".strip(" — "), "unit") for r in rows]
 
 
@@ -76,7 +79,7 @@ def get_units_rows_by_brigade(db: Database, brigade_id: int):
         FROM military_units
         WHERE brigade_id = %s
         ORDER BY number
-    """, (brigade_id,))
+    """, (brigade_id,), prepare=True)
     return [(r["id"], f"Частина {r['number']} — {r['name'] or ''}".strip(" — "), "unit") for r in rows]
 
 
@@ -86,7 +89,7 @@ def get_companies_rows(db: Database, unit_id: int):
         FROM companies
         WHERE military_unit_id = %s
         ORDER BY name
-    """, (unit_id,))
+    """, (unit_id,), prepare=True)
     return [(r["id"], f"Рота: {r['name']}", "company") for r in rows]
 
 
@@ -96,7 +99,7 @@ def get_platoons_rows(db: Database, company_id: int):
         FROM platoons
         WHERE company_id = %s
         ORDER BY name
-    """, (company_id,))
+    """, (company_id,), prepare=True)
     return [(r["id"], f"Взвод: {r['name']}", "platoon") for r in rows]
 
 
@@ -106,7 +109,7 @@ def get_squads_rows(db: Database, platoon_id: int):
         FROM squads
         WHERE platoon_id = %s
         ORDER BY name
-    """, (platoon_id,))
+    """, (platoon_id,), prepare=True)
     return [(r["id"], f"Відділення: {r['name']}", None) for r in rows]  # None -> листок
 
 
@@ -122,6 +125,85 @@ LEVEL_FETCHERS = {
 }
 
 
+# Таблиця -> рівні вузлів, діти яких з неї беруться ("" — корінь дерева, округи)
+TABLE_LEVELS = {
+    "military_districts": ("",),
+    "armies": ("district",),
+    "corps": ("army",),
+    "divisions": ("corps",),
+    "brigades": ("corps",),
+    "military_units": ("division", "brigade"),
+    "companies": ("unit",),
+    "platoons": ("company",),
+    "squads": ("platoon",),
+}
+
+
+# ----------------------------
+# ЛІЧИЛЬНИКИ ВУЗЛІВ (особовий склад за категоріями, техніка, озброєння)
+# ----------------------------
+# Один запит на всю ієрархію над агрегатами, які підтримують тригери (personnel_counts,
+# equipment_counts, weapon_counts — рядок на частину × тип/звання, а не на кожного військового
+# чи одиницю техніки): GROUPING SETS по шляху частини (unit_hierarchy_path) дає суми для кожного
+# округу, армії, корпусу, дивізії, бригади і частини, а друга частина — для рот, взводів і відділень.
+ROLLUP_SQL = """
+    SELECT kind, node_id, measure, qty
+    FROM (
+        SELECT CASE WHEN GROUPING(p.unit_id) = 0 THEN 'unit'
+                    WHEN GROUPING(p.division_id) = 0 THEN 'division'
+                    WHEN GROUPING(p.brigade_id) = 0 THEN 'brigade'
+                    WHEN GROUPING(p.corps_id) = 0 THEN 'corps'
+                    WHEN GROUPING(p.army_id) = 0 THEN 'army'
+                    ELSE 'district' END AS kind,
+               COALESCE(p.unit_id, p.division_id, p.brigade_id, p.corps_id, p.army_id, p.district_id) AS node_id,
+               m.measure, SUM(m.qty) AS qty
+        FROM (
+            SELECT pc.military_unit_id AS unit_id, 'category:' || r.category_id AS measure, pc.qty
+            FROM personnel_counts pc
+                     JOIN ranks r ON pc.rank_id = r.id
+            UNION ALL
+            SELECT military_unit_id, 'equipment', qty FROM equipment_counts
+            UNION ALL
+            SELECT military_unit_id, 'weapons', qty FROM weapon_counts
+        ) m
+                 JOIN unit_hierarchy_path p ON p.unit_id = m.unit_id
+        GROUP BY GROUPING SETS ((p.district_id, m.measure), (p.army_id, m.measure), (p.corps_id, m.measure),
+                                (p.division_id, m.measure), (p.brigade_id, m.measure), (p.unit_id, m.measure))
+        UNION ALL
+        SELECT CASE WHEN GROUPING(pc.squad_id) = 0 THEN 'squad'
+                    WHEN GROUPING(pc.platoon_id) = 0 THEN 'platoon'
+                    ELSE 'company' END,
+               COALESCE(pc.squad_id, pc.platoon_id, pc.company_id),
+               'category:' || r.category_id, SUM(pc.qty)
+        FROM personnel_counts pc
+                 JOIN ranks r ON pc.rank_id = r.id
+        WHERE pc.company_id <> 0
+        GROUP BY GROUPING SETS ((pc.company_id, r.category_id), (pc.platoon_id, r.category_id),
+                                (pc.squad_id, r.category_id))
+    ) rollup
+    WHERE node_id IS NOT NULL AND node_id <> 0
+"""
+
+# Таблиці, зміна яких змінює лічильники (теги інвалідації кешу і підписка на події)
+ROLLUP_TABLES = ("military_personnel", "ranks", "equipment", "weapons", "personnel_counts", "equipment_counts",
+                 "weapon_counts", "unit_hierarchy_path", "military_units", "divisions", "brigades", "corps",
+                 "armies", "companies", "platoons", "squads")
+
+CATEGORIES_SQL = "SELECT id, name AS d_val FROM personnel_categories ORDER BY id"
+
+# Рівні, для яких техніка й озброєння не облікуються (вони закріплені за частиною)
+PERSONNEL_ONLY_LEVELS = ("company", "platoon", "squad")
+
+
+def get_rollup_counts(db: Database):
+    """(категорії [(id, назва)], {(рівень, id): {"category:<id>" / "equipment" / "weapons": кількість}})"""
+    categories = lookup_cache(db).items(CATEGORIES_SQL)
+    stats = {}
+    for r in db.query_cached(ROLLUP_SQL, tables=ROLLUP_TABLES):
+        stats.setdefault((r["kind"], r["node_id"]), {})[r["measure"]] = int(r["qty"])
+    return categories, stats
+
+
 # ----------------------------
 # HierarchyTree
 # ----------------------------
@@ -129,32 +211,47 @@ class HierarchyTree(tk.Frame):
     def __init__(self, master, db: Database):
         super().__init__(master)
         self.db = db
+        # Вузли, для яких дочірні елементи зараз завантажуються у фоні
+        self._pending = set()
+        # Лічильники вузлів з get_rollup_counts() і колонки, в яких вони показані
+        self._stats = {}
+        self._stat_columns = ()
 
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
-        self.tree = ttk.Treeview(self, show="tree")
+        # id і рівень вузла — приховані колонки; лічильники додаються після першого завантаження
+        self.tree = ttk.Treeview(self, show="tree headings", columns=("id", "level"), displaycolumns=())
+        self.tree.heading("#0", text="Підрозділ")
+        self.tree.column("#0", width=320, stretch=True)
         self.tree.grid(row=0, column=0, sticky="nsew")
 
         vsb = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
         vsb.grid(row=0, column=1, sticky="ns")
         self.tree.configure(yscrollcommand=vsb.set)
 
+        self.busy = BusyIndicator(self, text="⏳ Завантаження...")
+        self.busy.grid(row=1, column=0, sticky="w")
+
         self.tree.bind("<<TreeviewOpen>>", self.on_open)
 
+        # Зміни в таблицях ієрархії оновлюють лише вже розгорнуті вузли відповідного рівня
+        LiveUpdates(self.tree, self.db, set(TABLE_LEVELS) | set(ROLLUP_TABLES), self._on_live_changes)
+
         self.load_root_nodes()
+        self.load_stats()
 
     def load_root_nodes(self):
-        try:
-            rows = get_districts_rows(self.db)
-        except Exception as e:
-            self.tree.insert("", "end", text=f"(Помилка при завантаженні округів: {e})")
-            return
+        def show(rows):
+            for id_, label, next_lvl in rows:
+                node = self.tree.insert("", "end", text=f"Округ: {label}", values=(id_, "district"), open=False)
+                self._show_stats(node)
+                if next_lvl in LEVEL_FETCHERS:
+                    self.tree.insert(node, "end", text="loading")
 
-        for id_, label, next_lvl in rows:
-            node = self.tree.insert("", "end", text=f"Округ: {label}", values=(id_, "district"), open=False)
-            if next_lvl in LEVEL_FETCHERS:
-                self.tree.insert(node, "end", text="loading")
+        DbTask(self, self.db, lambda: get_districts_rows(self.db), on_done=show,
+               on_error=lambda e: self.tree.insert("", "end", text=f"(Помилка при завантаженні округів: {e})"),
+               busy=self.busy)
 
     def on_open(self, event):
         node = self.tree.focus()
@@ -170,25 +267,131 @@ class HierarchyTree(tk.Frame):
         children = self.tree.get_children(node)
         if children and self.tree.item(children[0], "text") != "loading":
             return
-
-        for ch in children:
-            self.tree.delete(ch)
+        if node in self._pending:
+            return
 
         fetcher = LEVEL_FETCHERS.get(level)
         if not fetcher:
             return
 
-        try:
-            items = fetcher(self.db, item_id)
-        except Exception as e:
-            self.tree.insert(node, "end", text=f"(Error: {e})")
+        # Запит іде у фоновому потоці; placeholder "loading" лишається до відповіді
+        self._pending.add(node)
+        DbTask(self, self.db, lambda: fetcher(self.db, item_id),
+               on_done=lambda items: self._fill_node(node, items),
+               on_error=lambda e: self._fill_node(node, [], error=e),
+               on_finish=lambda: self._pending.discard(node),
+               busy=self.busy)
+
+    # ----------------------------
+    # Лічильники
+    # ----------------------------
+    def load_stats(self):
+        DbTask(self, self.db, lambda: get_rollup_counts(self.db), on_done=self._apply_stats,
+               on_error=lambda e: print(f"Hierarchy counters error: {e}"))
+
+    def _apply_stats(self, result):
+        categories, self._stats = result
+        columns = tuple(f"category:{cat_id}" for cat_id, _ in categories) + ("equipment", "weapons")
+        if columns != self._stat_columns:
+            self._stat_columns = columns
+            self.tree.configure(columns=("id", "level") + columns, displaycolumns=columns)
+            titles = [name for _, name in categories] + ["Техніка", "Озброєння"]
+            for col, title in zip(columns, titles):
+                self.tree.heading(col, text=title)
+                self.tree.column(col, width=90, anchor="center", stretch=False)
+
+        todo = list(self.tree.get_children(""))
+        while todo:
+            node = todo.pop()
+            self._show_stats(node)
+            todo.extend(self.tree.get_children(node))
+
+    def _show_stats(self, node):
+        vals = self.tree.item(node, "values") or ()
+        if len(vals) < 2 or not self._stat_columns:
+            return
+        level = vals[1] or "squad"
+        counts = self._stats.get((level, int(vals[0])), {})
+        for col in self._stat_columns:
+            if level in PERSONNEL_ONLY_LEVELS and col in ("equipment", "weapons"):
+                self.tree.set(node, col, "")
+            else:
+                self.tree.set(node, col, counts.get(col, 0))
+
+    # ----------------------------
+    # Оновлення за подіями змін БД
+    # ----------------------------
+    def _loaded_nodes(self, levels):
+        """Вузли рівнів levels, діти яких уже завантажені (не placeholder "loading")"""
+        result, todo = [], list(self.tree.get_children(""))
+        while todo:
+            node = todo.pop()
+            children = self.tree.get_children(node)
+            if not children or self.tree.item(children[0], "text") == "loading":
+                continue
+            vals = self.tree.item(node, "values") or ()
+            if len(vals) >= 2 and vals[1] in levels:
+                result.append(node)
+            todo.extend(children)
+        return result
+
+    def _on_live_changes(self, changes):
+        tables = TABLE_LEVELS if changes is None else changes
+        levels = {lvl for table in tables for lvl in TABLE_LEVELS.get(table, ())}
+        if changes is None or set(changes) & set(ROLLUP_TABLES):
+            self.load_stats()
+
+        if "" in levels:
+            DbTask(self, self.db, lambda: get_districts_rows(self.db),
+                   on_done=lambda rows: self._merge_children("", [(i, f"Округ: {label}", "district")
+                                                                  for i, label, _ in rows]),
+                   on_error=lambda e: print(f"Hierarchy refresh error: {e}"))
+        for node in self._loaded_nodes(levels):
+            item_id, level = self.tree.item(node, "values")[:2]
+            fetcher = LEVEL_FETCHERS[level]
+            DbTask(self, self.db, lambda f=fetcher, i=int(item_id): f(self.db, i),
+                   on_done=lambda items, n=node: self._merge_children(n, items),
+                   on_error=lambda e: print(f"Hierarchy refresh error: {e}"))
+
+    def _merge_children(self, node, items):
+        """Замінити дітей вузла на items, зберігши вже розгорнуті піддерева тих, що лишились"""
+        if node and not self.tree.exists(node):
+            return
+        existing = {}
+        for ch in self.tree.get_children(node):
+            vals = self.tree.item(ch, "values") or ()
+            existing[tuple(str(v) for v in vals[:2])] = ch
+
+        keep = set()
+        for index, (child_id, child_label, child_next) in enumerate(items):
+            child = existing.get((str(child_id), child_next or ""))
+            if child is None:
+                child = self.tree.insert(node, index, text=child_label, values=(child_id, child_next or ""),
+                                         open=False)
+                self._show_stats(child)
+                if child_next and child_next in LEVEL_FETCHERS:
+                    self.tree.insert(child, "end", text="loading")
+            else:
+                self.tree.item(child, text=child_label)
+                self.tree.move(child, node, index)
+            keep.add(child)
+        for ch in self.tree.get_children(node):
+            if ch not in keep:
+                self.tree.delete(ch)
+
+    def _fill_node(self, node, items, error=None):
+        if not self.tree.exists(node):
+            return
+        for ch in self.tree.get_children(node):
+            self.tree.delete(ch)
+
+        if error is not None:
+            self.tree.insert(node, "end", text=f"(Error: {error})")
             return
 
         for child_id, child_label, child_next in items:
-            self.tree.insert(node, "end", text=child_label, values=(child_id, child_next or ""), open=False)
+            child = self.tree.insert(node, "end", text=child_label, values=(child_id, child_next or ""), open=False)
+            self._show_stats(child)
             if child_next and child_next in LEVEL_FETCHERS:
-                new_children = self.tree.get_children(node)
-                if new_children:
-                    last = new_children[-1]
-                    self.tree.insert(last, "end", text="loading")
+                self.tree.insert(child, "end", text="loading")
 
@@ -0,0 +1,68 @@
+# ui/live.py
+import threading
+import tkinter as tk
+
+# Як довго накопичуються події змін перед одним оновленням віджета (мс)
+COALESCE_MS = 250
+
+
+class LiveUpdates:
+    """Підписка віджета на події змін рядків БД (Database.subscribe, LISTEN row_changes).
+
+    Події приходять у потоці слухача і лише накопичуються; раз на delay_ms Tk-потік
+    забирає накопичене й викликає on_changes(changes) один раз на всю пачку, тож масове
+    завантаження тисяч рядків дає одне оновлення, а не тисячі перемальовувань.
+
+    changes = {таблиця: {id: остання операція ('INSERT' / 'UPDATE' / 'DELETE')}}
+              або None — події могли загубитися (перепідключення слухача), треба перечитати все.
+    Підписка знімається сама, коли віджет знищено."""
+
+    def __init__(self, widget, db, tables, on_changes, delay_ms: int = COALESCE_MS):
+        self.widget = widget
+        self.db = db
+        self.tables = frozenset(tables)
+        self._on_changes = on_changes
+        self.delay_ms = delay_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._resync = False
+        self._root = widget._root()
+        self._token = db.subscribe(self._on_event, self.tables)
+        self._after_id = self._root.after(self.delay_ms, self._flush)
+
+    def _on_event(self, event):
+        # Потік слухача: жодних викликів Tk, лише накопичення
+        with self._lock:
+            if event.get("op") == "RESYNC" or event.get("table") is None or event.get("id") is None:
+                self._resync = True
+            else:
+                self._pending.setdefault(event["table"], {})[event["id"]] = event["op"]
+
+    def _alive(self) -> bool:
+        try:
+            return bool(self.widget.winfo_exists())
+        except tk.TclError:
+            return False
+
+    def _flush(self):
+        if not self._alive():
+            self.close()
+            return
+        with self._lock:
+            pending, resync = self._pending, self._resync
+            self._pending, self._resync = {}, False
+        if resync or pending:
+            try:
+                self._on_changes(None if resync else pending)
+            except Exception as e:
+                print(f"Live update error: {e}")
+        self._after_id = self._root.after(self.delay_ms, self._flush)
+
+    def close(self):
+        self.db.unsubscribe(self._token)
+        if self._after_id is not None:
+            try:
+                self._root.after_cancel(self._after_id)
+            except tk.TclError:
+                pass
+            self._after_id = None
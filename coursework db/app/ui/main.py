@@ -1,11 +1,15 @@
+import re
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from auth import AuthService
 
 from ui.queries import QueriesFrame
 from ui.crud import CRUDFrame
 from ui.view import ViewFrame
 from ui.hierarchy_view import HierarchyTree
+from ui.worker import DbTask, BusyIndicator
+from ui.omnibox import Omnibox
+from search_index import SearchIndex
 
 # ========================================================
 # ПРАВА ДОСТУПУ
@@ -17,6 +21,17 @@ ROLES = {
     "Guest": {"users": False, "crud": False, "queries": False, "view": True, "schedule": False},
 }
 
+# Скільки рядків SELECT-результату SQL-консоль показує в таблиці
+SQL_CONSOLE_MAX_ROWS = 1000
+
+# Рядкові літерали, ідентифікатори в лапках, $$-рядки і коментарі — ';' всередині них не розділяє команди
+_SQL_NOISE_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$).*?\1|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def _is_single_statement(sql: str) -> bool:
+    """Чи містить текст рівно одну SQL-команду (крапка з комою лише в кінці)"""
+    return ";" not in _SQL_NOISE_RE.sub(" ", sql).strip().rstrip(";")
+
 # ========================================================
 # ТЕКСТИ ДЛЯ ДОВІДКИ (F1)
 # ========================================================
@@ -74,6 +89,7 @@ HELP_TEXTS = {
 1. Заявки: Підтвердження реєстрації нових користувачів та зміна їх ролей.
 2. Користувачі: Перегляд списку всіх акаунтів.
 3. SQL Консоль: Виконання прямих SQL-запитів до бази даних (для технічного обслуговування).
+4. Статистика запитів: Час виконання, кількість викликів і рядків для кожного запиту (пошук "гарячих" місць).
 """
 }
 
@@ -97,6 +113,7 @@ class MainFrame(tk.Frame):
 
         role = user.get("role", "Guest")
         caps = ROLES.get(role, ROLES["Guest"])
+        self.caps = caps
 
         # Ліва частина (Навігація)
         nav_frame = ttk.Frame(toolbar)
@@ -124,6 +141,14 @@ class MainFrame(tk.Frame):
         ttk.Button(user_frame, text="👤 Профіль", command=self._show_profile).pack(side=tk.LEFT, padx=5)
         ttk.Button(user_frame, text="🚪 Вийти", command=self._logout).pack(side=tk.LEFT, padx=5)
 
+        # Глобальний пошук (частини, особовий склад, техніка, озброєння, споруди)
+        if caps["view"]:
+            Omnibox(toolbar, self.db, on_open=self._open_search_result).pack(side=tk.RIGHT, padx=10)
+            search_index = SearchIndex(self.db)
+            DbTask(self, self.db,
+                   lambda: search_index.provision([{"table": "search_entries", "display_fields": ["search_text"]}]),
+                   on_error=lambda e: print(f"Search index error: {e}"))
+
         # Основний контейнер
         self.container = ttk.Frame(self)
         self.container.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
@@ -139,6 +164,20 @@ class MainFrame(tk.Frame):
         self._current = frame
         self._current.grid(row=0, column=0, sticky="nsew")
 
+    def _open_search_result(self, entity_type, entity_id):
+        """Перехід до знайденого запису: редагування (якщо є права) або перегляд"""
+        if self.caps["crud"]:
+            frame = CRUDFrame(self.container, self.db)
+            self._swap(frame)
+            if frame.open_record(entity_type, entity_id):
+                return
+        if self.caps["view"]:
+            frame = ViewFrame(self.container, self.db)
+            self._swap(frame)
+            if frame.open_record(entity_type, entity_id):
+                return
+        messagebox.showinfo("Пошук", "Цей запис недоступний для перегляду з вашою роллю")
+
     def _show_view(self):
         self._swap(ViewFrame(self.container, self.db))
 
@@ -300,33 +339,103 @@ class MainFrame(tk.Frame):
         lbl_status = ttk.Label(top_f, text="Ready", font=("Segoe UI", 9))
         lbl_status.pack(anchor="w")
 
+        def fetch_select(q):
+            # Серверний курсор: у таблицю потрапляють перші SQL_CONSOLE_MAX_ROWS рядків,
+            # решта лише рахується, тож пам'ять не росте разом із результатом.
+            # DECLARE CURSOR приймає лише одну команду — скрипт виконується звичайним запитом
+            if _is_single_statement(q):
+                cols, rows = self.db.query_iter_with_columns(q)
+            else:
+                cols, rows = self.db.query_with_columns(q)
+            head, total = [], 0
+            for r in rows:
+                if total < SQL_CONSOLE_MAX_ROWS:
+                    head.append(tuple(r))
+                total += 1
+            return cols, head, total
+
+        def show_select(result):
+            cols, head, total = result
+            tree_sql["columns"] = cols
+            for c in cols: tree_sql.heading(c, text=c); tree_sql.column(c, width=100)
+            for values in head: tree_sql.insert("", tk.END, values=values)
+            lbl_status.config(text=f"Rows: {total}" + (f" (показано {len(head)})" if len(head) < total else ""),
+                              foreground="green")
+
+        def show_error(e):
+            lbl_status.config(text=f"Error: {e}", foreground="red")
+            messagebox.showerror("SQL Error", str(e))
+
         def run_sql():
             q = sql_text.get("1.0", tk.END).strip()
             if not q: return
             tree_sql.delete(*tree_sql.get_children())
             tree_sql["columns"] = []
+            lbl_status.config(text="Running...", foreground="gray")
+            if q.upper().startswith("SELECT"):
+                DbTask(tab_sql, self.db, lambda: fetch_select(q), on_done=show_select, on_error=show_error,
+                       busy=sql_busy)
+            else:
+                DbTask(tab_sql, self.db, lambda: self.db.execute(q),
+                       on_done=lambda af: lbl_status.config(text=f"Affected: {af}", foreground="blue"),
+                       on_error=show_error, busy=sql_busy)
+
+        run_bar = ttk.Frame(top_f)
+        run_bar.pack(fill=tk.X)
+        ttk.Button(run_bar, text="▶ Run", command=run_sql).pack(side=tk.RIGHT)
+        sql_busy = BusyIndicator(run_bar)
+        sql_busy.pack(side=tk.LEFT)
+
+        # --- TAB 4: СТАТИСТИКА ЗАПИТІВ ---
+        tab_stats = ttk.Frame(notebook, padding=10)
+        notebook.add(tab_stats, text="Статистика запитів")
+
+        stats = self.db.stats
+        ttk.Label(tab_stats, text=f"Повільні запити (≥ {stats.slow_ms} мс) пишуться у: {stats.log_path or '—'}",
+                  font=("Segoe UI", 9)).pack(anchor="w", pady=(0, 5))
+
+        cols_s = ("calls", "total_ms", "avg_ms", "max_ms", "rows", "errors", "histogram", "sql")
+        heads_s = ("Викликів", "Всього, мс", "Сер., мс", "Макс., мс", "Рядків", "Помилок", "Гістограма (мс)", "SQL")
+        st_f = ttk.Frame(tab_stats)
+        st_f.pack(fill=tk.BOTH, expand=True)
+        sc_sy = ttk.Scrollbar(st_f)
+        sc_sy.pack(side=tk.RIGHT, fill=tk.Y)
+        tree_st = ttk.Treeview(st_f, columns=cols_s, show="headings", yscrollcommand=sc_sy.set)
+        sc_sy.config(command=tree_st.yview)
+        for c, h in zip(cols_s, heads_s):
+            tree_st.heading(c, text=h)
+            tree_st.column(c, width=70 if c not in ("histogram", "sql") else 220, anchor=tk.W)
+        tree_st.column("sql", width=600)
+        tree_st.pack(fill=tk.BOTH, expand=True)
+
+        def load_stats():
+            tree_st.delete(*tree_st.get_children())
+            labels = stats.histogram_labels()
+            for e in stats.snapshot():
+                hist = " ".join(f"{l}:{n}" for l, n in zip(labels, e["histogram"]) if n)
+                tree_st.insert("", tk.END, values=(e["calls"], f"{e['total_ms']:.1f}", f"{e['avg_ms']:.1f}",
+                                                   f"{e['max_ms']:.1f}", e["rows"], e["errors"], hist, e["sql"]))
+
+        def reset_stats():
+            stats.reset()
+            load_stats()
+
+        def save_stats():
+            fname = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text", "*.txt")])
+            if not fname: return
             try:
-                if q.upper().startswith("SELECT"):
-                    if hasattr(self.db, 'query_with_columns'):
-                        cols, rows = self.db.query_with_columns(q)
-                    else:
-                        rows = self.db.query(q)
-                        cols = list(rows[0].keys()) if rows else ["Result"]
-
-                    tree_sql["columns"] = cols
-                    for c in cols: tree_sql.heading(c, text=c); tree_sql.column(c, width=100)
-                    for r in rows: tree_sql.insert("", tk.END,
-                                                   values=tuple(r) if isinstance(r, (list, tuple)) else tuple(
-                                                       r.values()))
-                    lbl_status.config(text=f"Rows: {len(rows)}", foreground="green")
-                else:
-                    af = self.db.execute(q)
-                    lbl_status.config(text=f"Affected: {af}", foreground="blue")
+                with open(fname, "w", encoding="utf-8") as f:
+                    f.write(stats.dump())
+                messagebox.showinfo("Успіх", "Файл збережено!")
             except Exception as e:
-                lbl_status.config(text=f"Error: {e}", foreground="red")
-                messagebox.showerror("SQL Error", str(e))
+                messagebox.showerror("Помилка", str(e))
 
-        ttk.Button(top_f, text="▶ Run", command=run_sql).pack(anchor="e")
+        st_btns = ttk.Frame(tab_stats, padding=(0, 10))
+        st_btns.pack(fill=tk.X)
+        ttk.Button(st_btns, text="🔄 Оновити", command=load_stats).pack(side=tk.RIGHT)
+        ttk.Button(st_btns, text="💾 Зберегти дамп", command=save_stats).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(st_btns, text="🧹 Скинути", command=reset_stats).pack(side=tk.LEFT)
+        load_stats()
 
     def _show_help(self, event=None):
         role = self.user.get("role", "Guest")
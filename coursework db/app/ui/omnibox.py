@@ -0,0 +1,135 @@
+# ui/omnibox.py
+import tkinter as tk
+from tkinter import ttk
+
+from ui.search import SearchController
+
+# Скільки збігів показує випадаючий список
+OMNIBOX_LIMIT = 15
+
+ENTITY_LABELS = {
+    "military_units": "🏢 Частина",
+    "military_personnel": "👤 Військовий",
+    "equipment": "🚜 Техніка",
+    "weapons": "🔫 Озброєння",
+    "facilities": "🏗️ Споруда",
+}
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class Omnibox(ttk.Frame):
+    """Глобальний пошук по частинах, особовому складу, техніці, озброєнню та спорудах
+    через одну таблицю search_entries. on_open(entity_type, entity_id) — перехід до запису."""
+
+    def __init__(self, master, db, on_open, width=30):
+        super().__init__(master)
+        self.db = db
+        self.on_open = on_open
+        self._results = []
+
+        ttk.Label(self, text="🔍").pack(side=tk.LEFT)
+        self.var = tk.StringVar()
+        self.entry = ttk.Entry(self, textvariable=self.var, width=width)
+        self.entry.pack(side=tk.LEFT, padx=(2, 0))
+
+        # Випадаючий список результатів
+        self.popup = tk.Toplevel(self)
+        self.popup.withdraw()
+        self.popup.overrideredirect(True)
+        self.listbox = tk.Listbox(self.popup, height=10, activestyle="dotbox")
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+
+        self.search = SearchController(self, db, fetch=self._fetch, show=self._show,
+                                       matches=self._matches, on_clear=self._hide)
+
+        self.entry.bind("<KeyRelease>", self._on_key)
+        self.entry.bind("<Return>", lambda e: self._open(0 if not self.listbox.curselection() else None))
+        self.entry.bind("<Down>", lambda e: self._move(1))
+        self.entry.bind("<Up>", lambda e: self._move(-1))
+        self.entry.bind("<Escape>", lambda e: self._hide())
+        self.entry.bind("<FocusOut>", lambda e: self.after(200, self._hide_if_unfocused))
+        self.listbox.bind("<Double-Button-1>", lambda e: self._open())
+        self.listbox.bind("<Return>", lambda e: self._open())
+
+    # =====================================================
+    # ПОШУК
+    # =====================================================
+    def _on_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape"):
+            return
+        self.search.on_key(self.var.get())
+
+    @staticmethod
+    def _tokens(term: str):
+        return term.lower().split()
+
+    def _fetch(self, term: str):
+        tokens = self._tokens(term)
+        where = " AND ".join(["search_text LIKE %s"] * len(tokens))
+        params = [f"%{_like_escape(t)}%" for t in tokens]
+        rows = self.db.query(f"""
+            SELECT entity_type, entity_id, label, search_text
+            FROM search_entries
+            WHERE {where}
+            ORDER BY (search_text LIKE %s) DESC, length(label), label
+            LIMIT {OMNIBOX_LIMIT}
+        """, params + [f"{_like_escape(tokens[0])}%"])
+        return rows, len(rows) < OMNIBOX_LIMIT
+
+    def _matches(self, row, term: str) -> bool:
+        return all(t in row["search_text"] for t in self._tokens(term))
+
+    # =====================================================
+    # СПИСОК РЕЗУЛЬТАТІВ
+    # =====================================================
+    def _show(self, term, rows):
+        self._results = list(rows)
+        self.listbox.delete(0, tk.END)
+        if not self._results:
+            self.listbox.insert(tk.END, "Нічого не знайдено")
+        for r in self._results:
+            kind = ENTITY_LABELS.get(r["entity_type"], r["entity_type"])
+            self.listbox.insert(tk.END, f"{kind}: {r['label']}")
+
+        x = self.entry.winfo_rootx()
+        y = self.entry.winfo_rooty() + self.entry.winfo_height()
+        width = max(self.entry.winfo_width(), 350)
+        self.popup.geometry(f"{width}x{min(10, max(1, len(self._results))) * 20 + 4}+{x}+{y}")
+        self.popup.deiconify()
+        self.popup.lift()
+
+    def _hide(self):
+        self.popup.withdraw()
+
+    def _hide_if_unfocused(self):
+        try:
+            focused = self.focus_get()
+        except (KeyError, tk.TclError):
+            focused = None
+        if focused not in (self.entry, self.listbox):
+            self._hide()
+
+    def _move(self, step: int):
+        if not self._results:
+            return
+        cur = self.listbox.curselection()
+        idx = (cur[0] + step) if cur else (0 if step > 0 else len(self._results) - 1)
+        idx = max(0, min(idx, len(self._results) - 1))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(idx)
+        self.listbox.see(idx)
+
+    def _open(self, index=None):
+        if index is None:
+            cur = self.listbox.curselection()
+            if not cur:
+                return
+            index = cur[0]
+        if index >= len(self._results):
+            return
+        row = self._results[index]
+        self._hide()
+        self.on_open(row["entity_type"], row["entity_id"])
@@ -3,6 +3,31 @@ from tkinter import ttk, messagebox, filedialog
 import csv
 from tkcalendar import DateEntry
 
+from ui.worker import DbTask, BusyIndicator
+from lookups import lookup_cache, source_sql
+from unit_stats import unit_stats
+
+# ===================================================================
+# ЗВІТИ-ОБРОБНИКИ ("handler" замість "sql"): handler(db, values) -> (колонки, рядки)
+# ===================================================================
+STATS_LEVELS = {"Армія": "army", "Корпус": "corps", "Дивізія": "division", "Бригада": "brigade"}
+STATS_ORDER = ["Найбільше", "Найменше"]
+
+
+def _stats_rows(items):
+    cols = ["Підрозділ", "К-сть частин"]
+    return cols, [dict(zip(cols, (label, units))) for _, label, units in items]
+
+
+def army_units_extreme(fewest: bool):
+    return lambda db, values: _stats_rows(unit_stats(db).extreme("army", fewest=fewest))
+
+
+def units_ranking(db, values):
+    fewest = values["order"] == STATS_ORDER[1]
+    return _stats_rows(unit_stats(db).top(STATS_LEVELS[values["level"]], values["limit"], fewest=fewest))
+
+
 # ===================================================================
 # ГРУПОВАНА СТРУКТУРА ЗАПИТІВ (З РОЗУМНИМИ ПАРАМЕТРАМИ)
 # ===================================================================
@@ -67,28 +92,27 @@ QUERY_GROUPS = {
         {
             "name": "Наявність техніки (Всього)",
             "sql": """
-                   SELECT et.name AS "Тип", et.category AS "Категорія", COUNT(e.id) AS "Кількість", mu.name AS "Частина"
-                   FROM equipment e
-                            JOIN equipment_types et ON e.equipment_type_id = et.id
-                            JOIN military_units mu ON e.military_unit_id = mu.id
+                   SELECT et.name AS "Тип", et.category AS "Категорія", SUM(ec.qty) AS "Кількість", mu.name AS "Частина"
+                   FROM equipment_counts ec
+                            JOIN equipment_types et ON ec.equipment_type_id = et.id
+                            JOIN military_units mu ON ec.military_unit_id = mu.id
                    GROUP BY et.name, et.category, mu.name
                    ORDER BY mu.name;
                    """,
-            "params": []
+            "params": [],
+            # Звіт читає агрегатну таблицю — поруч із результатом показується час її оновлення
+            "freshness": ["equipment_counts"]
         },
         {
             "name": "Техніка в Армії (за категорією)",
             "sql": """
                    SELECT e.model, e.serial_number, mu.name as "Частина"
-                   FROM equipment e
+                   FROM unit_hierarchy_path p
+                            JOIN military_units mu ON mu.id = p.unit_id
+                            JOIN equipment e ON e.military_unit_id = p.unit_id
                             JOIN equipment_types et ON e.equipment_type_id = et.id
-                            JOIN military_units mu ON e.military_unit_id = mu.id
-                            LEFT JOIN divisions d ON mu.division_id = d.id
-                            LEFT JOIN brigades b ON mu.brigade_id = b.id
-                            LEFT JOIN corps c ON c.id = COALESCE(d.corps_id, b.corps_id)
-                            LEFT JOIN armies a ON a.id = c.army_id
                    WHERE et.category = %(cat_name)s
-                     AND a.id = %(army_id)s;
+                     AND p.army_id = %(army_id)s;
                    """,
             "params": [
                 {"name": "cat_name", "label": "Категорія", "type": "manual_combo",
@@ -102,18 +126,15 @@ QUERY_GROUPS = {
         {
             "name": "Звіт по озброєнню (Округ)",
             "sql": """
-                   SELECT wt.name AS "Зброя", COUNT(w.id) AS "Кількість", md.name AS "Округ"
-                   FROM weapons w
-                            JOIN weapon_types wt ON w.weapon_type_id = wt.id
-                            JOIN military_units mu ON w.military_unit_id = mu.id
-                            LEFT JOIN divisions d ON mu.division_id = d.id
-                            LEFT JOIN brigades b ON mu.brigade_id = b.id
-                            LEFT JOIN corps c ON c.id = COALESCE(d.corps_id, b.corps_id)
-                            LEFT JOIN armies a ON a.id = c.army_id
-                            LEFT JOIN military_districts md ON md.id = a.military_district_id
+                   SELECT wt.name AS "Зброя", SUM(wc.qty) AS "Кількість", md.name AS "Округ"
+                   FROM weapon_counts wc
+                            JOIN weapon_types wt ON wc.weapon_type_id = wt.id
+                            JOIN unit_hierarchy_path p ON p.unit_id = wc.military_unit_id
+                            LEFT JOIN military_districts md ON md.id = p.district_id
                    GROUP BY wt.name, md.name;
                    """,
-            "params": []
+            "params": [],
+            "freshness": ["weapon_counts"]
         },
         {
             "name": "Озброєння частини",
@@ -129,17 +150,22 @@ QUERY_GROUPS = {
     "5. Статистика": [
         {
             "name": "Армія з найбільшою к-стю частин",
-            "sql": """
-                   SELECT a.name, COUNT(mu.id)
-                   FROM armies a
-                            JOIN corps c ON c.army_id = a.id
-                            LEFT JOIN divisions d ON d.corps_id = c.id
-                            LEFT JOIN brigades b ON b.corps_id = c.id
-                            LEFT JOIN military_units mu ON (mu.division_id = d.id OR mu.brigade_id = b.id)
-                   GROUP BY a.id, a.name
-                   ORDER BY 2 DESC LIMIT 1;
-                   """,
+            "handler": army_units_extreme(fewest=False),
             "params": []
+        },
+        {
+            "name": "Армія з найменшою к-стю частин",
+            "handler": army_units_extreme(fewest=True),
+            "params": []
+        },
+        {
+            "name": "Рейтинг за к-стю частин (Top-N)",
+            "handler": units_ranking,
+            "params": [
+                {"name": "level", "label": "Рівень", "type": "manual_combo", "values": list(STATS_LEVELS)},
+                {"name": "order", "label": "Порядок", "type": "manual_combo", "values": STATS_ORDER},
+                {"name": "limit", "label": "Кількість (N)", "type": "int"}
+            ]
         }
     ],
     "6. Керівний склад": [
@@ -147,14 +173,11 @@ QUERY_GROUPS = {
             "name": "Командири частин (в Армії)",
             "sql": """
                    SELECT mu.name AS "Частина", mp.last_name AS "Командир", r.name AS "Звання"
-                   FROM military_units mu
+                   FROM unit_hierarchy_path p
+                            JOIN military_units mu ON mu.id = p.unit_id
                             JOIN military_personnel mp ON mu.commander_id = mp.id
                             JOIN ranks r ON mp.rank_id = r.id
-                            LEFT JOIN divisions d ON mu.division_id = d.id
-                            LEFT JOIN brigades b ON mu.brigade_id = b.id
-                            LEFT JOIN corps c ON c.id = COALESCE(d.corps_id, b.corps_id)
-                            LEFT JOIN armies a ON a.id = c.army_id
-                   WHERE a.id = %(army_id)s;
+                   WHERE p.army_id = %(army_id)s;
                    """,
             "params": [{"name": "army_id", "label": "Армія", "type": "db_combo",
                         "table": "armies", "display": "name"}]
@@ -165,14 +188,10 @@ QUERY_GROUPS = {
             "name": "Локації частин округу",
             "sql": """
                    SELECT mu.name, loc.address
-                   FROM military_units mu
+                   FROM unit_hierarchy_path p
+                            JOIN military_units mu ON mu.id = p.unit_id
                             JOIN locations loc ON mu.location_id = loc.id
-                            LEFT JOIN divisions d ON mu.division_id = d.id
-                            LEFT JOIN brigades b ON mu.brigade_id = b.id
-                            LEFT JOIN corps c ON c.id = COALESCE(d.corps_id, b.corps_id)
-                            LEFT JOIN armies a ON a.id = c.army_id
-                            LEFT JOIN military_districts md ON md.id = a.military_district_id
-                   WHERE md.id = %(dist_id)s;
+                   WHERE p.district_id = %(dist_id)s;
                    """,
             "params": [{"name": "dist_id", "label": "Округ", "type": "db_combo",
                         "table": "military_districts", "display": "name"}]
@@ -227,6 +246,19 @@ QUERY_GROUPS = {
 }
 
 
+def param_source_sql(p) -> str:
+    """SQL довідника (id, d_val) для параметра типу db_combo"""
+    return source_sql(p["table"], p.get("display", "name"), p.get("condition", ""))
+
+
+def param_sources(queries=None):
+    """Довідники всіх db_combo-параметрів (усіх звітів QUERY_GROUPS або лише queries) без повторів"""
+    if queries is None:
+        queries = [q for group in QUERY_GROUPS.values() for q in group]
+    return list(dict.fromkeys(param_source_sql(p) for q in queries
+                              for p in q.get("params", []) if p["type"] == "db_combo"))
+
+
 # ========================================
 # QUERIES FRAME (Логіка інтерфейсу)
 # ========================================
@@ -235,7 +267,12 @@ class QueriesFrame(tk.Frame):
     def __init__(self, master, db):
         super().__init__(master)
         self.db = db
+        # Спільний кеш довідників: значення параметрів не перечитуються при перемиканні звітів
+        self.lookups = lookup_cache(db)
         self.current_query_config = None
+        # (конфігурація звіту, параметри) останнього виконання — експорт повторює саме його
+        self._last_run = None
+        self._run_task = None
         self._param_widgets = []
 
         self.columnconfigure(0, weight=1)
@@ -266,8 +303,12 @@ class QueriesFrame(tk.Frame):
 
         self.btn_run = ttk.Button(btn_frame, text="▶ Виконати", command=self._run, state=tk.DISABLED)
         self.btn_run.pack(side=tk.LEFT)
+        self.busy = BusyIndicator(btn_frame)
+        self.busy.pack(side=tk.LEFT, padx=10)
         self.btn_export = ttk.Button(btn_frame, text="💾 Експорт", command=self._export, state=tk.DISABLED)
         self.btn_export.pack(side=tk.RIGHT)
+        self.freshness_label = ttk.Label(btn_frame, text="", foreground="gray")
+        self.freshness_label.pack(side=tk.RIGHT, padx=10)
 
         tree_frame = ttk.Frame(self)
         tree_frame.grid(row=3, column=0, sticky="nsew", padx=10, pady=(0, 10))
@@ -281,6 +322,10 @@ class QueriesFrame(tk.Frame):
         sb_y.pack(side=tk.RIGHT, fill=tk.Y)
         sb_x.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # Довідники параметрів усіх звітів — одним запитом у фоні, поки користувач обирає звіт
+        DbTask(self, self.db, lambda: self.lookups.load(param_sources()),
+               on_error=lambda e: print(f"Error preloading report parameters: {e}"))
+
     def _on_category_select(self, event):
         cat = self.cat_combo.get()
         queries = QUERY_GROUPS.get(cat, [])
@@ -297,6 +342,8 @@ class QueriesFrame(tk.Frame):
         q_name = self.query_combo.get()
         queries = QUERY_GROUPS.get(cat, [])
         self.current_query_config = next((q for q in queries if q['name'] == q_name), None)
+        self._last_run = None
+        self.btn_export.config(state=tk.DISABLED)
 
         if self.current_query_config:
             self.btn_run.config(state=tk.NORMAL)
@@ -317,6 +364,12 @@ class QueriesFrame(tk.Frame):
             ttk.Label(self.params_frame, text="Параметри не потрібні", foreground="gray").pack(anchor="w")
             return
 
+        # Якщо попереднє завантаження ще не завершилось або довідник скинуто — добрати одним запитом
+        try:
+            self.lookups.load(param_sources([cfg]))
+        except Exception as e:
+            print(f"Error loading report parameters: {e}")
+
         for p in params:
             row = ttk.Frame(self.params_frame)
             row.pack(fill=tk.X, pady=2)
@@ -328,15 +381,7 @@ class QueriesFrame(tk.Frame):
 
             if p["type"] == "db_combo":
                 try:
-                    table = p["table"]
-                    display = p.get("display", "name")
-                    cond = p.get("condition", "")
-                    where_clause = f"WHERE {cond}" if cond else ""
-
-                    query = f"SELECT id, {display} FROM {table} {where_clause} ORDER BY {display}"
-                    data = self.db.query(query)
-
-                    values = [f"{r['id']}: {r[display]}" for r in data]
+                    values = self.lookups.values(param_source_sql(p))
                     widget = ttk.Combobox(row, values=values, state="readonly", width=30)
                 except Exception as e:
                     print(f"Error loading combo for {p['name']}: {e}")
@@ -388,8 +433,27 @@ class QueriesFrame(tk.Frame):
 
             values[meta["name"]] = final_val
 
-        try:
-            cols, rows = self.db.query_with_columns(self.current_query_config["sql"], values)
+        cfg = self.current_query_config
+        sql = cfg.get("sql")
+        handler = cfg.get("handler")
+        freshness = cfg.get("freshness")
+
+        def fetch():
+            result = handler(self.db, values) if handler else self.db.query_with_columns(sql, values)
+            refreshed = None
+            if freshness:
+                found = self.db.query("SELECT MIN(refreshed_at) AS ts FROM aggregate_refresh WHERE name = ANY(%s)",
+                                      [freshness])
+                refreshed = found[0]["ts"] if found else None
+            return result, refreshed
+
+        def show(fetched):
+            (cols, rows), refreshed = fetched
+            if cfg is not self.current_query_config:
+                return
+            self._last_run = (cfg, values)
+            self.freshness_label.config(
+                text=f"🕒 Дані станом на {refreshed.astimezone():%Y-%m-%d %H:%M:%S}" if refreshed else "")
 
             self.tree.delete(*self.tree.get_children())
             self.tree["columns"] = cols
@@ -402,22 +466,42 @@ class QueriesFrame(tk.Frame):
                 self.tree.insert("", tk.END, values=vals)
 
             self.btn_export.config(state=tk.NORMAL if rows else tk.DISABLED)
-        except Exception as e:
-            messagebox.showerror("SQL Помилка", str(e))
+
+        # Звіт виконується у фоновому потоці, вікно не "зависає" на час запиту
+        self.btn_run.config(state=tk.DISABLED)
+        self._run_task = DbTask(self, self.db, fetch,
+                                on_done=show,
+                                on_error=lambda e: messagebox.showerror("SQL Помилка", str(e)),
+                                on_finish=lambda: self.btn_run.config(state=tk.NORMAL),
+                                busy=self.busy)
 
     def _export(self):
-        items = self.tree.get_children()
-        if not items: return
+        if self._last_run is None: return
+        cfg, values = self._last_run
 
         fname = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV", "*.csv")])
         if not fname: return
 
-        try:
+        header = list(self.tree["columns"])
+
+        def write():
+            # Запит виконується повторно через серверний курсор — рядки пишуться у файл пачками
             with open(fname, 'w', newline='', encoding='utf-8-sig') as f:
                 writer = csv.writer(f)
-                writer.writerow(self.tree["columns"])
-                for i in items:
-                    writer.writerow(self.tree.item(i)['values'])
-            messagebox.showinfo("Успіх", "Файл збережено!")
-        except Exception as e:
-            messagebox.showerror("Помилка", str(e))
\ No newline at end of file
+                writer.writerow(header)
+                handler = cfg.get("handler")
+                if handler:
+                    cols, rows = handler(self.db, values)
+                    writer.writerows([r[c] for c in cols] for r in rows)
+                else:
+                    for r in self.db.query_iter(cfg["sql"], values):
+                        writer.writerow(list(r))
+
+        # Повторний запит і запис файлу — у фоновому потоці, як і сам звіт
+        self.btn_export.config(state=tk.DISABLED)
+        DbTask(self, self.db, write,
+               on_done=lambda _: messagebox.showinfo("Успіх", "Файл збережено!"),
+               on_error=lambda e: messagebox.showerror("Помилка", str(e)),
+               on_finish=lambda: self.btn_export.config(
+                   state=tk.NORMAL if self._last_run is not None else tk.DISABLED),
+               busy=self.busy)
@@ -0,0 +1,127 @@
+# ui/search.py
+from ui.worker import DbTask
+
+# Пауза після останнього натискання клавіші, після якої запускається пошук (мс)
+DEBOUNCE_MS = 300
+
+
+class SearchController:
+    """Пошук під час набору: debounce натискань, скасування попереднього запиту,
+    відкидання застарілих відповідей за номером запиту та звуження попереднього
+    результату на клієнті, якщо новий термін лише доповнює старий.
+
+    fetch(term) -> (rows, complete)  виконується у фоновому потоці; complete=True,
+                                     якщо rows — увесь результат (без LIMIT-обрізання)
+    show(term, rows)                 показ результату (Tk-потік)
+    matches(row, term) -> bool       фільтр для звуження на клієнті (None — завжди в БД)
+    on_clear()                       порожній термін — повернутися до звичайного списку
+    """
+
+    def __init__(self, widget, db, fetch, show, matches=None, on_clear=None, on_error=None,
+                 busy=None, delay_ms: int = DEBOUNCE_MS):
+        self.widget = widget
+        self.db = db
+        self._fetch = fetch
+        self._show = show
+        self._matches = matches
+        self._on_clear = on_clear
+        self._on_error = on_error
+        self._busy = busy
+        self.delay_ms = delay_ms
+
+        self._after_id = None
+        self._task = None
+        self._seq = 0
+        self._pending_term = None
+        # Останній повний результат: (term, rows) — база для звуження
+        self._complete = None
+
+    def on_key(self, term: str):
+        """Виклик з <KeyRelease>: відкласти пошук до паузи в наборі"""
+        term = term.strip()
+        if term == self._pending_term:
+            return
+        self._pending_term = term
+        self._cancel_timer()
+        self._after_id = self.widget.after(self.delay_ms, self._fire)
+
+    def search_now(self, term: str):
+        """Пошук без затримки (Enter)"""
+        self._pending_term = term.strip()
+        self._cancel_timer()
+        self._fire()
+
+    def reset(self):
+        """Забути попередні результати (після зміни даних чи таблиці)"""
+        self.cancel()
+        self._pending_term = None
+        self._complete = None
+
+    def invalidate(self):
+        """Дані змінились: попередній результат більше не база для звуження (пошук, що йде, не скасовується)"""
+        self._complete = None
+
+    def cancel(self):
+        self._cancel_timer()
+        self._seq += 1
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _cancel_timer(self):
+        if self._after_id is not None:
+            try:
+                self.widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def _fire(self):
+        self._after_id = None
+        term = self._pending_term or ""
+        self.cancel()
+        seq = self._seq
+
+        if not term:
+            self._complete = None
+            if self._on_clear:
+                self._on_clear()
+            return
+
+        base = self._complete
+        if self._matches is not None and base is not None and term.lower().startswith(base[0].lower()):
+            # Новий термін звужує попередній, а попередній результат повний — БД не потрібна
+            rows = [r for r in base[1] if self._matches(r, term)]
+            self._complete = (term, rows)
+            self._show(term, rows)
+            return
+
+        def done(result):
+            if seq != self._seq:
+                return
+            rows, complete = result
+            self._complete = (term, rows) if complete else None
+            self._show(term, rows)
+
+        def error(e):
+            if seq != self._seq:
+                return
+            if self._on_error:
+                self._on_error(e)
+            else:
+                print(f"Search error: {e}")
+
+        self._task = DbTask(self.widget, self.db, lambda: self._fetch(term), on_done=done, on_error=error,
+                            busy=self._busy)
+
+
+def row_matches(fields):
+    """Фільтр для звуження: term входить (без урахування регістру) у будь-яке з полів — як ILIKE '%term%'"""
+    def matches(row, term):
+        needle = term.lower()
+        for f in fields:
+            val = row.get(f) if hasattr(row, "get") else row[f]
+            if val is not None and needle in str(val).lower():
+                return True
+        return False
+    return matches
@@ -1,11 +1,25 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 
+from search_index import SearchIndex
+from ui.worker import DbTask, BusyIndicator
+from ui.search import SearchController, row_matches
+from ui.live import LiveUpdates
+
+# Скільки рядків показує пошук
+SEARCH_LIMIT = 50
+# Скільки рядків показує звичайний перегляд
+LIST_LIMIT = 100
+
 
 class ViewFrame(tk.Frame):
     def __init__(self, master, db):
         super().__init__(master)
         self.db = db
+        self.search_index = SearchIndex(db)
+        self._load_task = None
+        # Що зараз у таблиці: "list" — перші LIST_LIMIT записів за id, "search" / "record" — вибірка
+        self._mode = "list"
 
         self.columnconfigure(0, weight=1)
         self.rowconfigure(1, weight=1)
@@ -20,6 +34,9 @@ class ViewFrame(tk.Frame):
         self.entity_combo.pack(side=tk.LEFT, padx=5)
         self.entity_combo.bind("<<ComboboxSelected>>", self._on_entity_select)
 
+        self.busy = BusyIndicator(top_panel)
+        self.busy.pack(side=tk.RIGHT, padx=5)
+
         self.content_frame = ttk.Frame(self)
         self.content_frame.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
         self.content_frame.columnconfigure(0, weight=1)
@@ -59,10 +76,25 @@ class ViewFrame(tk.Frame):
         }
 
         self.entity_combo['values'] = list(self.entities.keys())
+        DbTask(self, self.db, lambda: self.search_index.provision(list(self.entities.values())),
+               on_error=lambda e: print(f"Search index error: {e}"))
         if self.entities:
             self.entity_combo.current(0)
             self._on_entity_select(None)
 
+    def open_record(self, table: str, record_id) -> bool:
+        """Показати таблицю table лише з записом record_id"""
+        for entity_name, config in self.entities.items():
+            if config["table"] == table:
+                self.entity_var.set(entity_name)
+                self._on_entity_select(None)
+                fields = ", ".join(config["display_fields"])
+                self._load_rows(config, f"SELECT id, {fields} FROM {table} WHERE id = %s", [record_id],
+                                on_error=lambda e: print(f"Error loading view: {e}"))
+                self._mode = "record"
+                return True
+        return False
+
     def _on_entity_select(self, event):
         entity_name = self.entity_var.get()
         if not entity_name: return
@@ -80,7 +112,15 @@ class ViewFrame(tk.Frame):
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
         search_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
-        search_entry.bind('<KeyRelease>', lambda e: self._search(config))
+        search_entry.bind('<KeyRelease>', lambda e: self.search.on_key(self.search_var.get()))
+        search_entry.bind('<Return>', lambda e: self.search.search_now(self.search_var.get()))
+        self.search = SearchController(
+            self, self.db,
+            fetch=lambda term: self._search(config, term),
+            show=lambda term, rows: self._show_search(config, rows),
+            matches=lambda row, term: row_matches(self._search_fields(config))(row, term),
+            on_clear=lambda: self._load_data(config),
+            busy=self.busy)
 
         ttk.Button(search_frame, text="🔄 Оновити", command=lambda: self._load_data(config)).pack(side=tk.RIGHT)
 
@@ -101,43 +141,106 @@ class ViewFrame(tk.Frame):
         vsb.grid(row=1, column=1, sticky="ns")
         hsb.grid(row=2, column=0, sticky="ew")
 
+        LiveUpdates(self.tree, self.db, [config["table"]], lambda changes: self._on_live_changes(config, changes))
+
         self._load_data(config)
 
     def _load_data(self, config):
         table = config["table"]
         fields = ", ".join(config["display_fields"])
-        sql = f"SELECT {fields} FROM {table} ORDER BY id LIMIT 100"
+        sql = f"SELECT id, {fields} FROM {table} ORDER BY id LIMIT {LIST_LIMIT}"
 
-        try:
-            for i in self.tree.get_children(): self.tree.delete(i)
+        self._mode = "list"
+        self._load_rows(config, sql, None, on_error=lambda e: print(f"Error loading view: {e}"))
 
-            rows = self.db.query(sql)
-            for row in rows:
-                vals = [row[f] for f in config["display_fields"]]
-                self.tree.insert("", tk.END, values=vals)
-        except Exception as e:
-            print(f"Error loading view: {e}")
-
-    def _search(self, config):
-        query_text = self.search_var.get().strip()
-        if not query_text:
-            self._load_data(config)
+    def _load_rows(self, config, sql, params, on_error):
+        """Виконати запит у фоновому потоці й замінити ним вміст таблиці"""
+        if self._load_task is not None:
+            self._load_task.cancel()
+
+        self.search.reset()
+        self._load_task = DbTask(self, self.db, lambda: self.db.query(sql, params),
+                                 on_done=lambda rows: self._show_rows(config, rows),
+                                 on_error=on_error, busy=self.busy)
+
+    def _show_rows(self, config, rows):
+        fields = config["display_fields"]
+        tree = self.tree
+        for i in tree.get_children(): tree.delete(i)
+        for row in rows:
+            vals = [row[f] for f in fields]
+            tree.insert("", tk.END, iid=str(row["id"]), values=vals)
+
+    def _show_search(self, config, rows):
+        # Повне завантаження, що ще виконується, не повинно перезаписати результат пошуку
+        if self._load_task is not None:
+            self._load_task.cancel()
+        self._mode = "search"
+        self._show_rows(config, rows)
+
+    def _on_live_changes(self, config, changes):
+        """Зміни рядків таблиці з подій БД: видалені прибираються, змінені перечитуються одним запитом,
+        нові з'являються лише у звичайному перегляді (перші LIST_LIMIT за id)"""
+        self.search.invalidate()
+        if changes is None:
+            if self._mode == "list":
+                self._load_data(config)
+            return
+        events = changes.get(config["table"], {})
+        for key, op in events.items():
+            if op == "DELETE" and self.tree.exists(str(key)):
+                self.tree.delete(str(key))
+        keys = [k for k, op in events.items()
+                if op != "DELETE" and (self.tree.exists(str(k)) or self._mode == "list")]
+        if not keys:
             return
 
-        table = config["table"]
         fields = config["display_fields"]
+        sql = f"SELECT id, {', '.join(fields)} FROM {config['table']} WHERE id = ANY(%s) ORDER BY id"
+        tree = self.tree
+
+        def apply(rows):
+            if not tree.winfo_exists():
+                return
+            for row in rows:
+                iid, vals = str(row["id"]), [row[f] for f in fields]
+                if tree.exists(iid):
+                    tree.item(iid, values=vals)
+                    continue
+                ids = [int(i) for i in tree.get_children()]
+                index = next((i for i, other in enumerate(ids) if other > row["id"]), len(ids))
+                if index < LIST_LIMIT:
+                    tree.insert("", index, iid=iid, values=vals)
+            extra = tree.get_children()[LIST_LIMIT:] if self._mode == "list" else ()
+            if extra:
+                tree.delete(*extra)
+
+        DbTask(self, self.db, lambda: self.db.query(sql, [keys]), on_done=apply,
+               on_error=lambda e: print(f"Live update error: {e}"))
+
+    def _search_fields(self, config):
+        """Поля, по яких шукає _search (і звужується результат на клієнті)"""
+        return config["display_fields"]
+
+    def _search(self, config, query_text):
+        """Пошук (фоновий потік) -> (rows, чи це весь результат)"""
+        table = config["table"]
+        fields = self._search_fields(config)
+
+        # Через триграмний індекс: найсхожіші записи першими
+        indexed = self.search_index.search_sql(f"SELECT id, {', '.join(fields)} FROM {table}",
+                                               table, fields, query_text)
+        if indexed is not None:
+            sql, params = indexed
+            rows = self.db.query(f"{sql} ORDER BY {SearchIndex.RANK_COLUMN} DESC, search_sub.id "
+                                 f"LIMIT {SEARCH_LIMIT}", params)
+            return rows, len(rows) < SEARCH_LIMIT
 
         where_parts = [f"{f}::text ILIKE %s" for f in fields]
         where_sql = " OR ".join(where_parts)
 
-        sql = f"SELECT {', '.join(fields)} FROM {table} WHERE {where_sql} LIMIT 50"
+        sql = f"SELECT id, {', '.join(fields)} FROM {table} WHERE {where_sql} LIMIT {SEARCH_LIMIT}"
         params = [f"%{query_text}%"] * len(fields)
 
-        try:
-            for i in self.tree.get_children(): self.tree.delete(i)
-            rows = self.db.query(sql, params)
-            for row in rows:
-                vals = [row[f] for f in fields]
-                self.tree.insert("", tk.END, values=vals)
-        except Exception as e:
-            print(f"Search error: {e}")
\ No newline at end of file
+        rows = self.db.query(sql, params)
+        return rows, len(rows) < SEARCH_LIMIT
\ No newline at end of file
@@ -0,0 +1,396 @@
+# ui/virtual_table.py
+import tkinter as tk
+from tkinter import ttk
+
+from ui.worker import DbTask
+
+# Розмір сторінки (рядків), що вибирається одним запитом
+PAGE_SIZE = 200
+# Скільки сторінок одночасно тримає Treeview
+WINDOW_PAGES = 3
+# Частка прокрутки від краю, після якої довантажується наступна/попередня сторінка
+EDGE = 0.15
+
+
+class VirtualTable(ttk.Frame):
+    """Treeview з keyset-пагінацією: рядки вибираються сторінками PageQuery
+    (WHERE (sort) > last ORDER BY sort LIMIT n), наступна сторінка підтягується заздалегідь,
+    а в таблиці тримається лише вікно з кількох сторінок."""
+
+    def __init__(self, master, db, busy=None, page_size: int = PAGE_SIZE, window_pages: int = WINDOW_PAGES):
+        super().__init__(master)
+        self.db = db
+        self.busy = busy
+        self.page_size = page_size
+        self.window_pages = max(2, window_pages)
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree = ttk.Treeview(self, show="headings")
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self._v_scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self._v_scroll.grid(row=0, column=1, sticky="ns")
+        h_scroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+        h_scroll.grid(row=1, column=0, sticky="ew")
+        self.tree.configure(yscrollcommand=self._on_yscroll, xscrollcommand=h_scroll.set)
+
+        self._query = None
+        self._key = None
+        self._columns = []
+        self._on_error = None
+        # Поколінням відсікаються відповіді на запити, що належали попередньому load()
+        self._generation = 0
+        self._task = None
+        self._pages = []            # [(first_key, last_key, кількість рядків)] у вікні
+        self._first_key = None      # межа першої сторінки результату (None — ще невідома)
+        self._at_end = False        # далі рядків немає
+        self._prefetched = None     # наступна сторінка, вибрана заздалегідь
+        self._prefetch_task = None
+        self._want_next = False     # користувач докрутив до кінця, поки сторінка ще вибиралася
+        self._start_key = None      # вікно відкрито не з початку, а з цього ключа (open_record)
+        self._select_key = None     # рядок, який треба виділити, щойно він з'явиться
+        self._bounds = {}           # iid -> межа сортування рядка (для вставки нових рядків на своє місце)
+
+    # =====================================================
+    # ПУБЛІЧНИЙ ІНТЕРФЕЙС
+    # =====================================================
+    def set_columns(self, columns, headers=None, widths=None):
+        self._columns = list(columns)
+        self.tree["columns"] = self._columns
+        for i, col in enumerate(self._columns):
+            self.tree.heading(col, text=(headers or self._columns)[i])
+            width = widths.get(col, 120) if widths else 120
+            self.tree.column(col, width=width, anchor=tk.W)
+
+    def load(self, query, on_error=None, first_page=None, start=None):
+        """Показати результат query (query_builder.PageQuery), починаючи з першої сторінки.
+        first_page — вже вибрана перша сторінка (query.page() без bound), щоб не вибирати її вдруге.
+        start — відкрити вікно з рядка query.key == start (рядки перед ним довантажуються прокруткою вгору)
+        і виділити цей рядок."""
+        self._query = query
+        self._key = query.key
+        self._start_key = start
+        self._select_key = None if start is None else str(start)
+        self._on_error = on_error
+        self.reload(first_page)
+
+    def reload(self, first_page=None):
+        self._cancel_tasks()
+        self._generation += 1
+        self._pages = []
+        self._first_key = None
+        self._at_end = False
+        self._prefetched = None
+        self._want_next = False
+        self._bounds = {}
+        self.tree.delete(*self.tree.get_children())
+        if first_page is not None:
+            self._append(first_page)
+        elif self._query is not None:
+            self._fetch_forward()
+
+    def cancel(self):
+        self._cancel_tasks()
+        self._generation += 1
+
+    @property
+    def query(self):
+        return self._query
+
+    def update_row(self, key, row=None) -> bool:
+        """Оновити рядок key на місці (row — свіжий рядок query) або прибрати його (row=None).
+        False — рядка немає у вікні."""
+        iid = str(key)
+        if not self.tree.exists(iid):
+            return False
+        if row is not None:
+            self.tree.item(iid, values=self._values(row))
+            return True
+        index = self.tree.index(iid)
+        self.tree.delete(iid)
+        self._bounds.pop(iid, None)
+        # Зменшити лічильник сторінки, якій належав рядок
+        for i, (first, last, count) in enumerate(self._pages):
+            if index < count:
+                self._pages[i] = (first, last, count - 1)
+                break
+            index -= count
+        # Передвибрана сторінка може містити рядок, що вже є у вікні — краще вибрати її заново
+        self._prefetched = None
+        return True
+
+    def apply_changes(self, upserted=(), deleted=(), refresh_visible: bool = False):
+        """Застосувати зміни рядків з подій БД до вікна без повного перезавантаження.
+        upserted — ключі вставлених/змінених рядків, deleted — видалених;
+        refresh_visible — змінились пов'язані таблиці, перечитати всі рядки вікна."""
+        if self._query is None:
+            return
+        for key in deleted:
+            self.update_row(key)
+        visible = set(self.tree.get_children())
+        keys = {str(k): k for k in upserted}
+        new = [k for iid, k in keys.items() if iid not in visible]
+        if len(new) > self.page_size:
+            # Масове завантаження — дешевше перечитати вікно, ніж вставляти рядки по одному
+            return self.reload()
+        if refresh_visible:
+            for iid in visible:
+                keys.setdefault(iid, self._bounds.get(iid, (iid,))[-1])
+        keys = {iid: k for iid, k in keys.items() if iid in visible or k in new}
+        if not keys:
+            return
+
+        query, generation = self._query, self._generation
+
+        def fetch():
+            return self.db.query(*query.rows(list(keys.values())))
+
+        def done(rows):
+            if generation != self._generation:
+                return
+            found = {str(r[self._key]): r for r in rows}
+            for iid, key in keys.items():
+                row = found.get(iid)
+                if self.tree.exists(iid):
+                    self.update_row(key, row)
+                elif row is not None:
+                    self._insert_sorted(row)
+
+        DbTask(self, self.db, fetch, on_done=done,
+               on_error=lambda e: self._on_error(e) if self._on_error else print(f"Live update error: {e}"))
+
+    def show_row(self, key):
+        """Відкрити вікно з рядка key (напр. щойно доданого) і виділити його"""
+        if self._query is None:
+            return
+        self._start_key = key
+        self._select_key = str(key)
+        self.reload()
+
+    # =====================================================
+    # ВИБІРКА СТОРІНОК
+    # =====================================================
+    def _start(self, forward: bool, bound, on_done, busy=True, start=None):
+        query, limit = self._query, self.page_size
+        if start is not None:
+            def fetch():
+                # Спершу межа сортування для рядка start, потім сторінка від нього включно
+                found = self.db.query(*query.row(start))
+                if not found:
+                    return self.db.query(*query.page(limit))
+                return self.db.query(*query.page(limit, query.bound(found[0]), inclusive=True))
+        else:
+            def fetch():
+                return self.db.query(*query.page(limit, bound, forward))
+        generation = self._generation
+
+        def done(rows):
+            if generation == self._generation:
+                on_done(rows)
+
+        def error(e):
+            if generation != self._generation:
+                return
+            if self._on_error:
+                self._on_error(e)
+            else:
+                print(f"Page load error: {e}")
+
+        return DbTask(self, self.db, fetch, on_done=done, on_error=error, busy=self.busy if busy else None)
+
+    def _loading(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _fetch_forward(self):
+        if self._loading() or self._at_end:
+            return
+        if self._prefetched is not None:
+            rows, self._prefetched = self._prefetched, None
+            self._append(rows)
+            return
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            # Сторінка вже в дорозі — покажемо її, щойно вона прийде
+            self._want_next = True
+            return
+        if self._pages:
+            self._task = self._start(True, self._pages[-1][1], self._append)
+        else:
+            self._task = self._start(True, None, self._append, start=self._start_key)
+
+    def _prefetch(self):
+        if self._at_end or not self._pages or self._prefetched is not None:
+            return
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            return
+
+        def keep(rows):
+            self._prefetch_task = None
+            if self._want_next:
+                self._want_next = False
+                self._append(rows)
+            else:
+                self._prefetched = rows
+
+        self._prefetch_task = self._start(True, self._pages[-1][1], keep, busy=False)
+
+    def _fetch_backward(self):
+        if self._loading() or not self._pages:
+            return
+        self._task = self._start(False, self._pages[0][0], self._prepend)
+
+    def _cancel_tasks(self):
+        for task in (self._task, self._prefetch_task):
+            if task is not None:
+                task.cancel()
+        self._task = self._prefetch_task = None
+
+    # =====================================================
+    # ВІКНО РЯДКІВ
+    # =====================================================
+    def _bound(self, row):
+        return self._query.bound(row)
+
+    def _values(self, row):
+        return [row.get(col) if row.get(col) is not None else "" for col in self._columns]
+
+    def _anchor(self):
+        """Перший видимий рядок — щоб після зміни вікна повернути прокрутку на нього"""
+        return self.tree.identify_row(5)
+
+    def _restore(self, anchor):
+        if not anchor or not self.tree.exists(anchor):
+            return
+        total = len(self.tree.get_children())
+        if total:
+            self.tree.yview_moveto(self.tree.index(anchor) / total)
+
+    def _append(self, rows):
+        # Чи є далі рядки, вирішує кількість вибраних з БД рядків, а не вставлених у вікно
+        if len(rows) < self.page_size:
+            self._at_end = True
+        if not rows:
+            return
+        anchor = self._anchor()
+        inserted = 0
+        for row in rows:
+            iid = str(row[self._key])
+            if not self.tree.exists(iid):
+                self.tree.insert("", tk.END, iid=iid, values=self._values(row))
+                inserted += 1
+            self._bounds[iid] = self._bound(row)
+        if not self._pages and self._start_key is None:
+            self._first_key = self._bound(rows[0])
+        # Рядки, що вже були у вікні (вставлені _insert_sorted), пораховані у своїй сторінці;
+        # межа наступного keyset-запиту — останній вибраний рядок
+        if inserted or not self._pages:
+            self._pages.append((self._bound(rows[0]), self._bound(rows[-1]), inserted))
+        else:
+            first, _, count = self._pages[-1]
+            self._pages[-1] = (first, self._bound(rows[-1]), count)
+        self._select_pending()
+
+        if len(self._pages) > self.window_pages:
+            _, _, count = self._pages.pop(0)
+            self._forget(self.tree.get_children()[:count])
+            self._restore(anchor)
+        self._prefetch()
+
+    def _prepend(self, rows):
+        if len(rows) < self.page_size:
+            # Дійшли до початку результату
+            self._first_key = self._bound(rows[-1]) if rows else self._pages[0][0]
+        if not rows:
+            return
+        rows = list(reversed(rows))
+        anchor = self._anchor()
+        inserted = 0
+        for i, row in enumerate(rows):
+            iid = str(row[self._key])
+            if not self.tree.exists(iid):
+                self.tree.insert("", i, iid=iid, values=self._values(row))
+                inserted += 1
+            self._bounds[iid] = self._bound(row)
+        if inserted:
+            self._pages.insert(0, (self._bound(rows[0]), self._bound(rows[-1]), inserted))
+        else:
+            _, last, count = self._pages[0]
+            self._pages[0] = (self._bound(rows[0]), last, count)
+
+        if len(self._pages) > self.window_pages:
+            _, _, count = self._pages.pop()
+            self._forget(self.tree.get_children()[-count:] if count else ())
+            # Відрізаний хвіст знову треба вибирати з БД
+            self._at_end = False
+            self._prefetched = None
+            self._want_next = False
+            if self._prefetch_task is not None:
+                self._prefetch_task.cancel()
+                self._prefetch_task = None
+        self._restore(anchor)
+
+    def _forget(self, iids):
+        self.tree.delete(*iids)
+        for iid in iids:
+            self._bounds.pop(iid, None)
+
+    def _precedes(self, a, b) -> bool:
+        """Межа a стоїть перед b у порядку query.sort (NULL — в кінці, як NULLS LAST)"""
+        for (_, _, desc, _), x, y in zip(self._query.sort, a, b):
+            if x == y:
+                continue
+            if x is None or y is None:
+                return y is None
+            try:
+                return (x > y) if desc else (x < y)
+            except TypeError:
+                return str(x) < str(y)
+        return False
+
+    def _insert_sorted(self, row):
+        """Вставити новий рядок на його місце у вікні; рядки поза межами вікна
+        не вставляються — їх вибере keyset-пагінація під час прокрутки"""
+        if not self._pages:
+            return
+        bound = self._bound(row)
+        if self._trimmed_top() and self._precedes(bound, self._pages[0][0]):
+            return
+        if not self._at_end and self._precedes(self._pages[-1][1], bound):
+            return
+        children = self.tree.get_children()
+        index = len(children)
+        for i, iid in enumerate(children):
+            other = self._bounds.get(iid)
+            if other is not None and self._precedes(bound, other):
+                index = i
+                break
+        iid = str(row[self._key])
+        self.tree.insert("", index, iid=iid, values=self._values(row))
+        self._bounds[iid] = bound
+        # Рядок належить сторінці, в межі якої потрапив його індекс
+        pos = index
+        for i, (first, last, count) in enumerate(self._pages):
+            if pos <= count or i == len(self._pages) - 1:
+                self._pages[i] = (first, last, count + 1)
+                break
+            pos -= count
+
+    def _select_pending(self):
+        if self._select_key is not None and self.tree.exists(self._select_key):
+            self.tree.selection_set(self._select_key)
+            self.tree.focus(self._select_key)
+            self.tree.see(self._select_key)
+            self._select_key = None
+
+    def _trimmed_top(self) -> bool:
+        """Вікно починається не з першої сторінки — зверху є відрізані рядки"""
+        return bool(self._pages) and self._pages[0][0] != self._first_key
+
+    def _on_yscroll(self, first, last):
+        self._v_scroll.set(first, last)
+        if not self._pages:
+            return
+        if float(last) >= 1.0 - EDGE:
+            self._fetch_forward()
+        elif float(first) <= EDGE and self._trimmed_top():
+            self._fetch_backward()
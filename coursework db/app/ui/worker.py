@@ -0,0 +1,141 @@
+# ui/worker.py
+import threading
+import tkinter as tk
+from tkinter import ttk
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+# Спільний пул потоків для роботи з БД: Tk-потік лише відображає результати
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db-worker")
+
+# Як часто Tk-потік перевіряє, чи завершився фоновий запит (мс)
+POLL_MS = 30
+
+
+class DbTask:
+    """Виконує fn() у фоновому потоці, а колбеки викликає в Tk-потоці через after()"""
+
+    def __init__(self, widget, db, fn, on_done=None, on_error=None, on_finish=None, busy=None):
+        self.widget = widget
+        self.db = db
+        self.cancelled = False
+        self._thread_id = None
+        # Поки cancel() тримає цей lock, потік не може завершити задачу і взяти наступну,
+        # тож скасування по thread id зачіпає лише запити цієї задачі
+        self._run_lock = threading.Lock()
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_finish = on_finish
+        self._busy = busy
+        # after() вішаємо на корінь: віджет може бути знищений раніше, ніж завершиться запит
+        self._root = widget._root()
+
+        if busy is not None:
+            busy.start(self)
+        self._future = _EXECUTOR.submit(self._call, fn)
+        self._root.after(POLL_MS, self._poll)
+
+    def _call(self, fn):
+        with self._run_lock:
+            if self.cancelled:
+                raise CancelledError()
+            self._thread_id = threading.get_ident()
+        try:
+            return fn()
+        finally:
+            with self._run_lock:
+                self._thread_id = None
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self):
+        """Скасувати задачу: ще не почата — знімається з черги, активний запит — connection.cancel()"""
+        if self.cancelled:
+            return
+        if self._future.cancel():
+            self.cancelled = True
+            return
+        with self._run_lock:
+            self.cancelled = True
+            # thread_id не None лише поки fn() цієї задачі ще виконується
+            if self._thread_id is not None:
+                self.db.cancel_thread(self._thread_id)
+
+    def _alive(self) -> bool:
+        try:
+            return bool(self.widget.winfo_exists())
+        except tk.TclError:
+            return False
+
+    def _poll(self):
+        if not self._alive():
+            self.cancel()
+            if self._busy is not None:
+                self._busy.stop(self)
+            return
+        if not self._future.done():
+            self._root.after(POLL_MS, self._poll)
+            return
+
+        if self._busy is not None:
+            self._busy.stop(self)
+        if self._on_finish:
+            self._on_finish()
+        if self.cancelled:
+            return
+
+        try:
+            result = self._future.result()
+        except Exception as e:
+            if self._on_error:
+                self._on_error(e)
+            else:
+                print(f"Background DB error: {e}")
+            return
+        if self._on_done:
+            self._on_done(result)
+
+
+class BusyIndicator(ttk.Frame):
+    """Індикатор виконання запиту з кнопкою скасування (показується лише під час роботи)"""
+
+    def __init__(self, master, text="⏳ Виконується запит..."):
+        super().__init__(master)
+        self._tasks = []
+        self._cursor = None
+
+        self._label = ttk.Label(self, text=text, foreground="gray")
+        self._bar = ttk.Progressbar(self, mode="indeterminate", length=80)
+        self._btn = ttk.Button(self, text="✖ Скасувати", command=self.cancel_all)
+
+    def start(self, task: DbTask):
+        self._tasks.append(task)
+        if len(self._tasks) > 1:
+            return
+        self._label.pack(side=tk.LEFT, padx=(0, 5))
+        self._bar.pack(side=tk.LEFT, padx=5)
+        self._btn.pack(side=tk.LEFT, padx=5)
+        self._bar.start(15)
+        try:
+            top = self.winfo_toplevel()
+            self._cursor = top.cget("cursor")
+            top.config(cursor="watch")
+        except tk.TclError:
+            pass
+
+    def stop(self, task: DbTask):
+        if task in self._tasks:
+            self._tasks.remove(task)
+        if self._tasks:
+            return
+        try:
+            self._bar.stop()
+            for w in (self._label, self._bar, self._btn):
+                w.pack_forget()
+            self.winfo_toplevel().config(cursor=self._cursor or "")
+        except tk.TclError:
+            pass
+
+    def cancel_all(self):
+        for task in list(self._tasks):
+            task.cancel()
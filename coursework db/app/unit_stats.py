@@ -0,0 +1,106 @@
+import threading
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Рівень -> (таблиця, колонка unit_hierarchy_path, підпис рівня)
+LEVELS = {
+    "army": ("armies", "army_id", "Армія"),
+    "corps": ("corps", "corps_id", "Корпус"),
+    "division": ("divisions", "division_id", "Дивізія"),
+    "brigade": ("brigades", "brigade_id", "Бригада"),
+}
+
+STATS_TABLES = ("unit_hierarchy_path", "military_units") + tuple(t for t, _, _ in LEVELS.values())
+
+
+def _counts_sql() -> str:
+    """Кількість частин для кожної армії, корпусу, дивізії і бригади за один прохід по unit_hierarchy_path.
+
+    Шлях частини зберігає всі рівні над нею, тож GROUPING SETS рахує кожну частину рівно один раз
+    на рівень (без множення рядків дивізії × бригади); LEFT JOIN з таблицями рівнів додає нулі."""
+    sets = ", ".join(f"({col})" for _, col, _ in LEVELS.values())
+    kind = "CASE " + " ".join(f"WHEN GROUPING({col}) = 0 THEN '{level}'" for level, (_, col, _) in LEVELS.items()) + " END"
+    node = "COALESCE(" + ", ".join(col for _, col, _ in LEVELS.values()) + ")"
+    parts = [f"SELECT '{level}' AS level, t.id, t.number, t.name, COALESCE(c.units, 0) AS units "
+             f"FROM {table} t LEFT JOIN counts c ON c.level = '{level}' AND c.node_id = t.id"
+             for level, (table, _, _) in LEVELS.items()]
+    return (f"WITH counts AS (SELECT {kind} AS level, {node} AS node_id, COUNT(*) AS units "
+            f"FROM unit_hierarchy_path GROUP BY GROUPING SETS ({sets})) "
+            + " UNION ALL ".join(parts))
+
+
+COUNTS_SQL = _counts_sql()
+
+
+class UnitStats:
+    """Статистика кількості частин по арміях, корпусах, дивізіях і бригадах.
+
+    Усі рівні рахуються одним запитом і зберігаються як відсортовані рейтинги, тож
+    "найбільше", "найменше" і top-N для будь-якого рівня відповідають без повторного
+    запиту до БД. Рейтинги скидаються, щойно Database повідомляє про запис у STATS_TABLES."""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        # level -> [(id, підпис, кількість частин)] за спаданням кількості
+        self._rankings: Optional[Dict[str, List[Tuple[int, str, int]]]] = None
+        self._version = 0
+        db.add_invalidation_listener(self.invalidate)
+
+    @staticmethod
+    def _label(level: str, number, name) -> str:
+        return f"{LEVELS[level][2]} {number} — {name or ''}".strip(" — ")
+
+    def rankings(self) -> Dict[str, List[Tuple[int, str, int]]]:
+        with self._lock:
+            if self._rankings is not None:
+                return self._rankings
+            version = self._version
+
+        result = {level: [] for level in LEVELS}
+        for r in self.db.query_cached(COUNTS_SQL, tables=STATS_TABLES):
+            result[r["level"]].append((r["id"], self._label(r["level"], r["number"], r["name"]), int(r["units"])))
+        for items in result.values():
+            items.sort(key=lambda item: (-item[2], item[1]))
+
+        with self._lock:
+            if version == self._version:
+                self._rankings = result
+        return result
+
+    def ranking(self, level: str) -> List[Tuple[int, str, int]]:
+        if level not in LEVELS:
+            raise ValueError(f"Невідомий рівень: {level}")
+        return self.rankings()[level]
+
+    def top(self, level: str, n: int, fewest: bool = False) -> List[Tuple[int, str, int]]:
+        """Перші n за кількістю частин (fewest=True — з найменшою кількістю)"""
+        items = self.ranking(level)
+        if fewest:
+            items = sorted(items, key=lambda item: (item[2], item[1]))
+        return items[:max(int(n), 0)]
+
+    def extreme(self, level: str, fewest: bool = False) -> List[Tuple[int, str, int]]:
+        """Усі з найбільшою (fewest=True — найменшою) кількістю частин, включно з рівними"""
+        items = self.ranking(level)
+        if not items:
+            return []
+        target = items[-1][2] if fewest else items[0][2]
+        return [item for item in items if item[2] == target]
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None):
+        with self._lock:
+            if tables is None or set(tables) & set(STATS_TABLES):
+                self._version += 1
+                self._rankings = None
+
+
+_SHARED = weakref.WeakKeyDictionary()
+
+
+def unit_stats(db) -> UnitStats:
+    """Єдиний UnitStats для з'єднання db"""
+    stats = _SHARED.get(db)
+    if stats is None:
+        stats = _SHARED[db] = UnitStats(db)
+    return stats
@@ -3,7 +3,17 @@
 -- =====================================================
 
 -- 1. CLEANUP
+DROP TABLE IF EXISTS search_entries CASCADE;
+DROP TABLE IF EXISTS unit_hierarchy_path CASCADE;
+DROP TABLE IF EXISTS equipment_counts CASCADE;
+DROP TABLE IF EXISTS weapon_counts CASCADE;
+DROP TABLE IF EXISTS personnel_counts CASCADE;
+DROP SEQUENCE IF EXISTS equipment_counts_refreshed CASCADE;
+DROP SEQUENCE IF EXISTS weapon_counts_refreshed CASCADE;
+DROP SEQUENCE IF EXISTS personnel_counts_refreshed CASCADE;
+DROP TABLE IF EXISTS aggregate_refresh CASCADE;
 DROP TABLE IF EXISTS artillery_attributes CASCADE;
+DROP TABLE IF EXISTS weapon_attributes CASCADE;
 DROP TABLE IF EXISTS vehicle_attributes CASCADE;
 DROP TABLE IF EXISTS facilities CASCADE;
 DROP TABLE IF EXISTS requests CASCADE;
@@ -322,6 +332,271 @@ CREATE TRIGGER chk_platoon_cmd BEFORE INSERT OR UPDATE ON platoons FOR EACH ROW
 CREATE TRIGGER chk_company_cmd BEFORE INSERT OR UPDATE ON companies FOR EACH ROW EXECUTE FUNCTION check_commander_rank();
 CREATE TRIGGER chk_unit_cmd BEFORE INSERT OR UPDATE ON military_units FOR EACH ROW EXECUTE FUNCTION check_commander_rank();
 
+-- Row change notifications (LISTEN row_changes): {"table": ..., "op": ..., "id": ...}
+-- TG_ARGV[0] - key column name (default 'id')
+CREATE OR REPLACE FUNCTION notify_row_change() RETURNS TRIGGER AS $$
+DECLARE
+    key_col TEXT := COALESCE(TG_ARGV[0], 'id');
+    row_data JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN row_data := to_jsonb(OLD); ELSE row_data := to_jsonb(NEW); END IF;
+    PERFORM pg_notify('row_changes', json_build_object(
+        'table', TG_TABLE_NAME, 'op', TG_OP, 'id', row_data -> key_col)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_military_districts AFTER INSERT OR UPDATE OR DELETE ON military_districts FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_armies AFTER INSERT OR UPDATE OR DELETE ON armies FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_corps AFTER INSERT OR UPDATE OR DELETE ON corps FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_divisions AFTER INSERT OR UPDATE OR DELETE ON divisions FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_brigades AFTER INSERT OR UPDATE OR DELETE ON brigades FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_military_units AFTER INSERT OR UPDATE OR DELETE ON military_units FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_companies AFTER INSERT OR UPDATE OR DELETE ON companies FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_platoons AFTER INSERT OR UPDATE OR DELETE ON platoons FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_squads AFTER INSERT OR UPDATE OR DELETE ON squads FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_military_personnel AFTER INSERT OR UPDATE OR DELETE ON military_personnel FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_equipment AFTER INSERT OR UPDATE OR DELETE ON equipment FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_weapons AFTER INSERT OR UPDATE OR DELETE ON weapons FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_ranks AFTER INSERT OR UPDATE OR DELETE ON ranks FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_specialties AFTER INSERT OR UPDATE OR DELETE ON specialties FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_locations AFTER INSERT OR UPDATE OR DELETE ON locations FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_equipment_types AFTER INSERT OR UPDATE OR DELETE ON equipment_types FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_weapon_types AFTER INSERT OR UPDATE OR DELETE ON weapon_types FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_facilities AFTER INSERT OR UPDATE OR DELETE ON facilities FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_vehicle_attributes AFTER INSERT OR UPDATE OR DELETE ON vehicle_attributes FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_weapon_attributes AFTER INSERT OR UPDATE OR DELETE ON weapon_attributes FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_personnel_specialties AFTER INSERT OR UPDATE OR DELETE ON personnel_specialties FOR EACH ROW EXECUTE FUNCTION notify_row_change();
+CREATE TRIGGER notify_generals_info AFTER INSERT OR UPDATE OR DELETE ON generals_info FOR EACH ROW EXECUTE FUNCTION notify_row_change('personnel_id');
+
+-- Global search index (omnibox): one row per searchable record, maintained by triggers
+CREATE TABLE search_entries (
+    entity_type VARCHAR(50) NOT NULL,
+    entity_id INT NOT NULL,
+    label TEXT NOT NULL,
+    search_text TEXT NOT NULL,
+    PRIMARY KEY (entity_type, entity_id)
+);
+-- trigram GIN index on search_text is created by the app (SearchIndex) when pg_trgm is available
+
+CREATE OR REPLACE FUNCTION sync_search_entry() RETURNS TRIGGER AS $$
+DECLARE
+    txt TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM search_entries WHERE entity_type = TG_TABLE_NAME AND entity_id = OLD.id;
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'military_units' THEN
+        txt := concat_ws(' ', NEW.number, NEW.name);
+    ELSIF TG_TABLE_NAME = 'military_personnel' THEN
+        txt := concat_ws(' ', NEW.last_name, NEW.first_name, NEW.middle_name);
+    ELSIF TG_TABLE_NAME = 'equipment' THEN
+        txt := concat_ws(' ', NEW.serial_number, NEW.model);
+    ELSIF TG_TABLE_NAME = 'weapons' THEN
+        txt := concat_ws(' ', NEW.serial_number, NEW.model, NEW.caliber);
+    ELSIF TG_TABLE_NAME = 'facilities' THEN
+        txt := concat_ws(' ', NEW.name, NEW.type, NEW.address);
+    END IF;
+
+    INSERT INTO search_entries (entity_type, entity_id, label, search_text)
+    VALUES (TG_TABLE_NAME, NEW.id, txt, lower(txt))
+    ON CONFLICT (entity_type, entity_id) DO UPDATE SET label = EXCLUDED.label, search_text = EXCLUDED.search_text;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER search_military_units AFTER INSERT OR UPDATE OR DELETE ON military_units FOR EACH ROW EXECUTE FUNCTION sync_search_entry();
+CREATE TRIGGER search_military_personnel AFTER INSERT OR UPDATE OR DELETE ON military_personnel FOR EACH ROW EXECUTE FUNCTION sync_search_entry();
+CREATE TRIGGER search_equipment AFTER INSERT OR UPDATE OR DELETE ON equipment FOR EACH ROW EXECUTE FUNCTION sync_search_entry();
+CREATE TRIGGER search_weapons AFTER INSERT OR UPDATE OR DELETE ON weapons FOR EACH ROW EXECUTE FUNCTION sync_search_entry();
+CREATE TRIGGER search_facilities AFTER INSERT OR UPDATE OR DELETE ON facilities FOR EACH ROW EXECUTE FUNCTION sync_search_entry();
+
+-- Denormalized unit -> division/brigade -> corps -> army -> district path for report joins.
+-- Replaces LEFT JOIN divisions/brigades + corps ON COALESCE(d.corps_id, b.corps_id) with one indexed join
+CREATE TABLE unit_hierarchy_path (
+    unit_id INT PRIMARY KEY REFERENCES military_units(id) ON DELETE CASCADE,
+    division_id INT,
+    brigade_id INT,
+    corps_id INT,
+    army_id INT,
+    district_id INT
+);
+CREATE INDEX idx_unit_path_corps ON unit_hierarchy_path (corps_id, unit_id);
+CREATE INDEX idx_unit_path_army ON unit_hierarchy_path (army_id, unit_id);
+CREATE INDEX idx_unit_path_district ON unit_hierarchy_path (district_id, unit_id);
+
+-- Recompute paths of the given units (NULL - all units)
+CREATE OR REPLACE FUNCTION unit_path_rebuild(p_unit_ids INT[]) RETURNS VOID AS $$
+    INSERT INTO unit_hierarchy_path (unit_id, division_id, brigade_id, corps_id, army_id, district_id)
+    SELECT mu.id, mu.division_id, mu.brigade_id, c.id, a.id, a.military_district_id
+    FROM military_units mu
+             LEFT JOIN divisions d ON mu.division_id = d.id
+             LEFT JOIN brigades b ON mu.brigade_id = b.id
+             LEFT JOIN corps c ON c.id = COALESCE(d.corps_id, b.corps_id)
+             LEFT JOIN armies a ON a.id = c.army_id
+    WHERE p_unit_ids IS NULL OR mu.id = ANY(p_unit_ids)
+    ON CONFLICT (unit_id) DO UPDATE SET
+        division_id = EXCLUDED.division_id, brigade_id = EXCLUDED.brigade_id, corps_id = EXCLUDED.corps_id,
+        army_id = EXCLUDED.army_id, district_id = EXCLUDED.district_id;
+$$ LANGUAGE sql;
+
+-- Keeps unit_hierarchy_path in sync when a unit or any level above it is re-parented
+-- (unit deletes are handled by ON DELETE CASCADE)
+CREATE OR REPLACE FUNCTION sync_unit_path() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'military_units' THEN
+        PERFORM unit_path_rebuild(ARRAY[NEW.id]);
+    ELSIF TG_TABLE_NAME = 'divisions' THEN
+        PERFORM unit_path_rebuild(ARRAY(SELECT id FROM military_units WHERE division_id = NEW.id));
+    ELSIF TG_TABLE_NAME = 'brigades' THEN
+        PERFORM unit_path_rebuild(ARRAY(SELECT id FROM military_units WHERE brigade_id = NEW.id));
+    ELSIF TG_TABLE_NAME = 'corps' THEN
+        UPDATE unit_hierarchy_path p SET army_id = NEW.army_id, district_id = a.military_district_id
+        FROM armies a WHERE a.id = NEW.army_id AND p.corps_id = NEW.id;
+    ELSIF TG_TABLE_NAME = 'armies' THEN
+        UPDATE unit_hierarchy_path SET district_id = NEW.military_district_id WHERE army_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER path_military_units AFTER INSERT OR UPDATE OF division_id, brigade_id ON military_units FOR EACH ROW EXECUTE FUNCTION sync_unit_path();
+CREATE TRIGGER path_divisions AFTER UPDATE OF corps_id ON divisions FOR EACH ROW EXECUTE FUNCTION sync_unit_path();
+CREATE TRIGGER path_brigades AFTER UPDATE OF corps_id ON brigades FOR EACH ROW EXECUTE FUNCTION sync_unit_path();
+CREATE TRIGGER path_corps AFTER UPDATE OF army_id ON corps FOR EACH ROW EXECUTE FUNCTION sync_unit_path();
+CREATE TRIGGER path_armies AFTER UPDATE OF military_district_id ON armies FOR EACH ROW EXECUTE FUNCTION sync_unit_path();
+
+-- Materialized report aggregates: quantity per unit x type, kept current by statement-level
+-- triggers on equipment / weapons (one upsert per statement, so bulk loads stay cheap).
+-- Category comes from the type, corps/army/district rollups join unit_hierarchy_path.
+-- No FK to military_units: a unit delete cascades to equipment/weapons and their triggers zero the counts.
+CREATE TABLE equipment_counts (
+    military_unit_id INT NOT NULL,
+    equipment_type_id INT NOT NULL,
+    qty INT NOT NULL,
+    PRIMARY KEY (military_unit_id, equipment_type_id)
+);
+
+CREATE TABLE weapon_counts (
+    military_unit_id INT NOT NULL,
+    weapon_type_id INT NOT NULL,
+    qty INT NOT NULL,
+    PRIMARY KEY (military_unit_id, weapon_type_id)
+);
+
+-- Personnel per unit x company/platoon/squad (0 = not assigned) x rank; category comes from the rank
+CREATE TABLE personnel_counts (
+    military_unit_id INT NOT NULL,
+    company_id INT NOT NULL,
+    platoon_id INT NOT NULL,
+    squad_id INT NOT NULL,
+    rank_id INT NOT NULL,
+    qty INT NOT NULL,
+    PRIMARY KEY (military_unit_id, company_id, platoon_id, squad_id, rank_id)
+);
+
+-- Last refresh time per aggregate table (shown next to report results).
+-- Kept in a sequence (epoch ms) rather than a table row: setval takes no row lock,
+-- so concurrent writers to equipment / weapons do not queue behind one hot row.
+CREATE SEQUENCE equipment_counts_refreshed;
+CREATE SEQUENCE weapon_counts_refreshed;
+CREATE SEQUENCE personnel_counts_refreshed;
+CREATE VIEW aggregate_refresh AS
+SELECT 'equipment_counts'::VARCHAR(100) AS name, to_timestamp(last_value / 1000.0) AS refreshed_at
+FROM equipment_counts_refreshed
+UNION ALL
+SELECT 'weapon_counts', to_timestamp(last_value / 1000.0) FROM weapon_counts_refreshed
+UNION ALL
+SELECT 'personnel_counts', to_timestamp(last_value / 1000.0) FROM personnel_counts_refreshed;
+
+-- Stamp the refresh time at most once per transaction (transaction-local setting as the marker)
+CREATE OR REPLACE FUNCTION stamp_aggregate(agg TEXT) RETURNS VOID AS $$
+BEGIN
+    IF COALESCE(current_setting('aggregate_stamp.' || agg, true), '') = '' THEN
+        EXECUTE format('SELECT setval(%L, GREATEST(last_value, %s)) FROM %I',
+                       agg || '_refreshed', (extract(epoch FROM clock_timestamp()) * 1000)::BIGINT, agg || '_refreshed');
+        PERFORM set_config('aggregate_stamp.' || agg, 'done', true);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV: aggregate table, then its key columns after military_unit_id (NULL keys are stored as 0)
+CREATE OR REPLACE FUNCTION apply_unit_counts() RETURNS TRIGGER AS $$
+DECLARE
+    cols TEXT[] := ARRAY['military_unit_id'] || TG_ARGV[1:TG_NARGS - 1];
+    keys TEXT;
+    names TEXT;
+    matches TEXT;
+    deltas TEXT;
+BEGIN
+    SELECT string_agg(format('COALESCE(%I, 0) AS %1$I', c), ', '),
+           string_agg(format('%I', c), ', '),
+           string_agg(format('c.%1$I = d.%1$I', c), ' AND ')
+    INTO keys, names, matches
+    FROM unnest(cols) AS c;
+    -- Transition tables exist only for their own event, so the delta source depends on TG_OP
+    deltas := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT %s, 1 AS delta FROM new_rows', keys)
+        WHEN 'DELETE' THEN format('SELECT %s, -1 AS delta FROM old_rows', keys)
+        ELSE format('SELECT %1$s, 1 AS delta FROM new_rows UNION ALL SELECT %1$s, -1 FROM old_rows', keys)
+    END;
+    EXECUTE format(
+        'INSERT INTO %1$I AS c (%2$s, qty) '
+        'SELECT %2$s, SUM(delta) FROM (%3$s) d GROUP BY %2$s HAVING SUM(delta) <> 0 '
+        'ON CONFLICT (%2$s) DO UPDATE SET qty = c.qty + EXCLUDED.qty',
+        TG_ARGV[0], names, deltas);
+    -- Only keys touched by this statement can have dropped to zero
+    EXECUTE format(
+        'DELETE FROM %1$I c USING (SELECT DISTINCT %2$s FROM (%3$s) d) d WHERE %4$s AND c.qty <= 0',
+        TG_ARGV[0], names, deltas, matches);
+    PERFORM stamp_aggregate(TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Full recompute (initial load or repair)
+CREATE OR REPLACE FUNCTION rebuild_unit_counts() RETURNS VOID AS $$
+    DELETE FROM equipment_counts;
+    INSERT INTO equipment_counts (military_unit_id, equipment_type_id, qty)
+    SELECT military_unit_id, equipment_type_id, COUNT(*) FROM equipment GROUP BY 1, 2;
+    DELETE FROM weapon_counts;
+    INSERT INTO weapon_counts (military_unit_id, weapon_type_id, qty)
+    SELECT military_unit_id, weapon_type_id, COUNT(*) FROM weapons GROUP BY 1, 2;
+    DELETE FROM personnel_counts;
+    INSERT INTO personnel_counts (military_unit_id, company_id, platoon_id, squad_id, rank_id, qty)
+    SELECT military_unit_id, COALESCE(company_id, 0), COALESCE(platoon_id, 0), COALESCE(squad_id, 0), rank_id, COUNT(*)
+    FROM military_personnel GROUP BY 1, 2, 3, 4, 5;
+    SELECT stamp_aggregate('equipment_counts');
+    SELECT stamp_aggregate('weapon_counts');
+    SELECT stamp_aggregate('personnel_counts');
+$$ LANGUAGE sql;
+CREATE TRIGGER counts_equipment_insert AFTER INSERT ON equipment REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('equipment_counts', 'equipment_type_id');
+CREATE TRIGGER counts_equipment_update AFTER UPDATE ON equipment REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('equipment_counts', 'equipment_type_id');
+CREATE TRIGGER counts_equipment_delete AFTER DELETE ON equipment REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('equipment_counts', 'equipment_type_id');
+CREATE TRIGGER counts_weapons_insert AFTER INSERT ON weapons REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('weapon_counts', 'weapon_type_id');
+CREATE TRIGGER counts_weapons_update AFTER UPDATE ON weapons REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('weapon_counts', 'weapon_type_id');
+CREATE TRIGGER counts_weapons_delete AFTER DELETE ON weapons REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('weapon_counts', 'weapon_type_id');
+CREATE TRIGGER counts_personnel_insert AFTER INSERT ON military_personnel REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('personnel_counts', 'company_id', 'platoon_id', 'squad_id', 'rank_id');
+CREATE TRIGGER counts_personnel_update AFTER UPDATE ON military_personnel REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('personnel_counts', 'company_id', 'platoon_id', 'squad_id', 'rank_id');
+CREATE TRIGGER counts_personnel_delete AFTER DELETE ON military_personnel REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_unit_counts('personnel_counts', 'company_id', 'platoon_id', 'squad_id', 'rank_id');
+
+-- Indexes for server-side sorting / filtering of CRUD grids: (sort column, id) matches
+-- ORDER BY col, id and the keyset bound (col, id) > (%s, %s) of the next page
+CREATE INDEX idx_armies_number ON armies (number, id);
+CREATE INDEX idx_corps_number ON corps (number, id);
+CREATE INDEX idx_divisions_number ON divisions (number, id);
+CREATE INDEX idx_brigades_number ON brigades (number, id);
+CREATE INDEX idx_personnel_last_name ON military_personnel (last_name, id);
+CREATE INDEX idx_personnel_rank ON military_personnel (rank_id, id);
+CREATE INDEX idx_personnel_unit ON military_personnel (military_unit_id, id);
+CREATE INDEX idx_equipment_model ON equipment (model, id);
+CREATE INDEX idx_equipment_unit ON equipment (military_unit_id, id);
+CREATE INDEX idx_weapons_model ON weapons (model, id);
+CREATE INDEX idx_weapons_unit ON weapons (military_unit_id, id);
+CREATE INDEX idx_facilities_name ON facilities (name, id);
+
 -- =====================================================
 -- 9. SEED DATA (Test Data)
 -- =====================================================
@@ -391,4 +666,8 @@ INSERT INTO weapons (weapon_type_id, model, serial_number, caliber, military_uni
 
 -- 9.9 Infrastructure
 INSERT INTO facilities (name, type, address, military_unit_id, location_id) VALUES
-('Казарма №1', 'Barracks', 'вул. Полкова, 5', 1, 2);
\ No newline at end of file
+('Казарма №1', 'Barracks', 'вул. Полкова, 5', 1, 2);
+
+-- 9.10 Derived tables: unit paths and report aggregates (triggers keep them current; rebuild covers rows loaded without triggers)
+SELECT unit_path_rebuild(NULL);
+SELECT rebuild_unit_counts();
\ No newline at end of file